@@ -0,0 +1,82 @@
+# coding: utf-8
+
+"""
+Compares dump codecs by size of dumped record and dump throughput.
+
+    $ python -m benchmarks.dump_codecs [--url redis://localhost:6379/15]
+
+Without `--url` records are written to `fakeredis`, so throughput shows
+encoding and client overhead only. The target db is flushed.
+"""
+
+from __future__ import print_function
+
+import time
+import uuid
+import argparse
+
+import redis
+
+from core import dump
+
+
+def make_task(args_size):
+    return dump.Task(str(uuid.uuid4()), 'core.tasks.process_event', [],
+                     dict(user_id='4F8B2C', seq_id=str(uuid.uuid4()),
+                          device_type=1, event_type='activities',
+                          processing_timestamp='2015-08-01T10:00:00',
+                          payload='x' * args_size),
+                     'ProcessingRetryLimitException(60)')
+
+
+def record_size(client, key):
+    try:
+        return client.memory_usage(key)
+    except (AttributeError, redis.ResponseError):
+        return sum(len(k) + len(v) for k, v in client.hgetall(key).items())
+
+
+def run(client, name, codec, records, batch):
+    client.flushdb()
+    redis_dump = dump.RedisDump(client, 'tasks', 'tasks:all', codec=codec)
+    tasks = [make_task(records['args_size']) for _ in range(records['n'])]
+
+    started = time.time()
+    for i in range(0, len(tasks), batch):
+        redis_dump.dump_many(tasks[i:i + batch])
+    elapsed = time.time() - started
+
+    size = record_size(client, 'tasks:{}'.format(tasks[0].id))
+    print('{:<24} {:>10} {:>14.0f}'.format(name, size, len(tasks) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', help='redis url, fakeredis if omitted')
+    parser.add_argument('-n', type=int, default=10000,
+                        help='number of records')
+    parser.add_argument('--batch', type=int, default=1,
+                        help='records per dump_many call')
+    parser.add_argument('--args-size', type=int, default=2048,
+                        help='size of payload in task kwargs, bytes')
+    opts = parser.parse_args()
+
+    if opts.url:
+        client = redis.StrictRedis.from_url(opts.url)
+    else:
+        import fakeredis
+        client = fakeredis.FakeStrictRedis()
+
+    records = dict(n=opts.n, args_size=opts.args_size)
+    codecs = [('json', dump.JsonCodec())]
+    if dump.msgpack is not None:
+        codecs += [('msgpack', dump.MsgpackCodec(compress_threshold=0)),
+                   ('msgpack+zlib', dump.MsgpackCodec())]
+
+    print('{:<24} {:>10} {:>14}'.format('codec', 'bytes/rec', 'records/s'))
+    for name, codec in codecs:
+        run(client, name, codec, records, opts.batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# coding: utf-8
+
+"""
+Drives `core.tasks.process_event` (or `BaseProcessing.process` with
+`--entry processing`) end to end for every processing class and reports
+events/s, latency percentiles, SQL queries per event and memory blocks
+retained per event.
+
+    $ python -m benchmarks.process_event [-n 500] [--latency 20]
+        [--auth-url postgresql+pg8000://...] [--history-url ...]
+
+Vendor APIs are replaced with fake sessions answering after `--latency`
+ms, redis with `fakeredis`, broker and notifications with kombu's memory
+transport. Auth and history dbs are SQLite files in a temporary directory
+unless urls are given. Tables of given dbs are dropped and re-created.
+
+History records are upserted with `ON CONFLICT`, which SQLite (3.24+)
+runs as well.
+
+Retained blocks per event are memory blocks still allocated after a
+separate run of `--trace-events` events traced by `tracemalloc`, so they
+show growth of caches and leaks, not allocation rate. Tracing requires
+python 3.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import itertools
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+USERS = 100
+
+
+class FakeResponse(object):
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode('utf-8')
+        self.text = self.content.decode('utf-8')
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession(object):
+    """
+    Stand-in of `requests.Session` of vendor host answering every request
+    with the same body after `latency` seconds.
+    """
+
+    def __init__(self, latency, jitter=0.0, size=512):
+        """
+        :param latency: seconds every request takes
+        :param jitter: max random deviation of latency, fraction of it
+        :param size: approximate size of response body, bytes
+        """
+        self._latency = latency
+        self._jitter = jitter
+        self._body = dict(summary=[dict(steps=1000, calories=200)],
+                          padding='x' * size)
+
+    def request(self, method, url, **kwargs):
+        latency = self._latency * (1 + random.uniform(-self._jitter,
+                                                      self._jitter))
+        if latency > 0:
+            time.sleep(latency)
+        return FakeResponse(self._body)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        pass
+
+
+def setup_env(auth_url, history_url):
+    """
+    Points config to local stand-ins. Has to run before `core.app` is
+    imported.
+    """
+    os.environ.update(CELERY_BROKER_URL='memory://',
+                      CELERY_RESULT_URL='cache+memory://',
+                      NOTIFICATION_URL='memory://',
+                      # memory transport has no headers exchanges
+                      NOTIFICATION_EXCHANGE_TYPE='direct',
+                      AUTH_DB_URL=auth_url,
+                      HISTORY_DB_URL=history_url)
+
+
+def setup_sqlite():
+    import types
+
+    from sqlalchemy.schema import ColumnDefault
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.dialects.postgresql import JSONB
+    from sqlalchemy.dialects.postgresql.base import PGCompiler
+    from sqlalchemy.dialects.postgresql.dml import OnConflictDoUpdate
+
+    from core import db
+
+    @compiles(JSONB, 'sqlite')
+    def compile_jsonb(type_, compiler, **kw):
+        return 'JSON'
+
+    def function(method):
+        # unbound methods of python 2 refuse instances of other classes
+        return getattr(method, '__func__', method)
+
+    @compiles(OnConflictDoUpdate, 'sqlite')
+    def compile_on_conflict(clause, compiler, **kw):
+        # SQLite understands ON CONFLICT of PostgreSQL
+        compiler._on_conflict_target = types.MethodType(
+            function(PGCompiler._on_conflict_target), compiler)
+        return function(PGCompiler.visit_on_conflict_do_update)(
+            compiler, clause, **kw)
+
+    # SQLite has no sequences
+    ids = itertools.count(1)
+    ColumnDefault(lambda: next(ids))._set_parent(
+        db.HistoricalData.__table__.c.historical_data_id)
+
+
+def setup_app():
+    import fakeredis
+    import redis
+
+    from core import app
+
+    server = fakeredis.FakeServer()
+    app.resources.register('redis_pool', lambda: redis.ConnectionPool(
+        connection_class=fakeredis.FakeConnection, server=server))
+    return app
+
+
+def setup_dbs(app):
+    from core import db
+    from core.db import partitions
+
+    auth_db, history_db = app.resources.auth_db, app.resources.history_db
+    db.AuthModel.metadata.drop_all(auth_db)
+    db.AuthModel.metadata.create_all(auth_db)
+    db.HistoryModel.metadata.drop_all(history_db)
+    db.HistoryModel.metadata.create_all(history_db)
+    if history_db.dialect.name == 'postgresql':
+        with history_db.begin() as connection:
+            partitions.create_partitions(connection, months_ahead=0)
+
+    session = app.AuthSession()
+    for user_id in users():
+        session.add(db.UserConnection(user_id, 'token', 'secret', 'key',
+                                      'key-secret'))
+        session.add(db.HumanApiConnection(human_id=user_id,
+                                          access_token='token'))
+    session.commit()
+    session = app.HistorySession()
+    session.add(db.EventType(1, 'raw'))
+    session.commit()
+
+
+def setup_vendors(latency, jitter):
+    import moves
+    from fitbit.api import FitbitOauthClient
+    from humanapi.api import ROOT
+
+    from core.processing import vendor_clients
+
+    clients = vendor_clients()
+    for url in (FitbitOauthClient.API_ENDPOINT, moves.MovesClient.api_url,
+                ROOT):
+        clients.mount(url, FakeSession(latency, jitter))
+
+
+def users():
+    return ['bench-{}'.format(i) for i in range(USERS)]
+
+
+class QueryCounter(object):
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted `values`.
+    """
+    if not values:
+        return float('nan')
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def make_entry(name):
+    from core.tasks import process_event
+    from core.processing import TimedProcessingRequest, create_processing
+
+    def task(user_id, device_type, event_type):
+        result = process_event.apply(kwargs=dict(
+            user_id=user_id, seq_id=str(uuid.uuid4()),
+            device_type=device_type, event_type=event_type,
+            processing_timestamp=datetime.datetime.now().isoformat()))
+        if result.failed():
+            raise result.result
+
+    def processing(user_id, device_type, event_type):
+        request = TimedProcessingRequest(user_id, str(uuid.uuid4()),
+                                         device_type, event_type,
+                                         datetime.datetime.now())
+        with create_processing(request) as p:
+            p.process()
+
+    return dict(task=task, processing=processing)[name]
+
+
+def run(entry, device_type, event_type, n):
+    """
+    :return: tuple of sorted latencies, seconds, total seconds and number
+      of errors
+    """
+    latencies, errors = [], 0
+    user_ids = itertools.cycle(users())
+    started = timer()
+    for _ in range(n):
+        event_started = timer()
+        try:
+            entry(next(user_ids), device_type, event_type)
+        except Exception:
+            errors += 1
+        latencies.append(timer() - event_started)
+    return sorted(latencies), timer() - started, errors
+
+
+def retained_blocks(entry, device_type, event_type, n):
+    if tracemalloc is None or not n:
+        return float('nan')
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        run(entry, device_type, event_type, n)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    return sum(s.count_diff for s in after.compare_to(before, 'filename')) \
+        / float(n)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', type=int, default=500,
+                        help='number of events per processing class')
+    parser.add_argument('--entry', choices=('task', 'processing'),
+                        default='task')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='latency of vendor API, ms')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='max deviation of latency, fraction of it')
+    parser.add_argument('--auth-url', help='auth db url, SQLite if omitted')
+    parser.add_argument('--history-url',
+                        help='history db url, SQLite if omitted')
+    parser.add_argument('--trace-events', type=int, default=100,
+                        help='number of events traced for retained blocks')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='number of events run before measuring')
+    opts = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench-')
+    try:
+        setup_env(opts.auth_url or 'sqlite:///{}/auth.db'.format(tmp),
+                  opts.history_url or 'sqlite:///{}/history.db'.format(tmp))
+        setup_sqlite()
+        app = setup_app()
+        setup_dbs(app)
+        setup_vendors(opts.latency / 1000.0, opts.jitter)
+
+        from core.processing import device_event_processing_mapping
+
+        entry = make_entry(opts.entry)
+        queries = QueryCounter(app.resources.auth_db,
+                               app.resources.history_db)
+        print('{:<36} {:>9} {:>8} {:>8} {:>8} {:>9} {:>7} {:>9}'.format(
+            'processing', 'events/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'queries', 'errors', 'retained'))
+        for (device_type, event_type), cls in sorted(
+                device_event_processing_mapping.items(),
+                key=lambda item: item[1].__name__):
+            run(entry, device_type, event_type, opts.warmup)
+            queries.count = 0
+            latencies, elapsed, errors = run(entry, device_type, event_type,
+                                             opts.n)
+            per_event = queries.count / float(opts.n)
+            retained = retained_blocks(entry, device_type, event_type,
+                                       opts.trace_events)
+            print('{:<36} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.2f} '
+                  '{:>7} {:>9.1f}'.format(
+                      cls.__name__, opts.n / elapsed,
+                      percentile(latencies, 50) * 1000,
+                      percentile(latencies, 95) * 1000,
+                      percentile(latencies, 99) * 1000,
+                      per_event, errors, retained))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
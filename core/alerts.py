@@ -0,0 +1,139 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import re
+import hashlib
+import collections
+
+from core.notify import SystemEvent
+
+__all__ = ('AlertAggregator', 'AlertDigest', 'AlertConfig', 'normalize')
+
+AlertConfig = collections.namedtuple('AlertConfig', 'window samples')
+
+_PATTERNS = (
+    (re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                r'[0-9a-f]{12}', re.I), '<uuid>'),
+    (re.compile(r'\b0x[0-9a-f]+\b', re.I), '<hex>'),
+    (re.compile(r'\b[0-9a-f]{16,}\b', re.I), '<hex>'),
+    (re.compile(r"'[^']*'"), "'<str>'"),
+    (re.compile(r'"[^"]*"'), '"<str>"'),
+    (re.compile(r'\d+(\.\d+)?'), '<n>'),
+    (re.compile(r'\s+'), ' '),
+)
+MAX_PATTERN_LENGTH = 200
+
+
+def normalize(message):
+    """
+    Replaces variable parts of message (ids, numbers, quoted values) with
+    placeholders, so messages of the same error share a pattern.
+    """
+    pattern = message or ''
+    for regexp, placeholder in _PATTERNS:
+        pattern = regexp.sub(placeholder, pattern)
+    return pattern.strip()[:MAX_PATTERN_LENGTH]
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class AlertDigest(collections.namedtuple('AlertDigest', [
+        'type', 'pattern', 'count', 'first_seen', 'last_seen', 'samples'])):
+    """
+    Summary of system events of the same type and pattern collected during
+    single window.
+
+    :param samples: first messages of the window as is
+    """
+    __slots__ = ()
+    FORMAT = ('{d.count} event(s) from {d.first_seen} to {d.last_seen}: '
+              '{d.pattern}')
+
+    def event(self, id):
+        """
+        :return: Instance of `core.notify.SystemEvent` to be sent, the only
+          message as is if window collected single event
+        """
+        if self.count == 1 and self.samples:
+            return SystemEvent(id, self.last_seen, self.type, self.samples[0])
+        message = '\n'.join([self.FORMAT.format(d=self), 'Samples:'] +
+                            ['* {}'.format(s) for s in self.samples])
+        return SystemEvent(id, self.last_seen, self.type, message)
+
+
+class AlertAggregator(object):
+    """
+    Redis-based aggregation of system events by type and normalized
+    message, shared by all workers.
+
+    First event of a key opens a window, the following ones are only
+    counted. Whoever opened the window has to `take` digest once window
+    passed and send only it.
+    """
+
+    def __init__(self, redis, window, samples=5, prefix='alerts'):
+        """
+        :param redis: Instance of `redis.StrictRedis`
+        :param window: seconds events are collected for
+        :param samples: max number of messages kept as is per window
+        :param prefix: prefix of keys
+        """
+        self._redis = redis
+        self._window = window
+        self._samples = samples
+        self._prefix = prefix
+
+    @property
+    def window(self):
+        return self._window
+
+    def add(self, event):
+        """
+        Counts event in window of its key.
+        :param event: Instance of `core.notify.SystemEvent`
+        :return: `True` if event opened new window
+        """
+        pattern = normalize(event.message)
+        key, samples_key = self._keys(event.type, pattern)
+        # outlives window in case scheduled digest is late
+        ttl = int(self._window * 10) + 60
+        pipe = self._redis.pipeline()
+        pipe.hincrby(key, 'count', 1)
+        pipe.hsetnx(key, 'first_seen', event.time)
+        pipe.hset(key, 'last_seen', event.time)
+        pipe.hsetnx(key, 'pattern', pattern)
+        pipe.rpush(samples_key, event.message)
+        pipe.ltrim(samples_key, 0, self._samples - 1)
+        pipe.expire(key, ttl)
+        pipe.expire(samples_key, ttl)
+        return pipe.execute()[0] == 1
+
+    def take(self, type, message):
+        """
+        Pops digest of the key of `type` and `message` and closes its
+        window.
+        :return: Instance of `AlertDigest` or `None` if nothing is collected
+        """
+        key, samples_key = self._keys(type, normalize(message))
+        pipe = self._redis.pipeline()
+        pipe.hgetall(key)
+        pipe.lrange(samples_key, 0, -1)
+        pipe.delete(key, samples_key)
+        window, samples, _ = pipe.execute()
+        if not window:
+            return None
+
+        window = {_decode(k): _decode(v) for k, v in window.items()}
+        return AlertDigest(type, window.get('pattern'),
+                           int(window.get('count', 1)),
+                           window.get('first_seen'), window.get('last_seen'),
+                           [_decode(s) for s in samples])
+
+    def _keys(self, type, pattern):
+        digest = hashlib.sha1(u'{}\n{}'.format(type, pattern)
+                              .encode('utf-8')).hexdigest()
+        key = '{}:{}'.format(self._prefix, digest)
+        return key, '{}:samples'.format(key)
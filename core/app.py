@@ -1,44 +1,185 @@
 # coding: utf-8
 
+import uuid
+import functools
+
 from celery import Celery
 
 from core import db
 from core import dump
+from core import green
 from core import notify
+from core import utils
+from core import alerts
+from core import metrics
+from core import coalesce
+from core import ratelimit
+from core.resources import Resources
 from core.config import load_config
 
-__all__ = ('app', 'task_dump', 'user_event_notifier', 'AuthSession',
-           'HistorySession')
+__all__ = ('app', 'task_dump', 'task_store', 'user_event_notifier',
+           'AuthSession', 'HistorySession', 'history_writer',
+           'user_connection_cache', 'human_connection_cache', 'rate_limits',
+           'event_coalescer', 'alert_aggregator', 'vendor_limiter',
+           'redis_client', 'notify_dump', 'system_event_notifier',
+           'resources', 'metrics_sink')
 
 config = load_config()
 
 app = Celery('core')
 app.config_from_object(config.celery)
 
-_redis_pool = dump.create_redis_pool(config.dump)
-_amqp_pool = notify.create_amqp_pool(config.rabbitmq)
-_aws_session = notify.create_aws_session(config.aws)
-auth_db = db.create_engine(config.auth_db)
-history_db = db.create_engine(config.history_db)
-
-AuthSession = db.create_session(auth_db)
-HistorySession = db.create_session(history_db)
+if green.is_patched():
+    green.patch_psycopg()
+
+
+def _create_engine(db_config):
+    engine = db.create_engine(db_config)
+    # statements are counted only if someone reads the numbers
+    if config.query_log.enabled:
+        db.instrument_engine(engine, slow=config.query_log.slow)
+    elif config.metrics.sink:
+        db.instrument_engine(engine)
+    return engine
+
+
+def _create_engines(configs):
+    return [_create_engine(c) for c in configs]
+
+
+# nothing connects at import: worker's parent process never uses these,
+# every child creates its own ones
+resources = Resources()
+resources.register('redis_pool', functools.partial(dump.create_redis_pool,
+                                                   config.dump))
+resources.register('amqp_pool', functools.partial(notify.create_amqp_pool,
+                                                  config.rabbitmq))
+resources.register('aws_session', functools.partial(
+    notify.create_aws_session, config.aws))
+resources.register('auth_db', functools.partial(_create_engine,
+                                                config.auth_db))
+resources.register('auth_db_replicas', functools.partial(
+    _create_engines, [config.auth_db._replace(url=url)
+                      for url in config.auth_db_replicas.urls]))
+resources.register('history_db', functools.partial(_create_engine,
+                                                   config.history_db))
+
+if config.auth_db_replicas.urls:
+    # auth traffic is almost all reads of connections
+    AuthSession = db.create_routing_session(
+        functools.partial(resources.get, 'auth_db'),
+        db.ReplicaSet(functools.partial(resources.get, 'auth_db_replicas'),
+                      config.auth_db_replicas.strategy),
+        sticky=config.auth_db_replicas.sticky)
+else:
+    AuthSession = db.create_session(functools.partial(resources.get,
+                                                      'auth_db'))
+HistorySession = db.create_session(functools.partial(resources.get,
+                                                     'history_db'))
+
+vendor_limiter = green.ConcurrencyLimiter(config.vendor_concurrency)
+
+user_connection_cache = db.RowCache(db.UserConnection, 'user_id',
+                                    *config.connection_cache)
+human_connection_cache = db.RowCache(db.HumanApiConnection, 'human_id',
+                                     *config.connection_cache)
+
+
+@utils.process_local
+def redis_client():
+    """
+    Returns client of dump redis shared by all redis-based components of
+    the process.
+    """
+    return dump.create_redis(resources.redis_pool)
+
+
+def _redis_dump(prefix, set_key, indexed=()):
+    if config.dump.backend == 'stream':
+        return dump.RedisStreamDump(redis_client(),
+                                    '{}:stream'.format(prefix),
+                                    codec=dump.create_codec(config.dump),
+                                    maxlen=config.dump.stream_maxlen)
+    if config.dump.backend != 'hash':
+        raise ValueError("Unknown dump backend '{}'"
+                         .format(config.dump.backend))
+    return dump.RedisDump(redis_client(), prefix=prefix,
+                          set_key=set_key,
+                          codec=dump.create_codec(config.dump),
+                          ttl=config.dump.ttl,
+                          retention=config.dump.retention,
+                          indexed=indexed)
+
+
+@utils.process_local
+def _redis_task_dump():
+    return _redis_dump('tasks', 'tasks:all',
+                       indexed=('name', 'exception_type'))
 
 
 # TODO(ak): consider factory
-def task_dump(pool=_redis_pool):
-    return dump.RedisDump(dump.create_redis(pool), prefix='tasks',
-                          set_key='tasks:all')
+def task_dump():
+    if config.dump.batch_enabled:
+        return buffered_task_dump()
+    return _redis_task_dump()
+
+
+@utils.process_local
+def buffered_task_dump():
+    return dump.BufferedDump(_redis_task_dump(),
+                             size=config.dump.batch_size,
+                             interval=config.dump.batch_interval,
+                             maxsize=config.dump.batch_maxsize)
+
+
+def task_store():
+    """
+    Returns unbuffered task dump to query and remove dumped tasks.
+    """
+    return _redis_task_dump()
+
+
+@utils.process_local
+def notify_dump():
+    return _redis_dump('notification', 'notification:all')
 
 
-def notify_dump(pool=_redis_pool):
-    return dump.RedisDump(dump.create_redis(pool), prefix='notification',
-                          set_key='notification:all')
+@utils.process_local
+def metrics_sink():
+    """
+    Returns `core.metrics.Sink` of the process, `core.metrics.NullSink` if
+    metrics are disabled.
+    """
+    return metrics.create_sink(config.metrics)
+
+
+@utils.process_local
+def rate_limits():
+    return ratelimit.RateLimitRegistry(redis_client())
+
+
+@utils.process_local
+def event_coalescer():
+    return coalesce.EventCoalescer(redis_client(), config.coalesce.window)
+
+
+@utils.process_local
+def alert_aggregator():
+    return alerts.AlertAggregator(redis_client(), config.alerts.window,
+                                  samples=config.alerts.samples)
 
 
 # TODO(ak): consider factory
-def user_event_notifier(pool=_amqp_pool):
-    return notify.RabbitMQEventNotifier(pool, config.rabbitmq.routing_key,
+def user_event_notifier():
+    if config.rabbitmq_batch.enabled:
+        return batched_user_event_notifier()
+    return _rabbitmq_user_event_notifier()
+
+
+@utils.process_local
+def _rabbitmq_user_event_notifier():
+    return notify.RabbitMQEventNotifier(resources.amqp_pool,
+                                        config.rabbitmq.routing_key,
                                         notify.create_exchange(
                                             config.rabbitmq.exchange,
                                             config.rabbitmq.exchange_type),
@@ -47,11 +188,54 @@ def user_event_notifier(pool=_amqp_pool):
                                         ))
 
 
-def system_event_notifier(session=_aws_session):
-    return notify.EmailEventNotifier(notify.create_sns(session),
-                                     topic=config.sns.topic,
-                                     subject=config.sns.subject,
-                                     message_type=config.sns.message_type)
+@utils.process_local
+def batched_user_event_notifier():
+    batch = config.rabbitmq_batch
+    return notify.BatchedRabbitMQEventNotifier(
+        notify.create_amqp_connection(config.rabbitmq),
+        config.rabbitmq.routing_key,
+        notify.create_exchange(config.rabbitmq.exchange,
+                               config.rabbitmq.exchange_type),
+        dict(type=config.rabbitmq.message_type),
+        size=batch.size, interval=batch.interval, maxsize=batch.maxsize,
+        on_failure=_dump_unpublished, confirm=batch.confirm)
+
+
+def _dump_unpublished(events, exc):
+    """
+    Dumps events which weren't published as failed tasks re-sending them,
+    so `core.replay` publishes them once broker is back.
+    """
+    failed = task_dump()
+    for event in events:
+        failed.dump(dump.Task(str(uuid.uuid4()),
+                              'core.tasks.notify_user_event',
+                              [event.body, event.priority], {}, exc))
+
+
+@utils.process_local
+def history_writer():
+    return db.HistoryWriter(HistorySession.session_factory,
+                            size=config.history_batch.size,
+                            interval=config.history_batch.interval,
+                            timeout=config.history_batch.timeout)
+
+
+@utils.process_local
+def system_event_notifier():
+    """
+    Returns `core.notify.AsyncEventNotifier` if SNS messages are sent
+    asynchronously, `core.notify.EmailEventNotifier` otherwise.
+    """
+    # boto3 clients are thread-safe but expensive to create
+    sns = notify.create_sns(resources.aws_session)
+    notifier = notify.EmailEventNotifier(sns,
+                                         topic=config.sns.topic,
+                                         subject=config.sns.subject,
+                                         message_type=config.sns.message_type)
+    if config.sns.async_workers:
+        return notify.AsyncEventNotifier(notifier, config.sns.async_workers)
+    return notifier
 
 
 if __name__ == '__main__':
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import collections
+
+__all__ = ('EventCoalescer', 'PendingEvent', 'CoalesceConfig')
+
+CoalesceConfig = collections.namedtuple('CoalesceConfig', 'window')
+PendingEvent = collections.namedtuple('PendingEvent', [
+    'sequence_id', 'processing_timestamp', 'merged'])
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class EventCoalescer(object):
+    """
+    Redis-based debounce of events with the same user, device and event
+    type.
+
+    First event of a key opens a window, the following ones only replace
+    pending sequence id. Whoever opened the window has to `take` pending
+    event once window passed and process only it.
+    """
+
+    def __init__(self, redis, window, prefix='coalesce'):
+        """
+        :param redis: Instance of `redis.StrictRedis`
+        :param window: seconds events are collected for
+        :param prefix: prefix of keys
+        """
+        self._redis = redis
+        self._window = window
+        self._prefix = prefix
+        self._stats_key = '{}:merged'.format(prefix)
+
+    @property
+    def window(self):
+        return self._window
+
+    def offer(self, user_id, device_type, event_type, sequence_id,
+              processing_timestamp=None):
+        """
+        Makes event the pending one of its key.
+        :return: `True` if event opened new window
+        """
+        pipe = self._redis.pipeline()
+        key = self._key(user_id, device_type, event_type)
+        pipe.hmset(key, dict(sequence_id=sequence_id,
+                             processing_timestamp=processing_timestamp or ''))
+        pipe.hincrby(key, 'count', 1)
+        # outlives window in case scheduled flush is late
+        pipe.expire(key, int(self._window * 10) + 60)
+        _, count, _ = pipe.execute()
+        return count == 1
+
+    def take(self, user_id, device_type, event_type):
+        """
+        Pops pending event of the key and closes its window.
+        :return: Instance of `PendingEvent` or `None` if nothing is pending
+        """
+        pipe = self._redis.pipeline()
+        key = self._key(user_id, device_type, event_type)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        pending, _ = pipe.execute()
+        if not pending:
+            return None
+
+        pending = {_decode(k): _decode(v) for k, v in pending.items()}
+        merged = int(pending.get('count', 1)) - 1
+        if merged:
+            self._redis.hincrby(self._stats_key,
+                                '{}:{}'.format(device_type, event_type),
+                                merged)
+        return PendingEvent(pending.get('sequence_id'),
+                            pending.get('processing_timestamp') or None,
+                            merged)
+
+    def merged(self):
+        """
+        :return: dict of numbers of merged events by `device:event` type
+        """
+        return {_decode(k): int(v) for k, v in
+                self._redis.hgetall(self._stats_key).items()}
+
+    def _key(self, user_id, device_type, event_type):
+        return '{}:{}:{}:{}'.format(self._prefix, device_type, event_type,
+                                    user_id)
@@ -8,7 +8,14 @@ except ImportError:
 
 __all__ = ('create_engine', 'create_session', 'AuthModel', 'HistoryModel',
            'HistoricalData', 'UserConnection', 'NotFoundException',
-           'CustomQuery', 'DatabaseConfig', 'EventType', 'HumanApiConnection')
+           'CustomQuery', 'DatabaseConfig', 'EventType', 'HumanApiConnection',
+           'HistoryRecord', 'HistoryWriter', 'HistoryBatchConfig',
+           'upsert_historical_data', 'LookupCache', 'RowCache',
+           'RowCacheConfig', 'lookup', 'lookup_cache', 'invalidate_lookups',
+           'LazyBindSession', 'ReplicaConfig', 'ReplicaSet', 'RoutingSession',
+           'create_routing_session', 'QueryStats', 'QueryLogConfig',
+           'SlowQuery', 'count_queries', 'start_counting', 'stop_counting',
+           'instrument_engine', 'redact')
 
 from core.db.base import (
     create_engine,
@@ -16,14 +23,45 @@ from core.db.base import (
     DatabaseConfig,
     AuthModel,
     HistoryModel,
-    CustomQuery
+    CustomQuery,
+    LazyBindSession
+)
+from core.db.routing import (
+    ReplicaConfig,
+    ReplicaSet,
+    RoutingSession,
+    create_routing_session
+)
+from core.db.instrument import (
+    QueryStats,
+    QueryLogConfig,
+    SlowQuery,
+    count_queries,
+    start_counting,
+    stop_counting,
+    instrument_engine,
+    redact
 )
 from core.db.exc import (
     NotFoundException
 )
+from core.db.cache import (
+    LookupCache,
+    RowCache,
+    RowCacheConfig,
+    lookup,
+    lookup_cache,
+    invalidate_lookups
+)
 from core.db.models import (
     EventType,
     HistoricalData,
     UserConnection,
     HumanApiConnection
 )
+from core.db.batch import (
+    HistoryRecord,
+    HistoryWriter,
+    HistoryBatchConfig,
+    upsert_historical_data
+)
@@ -4,13 +4,16 @@ import sqlalchemy
 import collections
 
 from sqlalchemy.orm import Query
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
+from sqlalchemy.engine.url import make_url
 from core.db.exc import NotFoundException
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
 
 __all__ = ('create_engine', 'create_session', 'DatabaseConfig',
-           'AuthModel', 'HistoryModel', 'CustomQuery')
+           'AuthModel', 'HistoryModel', 'CustomQuery', 'LazyBindSession')
 
 AuthModel = declarative_base()
 HistoryModel = declarative_base()
@@ -20,23 +23,83 @@ def create_engine(config):
     """
     :config should be config instance: of `config.DatabaseConfig`
     :return: Instance of `sqlalchemy.Engine`
+
+    Options not supported by driver or pool of `config.url` are ignored,
+    e.g. pool options of sqlite.
     """
-    return sqlalchemy.create_engine(config.url)
+    url = make_url(config.url)
+    dialect = url.get_dialect()
+    kwargs = {}
+    if issubclass(dialect.get_pool_class(url), sqlalchemy.pool.QueuePool):
+        kwargs.update(pool_size=config.pool_size,
+                      max_overflow=config.max_overflow,
+                      pool_timeout=config.pool_timeout)
+    if config.pool_recycle:
+        kwargs['pool_recycle'] = config.pool_recycle
+    if config.pool_pre_ping:
+        kwargs['pool_pre_ping'] = True
+    if config.use_batch_mode and issubclass(dialect, PGDialect_psycopg2):
+        # pg8000 always prepares statements and reuses them per connection,
+        # psycopg2 needs executemany to be batched instead
+        kwargs['use_batch_mode'] = True
+    return sqlalchemy.create_engine(url, **kwargs)
 
 
 def create_session(bind):
     """
     Returns scoped `sqlalchemy.Session` factory
+
+    :param bind: Instance of `sqlalchemy.Engine` or callable returning it,
+      which is called when session needs connection
     """
+    if callable(bind):
+        return scoped_session(sessionmaker(class_=LazyBindSession,
+                                           engine=bind,
+                                           query_cls=CustomQuery))
     return scoped_session(sessionmaker(bind=bind, query_cls=CustomQuery))
 
 
-class DatabaseConfig(collections.namedtuple('DatabaseConfig', ['url'])):
+class LazyBindSession(Session):
+    """
+    Session which gets its engine from `engine` callable only when it needs
+    connection, so engines may be created lazily.
+    """
+
+    def __init__(self, engine=None, **kwargs):
+        """
+        :param engine: callable returning `sqlalchemy.Engine`
+        """
+        self._engine = engine
+        super(LazyBindSession, self).__init__(**kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.bind is None and self._engine is not None:
+            return self._engine()
+        return super(LazyBindSession, self).get_bind(mapper, clause)
+
+
+class DatabaseConfig(collections.namedtuple('DatabaseConfig', [
+        'url', 'pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle',
+        'pool_pre_ping', 'use_batch_mode'])):
     """
     :param url: `sqlalchemy` connection url
+    :param pool_size: number of connections kept open
+    :param max_overflow: number of connections opened above `pool_size`
+      under load
+    :param pool_timeout: seconds to wait for free connection
+    :param pool_recycle: seconds connection is reused for, 0 means forever
+    :param pool_pre_ping: whether connection is checked before it's used
+    :param use_batch_mode: whether psycopg2 sends executemany in batches
     """
     __slots__ = ()
 
+    def __new__(cls, url, pool_size=5, max_overflow=10, pool_timeout=30,
+                pool_recycle=0, pool_pre_ping=False, use_batch_mode=False):
+        return super(DatabaseConfig, cls).__new__(cls, url, pool_size,
+                                                  max_overflow, pool_timeout,
+                                                  pool_recycle, pool_pre_ping,
+                                                  use_batch_mode)
+
 
 class CustomQuery(Query):
     """
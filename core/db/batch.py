@@ -0,0 +1,143 @@
+# coding: utf-8
+
+import datetime
+import collections
+from concurrent.futures import Future
+
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+
+from core.utils import Batcher
+from core.db.cache import lookup
+from core.db.models import EventType
+from core.db.models import HistoricalData
+from core.db.models import historical_data_daily_key
+
+__all__ = ('HistoryRecord', 'HistoryWriter', 'HistoryBatchConfig',
+           'upsert_historical_data')
+
+HistoryBatchConfig = collections.namedtuple('HistoryBatchConfig',
+                                            'enabled size interval timeout')
+
+
+class HistoryRecord(collections.namedtuple('HistoryRecord', [
+        'sequence_id', 'user_id', 'device_type_id', 'real_event_type_name',
+        'event'])):
+    """
+    Processing result to be saved to `historical_data`.
+    """
+    __slots__ = ()
+
+    @property
+    def daily_key(self):
+        return self.user_id, self.device_type_id, self.real_event_type_name
+
+
+def upsert_historical_data(session, records):
+    """
+    Saves `records` with single `INSERT ... ON CONFLICT DO UPDATE`.
+
+    Today's record with the same daily key gets its `event` replaced, so
+    only the latest of `records` sharing a key is written.
+
+    :param session: `sqlalchemy.Session` bound to history db
+    :param records: iterable of `HistoryRecord`
+    :return: list of flags, in order of `records`, whether record is saved
+      as the first one of its day, i.e. is inserted rather than replaces
+      the existing one
+    """
+    records = list(records)
+    latest = collections.OrderedDict()
+    for i, record in enumerate(records):
+        latest.pop(record.daily_key, None)
+        latest[record.daily_key] = i
+    if not latest:
+        return []
+
+    event_type = lookup(session, EventType, 'raw')
+    now = datetime.datetime.utcnow()
+    table = HistoricalData.__table__
+
+    stmt = insert(table).values([dict(
+        sequence_id=r.sequence_id,
+        user_id=r.user_id,
+        device_type_id=r.device_type_id,
+        real_event_type_name=r.real_event_type_name,
+        event=r.event,
+        event_type_id=event_type.id,
+        datetime=now,
+        day=now.date()
+    ) for r in (records[i] for i in latest.values())])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(historical_data_daily_key.expressions),
+        set_=dict(event=stmt.excluded.event,
+                  datetime=stmt.excluded.datetime)
+    ).returning(table.c.user_id, table.c.device_type_id,
+                table.c.real_event_type_name,
+                # xmax of updated row is id of the updating transaction
+                literal_column('xmax = 0'))
+    inserted = {tuple(row[:3]) for row in session.execute(stmt) if row[3]}
+    return [latest[r.daily_key] == i and r.daily_key in inserted
+            for i, r in enumerate(records)]
+
+
+class HistoryWriter(object):
+    """
+    Buffers `HistoryRecord`s of many processings and writes them with
+    `upsert_historical_data` in one transaction per batch.
+
+    Every submitted record gets a future which is resolved when its batch
+    is committed or failed, so caller can fail (and retry) its task. Its
+    result tells whether record is the first one of its day, see
+    `upsert_historical_data`.
+    """
+
+    def __init__(self, session_factory, size=100, interval=0.05,
+                 timeout=30):
+        """
+        :param session_factory: `sqlalchemy.orm.sessionmaker` of history db.
+          Batches are written from background thread, so scoped session
+          must not be used here
+        :param size: max number of records written at once
+        :param interval: max seconds record waits for its batch
+        :param timeout: seconds `write` waits for the batch to be written
+        """
+        self._session_factory = session_factory
+        self._timeout = timeout
+        self._batcher = Batcher(self._write, size=size, interval=interval,
+                                name='history-writer')
+
+    def submit(self, record):
+        """
+        :param record: Instance of `HistoryRecord`
+        :return: `concurrent.futures.Future` resolved once record is saved
+        """
+        future = Future()
+        self._batcher.put((record, future))
+        return future
+
+    def write(self, record):
+        """
+        Submits `record` and blocks until it is saved.
+        :return: whether record is the first one of its day
+        :raises: exception the batch failed with
+        """
+        return self.submit(record).result(self._timeout)
+
+    def close(self):
+        self._batcher.close()
+
+    def _write(self, items):
+        session = self._session_factory()
+        try:
+            created = upsert_historical_data(session, (r for r, _ in items))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for _, future in items:
+                future.set_exception(e)
+        else:
+            for (_, future), first in zip(items, created):
+                future.set_result(first)
+        finally:
+            session.close()
@@ -0,0 +1,229 @@
+# coding: utf-8
+
+import time
+import threading
+import collections
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from core.db.exc import NotFoundException
+
+__all__ = ('LookupCache', 'RowCache', 'RowCacheConfig', 'lookup',
+           'lookup_cache', 'invalidate_lookups')
+
+DEFAULT_LOOKUP_TTL = 600
+
+RowCacheConfig = collections.namedtuple('RowCacheConfig', 'maxsize ttl')
+
+
+def snapshot(obj):
+    """
+    Returns dict of column attributes of mapped `obj`.
+    """
+    return {attr.key: getattr(obj, attr.key)
+            for attr in inspect(obj).mapper.column_attrs}
+
+
+def restore(session, model, values):
+    """
+    Builds instance of `model` from `snapshot` and attaches it to `session`
+    as persistent one without emitting SELECT.
+    """
+    obj = inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(obj, key, value)
+    make_transient_to_detached(obj)
+    return session.merge(obj, load=False)
+
+
+class LookupCache(object):
+    """
+    Process-wide cache of rows of small static lookup table.
+
+    All rows are loaded at once on first use and reloaded after `ttl`
+    seconds or explicit `invalidate`. Rows are kept as plain column values,
+    so no instance is shared between sessions or threads: `get` returns
+    instance attached to the passed session.
+    """
+
+    def __init__(self, model, key='name', ttl=DEFAULT_LOOKUP_TTL):
+        """
+        :param model: mapped class of lookup table
+        :param key: name of column attribute rows are looked up by
+        :param ttl: seconds, `None` means rows never expire
+        """
+        self._model = model
+        self._key = key
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = None
+        self._loaded_at = None
+
+    def get(self, session, value):
+        """
+        :param session: `sqlalchemy.Session` used if rows have to be loaded
+          and to attach returned instance to
+        :param value: value of `key` column
+        :return: Instance of `model`
+        :raises: `NotFoundException` if no row found
+        """
+        try:
+            values = self._load(session)[value]
+        except KeyError:
+            raise NotFoundException
+        return restore(session, self._model, values)
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+
+    def _load(self, session):
+        with self._lock:
+            if self._rows is None or self._expired:
+                self._rows = {getattr(obj, self._key): snapshot(obj)
+                              for obj in session.query(self._model)}
+                self._loaded_at = time.time()
+            return self._rows
+
+    @property
+    def _expired(self):
+        return (self._ttl is not None and
+                time.time() - self._loaded_at > self._ttl)
+
+
+class RowCache(object):
+    """
+    Process-wide bounded LRU cache of rows of `model` by unique `key` with
+    short TTL.
+
+    Like `LookupCache` it keeps plain column values and returns instances
+    attached to the passed session. Writes of cached columns have to be
+    propagated with `update` to stay visible for other tasks of the
+    process.
+    """
+
+    def __init__(self, model, key, maxsize=1024, ttl=30):
+        """
+        :param model: mapped class
+        :param key: name of column attribute rows are looked up by
+        :param maxsize: max number of cached rows
+        :param ttl: seconds row is cached for, 0 disables caching
+        """
+        self._model = model
+        self._key = key
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = collections.OrderedDict()
+
+    def get(self, session, value):
+        """
+        :param session: `sqlalchemy.Session` used on cache miss and to
+          attach returned instance to
+        :param value: value of `key` column
+        :return: Instance of `model`
+        :raises: `NotFoundException` if no row found
+        """
+        values = self._get(value)
+        if values is not None:
+            return restore(session, self._model, values)
+
+        obj = session.query(self._model).filter(
+            getattr(self._model, self._key) == value
+        ).first_or_raise()
+        self.put(obj)
+        return obj
+
+    def prefetch(self, session, values):
+        """
+        Loads rows with `key` in `values` with single query and caches them.
+        :return: list of loaded instances
+        """
+        values = set(values)
+        if not values:
+            return []
+        objs = session.query(self._model).filter(
+            getattr(self._model, self._key).in_(values)
+        ).all()
+        for obj in objs:
+            self.put(obj)
+        return objs
+
+    def put(self, obj):
+        if not self._ttl:
+            return
+        with self._lock:
+            value = getattr(obj, self._key)
+            self._rows.pop(value, None)
+            self._rows[value] = (time.time() + self._ttl, snapshot(obj))
+            while len(self._rows) > self._maxsize:
+                self._rows.popitem(last=False)
+
+    def update(self, value, **values):
+        """
+        Writes `values` through to cached row with `key` equal to `value`.
+        """
+        with self._lock:
+            try:
+                self._rows[value][1].update(values)
+            except KeyError:
+                pass
+
+    def invalidate(self, value=None):
+        """
+        Drops row with `key` equal to `value` or all rows if it is `None`.
+        """
+        with self._lock:
+            if value is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(value, None)
+
+    def _get(self, value):
+        with self._lock:
+            try:
+                expires, values = self._rows[value]
+            except KeyError:
+                return None
+            if expires < time.time():
+                del self._rows[value]
+                return None
+            # move to the end as recently used
+            del self._rows[value]
+            self._rows[value] = (expires, values)
+            return dict(values)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def lookup_cache(model, key='name', ttl=DEFAULT_LOOKUP_TTL):
+    """
+    Returns process-wide `LookupCache` of `model` by `key`. `ttl` is only
+    used when cache is created.
+    """
+    with _caches_lock:
+        try:
+            return _caches[(model, key)]
+        except KeyError:
+            cache = _caches[(model, key)] = LookupCache(model, key, ttl)
+            return cache
+
+
+def lookup(session, model, value, key='name'):
+    """
+    Shortcut for `lookup_cache(model, key).get(session, value)`.
+    """
+    return lookup_cache(model, key).get(session, value)
+
+
+def invalidate_lookups():
+    """
+    Drops rows of all lookup caches.
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.invalidate()
@@ -0,0 +1,183 @@
+# coding: utf-8
+
+"""
+Counting of statements executed by engines, per block of code.
+
+    instrument_engine(engine, slow=0.5)
+    with count_queries() as stats:
+        session.query(...).all()
+    stats.count, stats.time, stats.slow
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+import datetime
+import threading
+import contextlib
+import collections
+
+from sqlalchemy import event
+
+__all__ = ('QueryStats', 'QueryLogConfig', 'SlowQuery', 'count_queries',
+           'start_counting', 'stop_counting', 'instrument_engine', 'redact')
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+QueryLogConfig = collections.namedtuple('QueryLogConfig', 'enabled slow')
+
+SlowQuery = collections.namedtuple('SlowQuery', 'statement parameters time')
+
+#: max number of slow statements kept by `QueryStats`
+MAX_SLOW = 10
+
+
+class QueryStats(object):
+    """
+    Number and total seconds of statements executed in `count_queries`
+    block, slow ones of them and, if asked, numbers of executions of every
+    statement.
+    """
+    __slots__ = ('count', 'time', 'slow', 'statements')
+
+    def __init__(self, by_statement=False):
+        self.count = 0
+        self.time = 0.0
+        self.slow = []
+        self.statements = collections.Counter() if by_statement else None
+
+    def most_repeated(self):
+        """
+        :return: tuple of statement executed most times and the number of
+          times, `(None, 0)` if statements are not counted
+        """
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+    def __repr__(self):
+        return 'QueryStats(count={}, time={:.4f}, slow={})'.format(
+            self.count, self.time, len(self.slow))
+
+
+def _active():
+    try:
+        return _local.stats
+    except AttributeError:
+        _local.stats = []
+        return _local.stats
+
+
+def start_counting(by_statement=False):
+    """
+    Starts counting statements executed by instrumented engines in current
+    thread (or greenlet, when patched) until `stop_counting`.
+
+    :param by_statement: whether executions of every statement are counted
+    :return: Instance of `QueryStats`
+    """
+    stats = QueryStats(by_statement)
+    _active().append(stats)
+    return stats
+
+
+def stop_counting(stats):
+    try:
+        _active().remove(stats)
+    except ValueError:
+        pass
+
+
+@contextlib.contextmanager
+def count_queries(by_statement=False):
+    """
+    Counts statements within the block, see `start_counting`. Blocks may be
+    nested, every one of them counts its statements.
+
+    :return: context manager yielding `QueryStats`
+    """
+    stats = start_counting(by_statement)
+    try:
+        yield stats
+    finally:
+        stop_counting(stats)
+
+
+def _redact_value(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (datetime.date, datetime.time)):
+        return '<{}>'.format(type(value).__name__)
+    try:
+        size = len(value)
+    except TypeError:
+        return '<{}>'.format(type(value).__name__)
+    return '<{} of {}>'.format(type(value).__name__, size)
+
+
+def redact(parameters, executemany=False):
+    """
+    Replaces values of statement parameters with their types, so slow
+    statements can be logged without tokens and users' data.
+
+    :param executemany: whether `parameters` is a list of parameter sets
+    """
+    if executemany:
+        if not parameters:
+            return []
+        # sets of executemany share their shape
+        return [redact(parameters[0]), '... {} set(s)'.format(
+            len(parameters))]
+    if isinstance(parameters, dict):
+        return dict((k, _redact_value(v)) for k, v in parameters.items())
+    if isinstance(parameters, (list, tuple)):
+        return [_redact_value(v) for v in parameters]
+    return _redact_value(parameters)
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    context._query_started = time.time()
+
+
+def _after_execute(slow, conn, cursor, statement, parameters, context,
+                   executemany):
+    active = _active()
+    elapsed = time.time() - context._query_started
+    query = None
+    if slow is not None and elapsed >= slow:
+        query = SlowQuery(statement, redact(parameters, executemany),
+                          elapsed)
+        logger.warning('Slow statement ({:.1f} ms): {} {}'.format(
+            elapsed * 1000, statement, query.parameters))
+    for stats in active:
+        stats.count += 1
+        stats.time += elapsed
+        if stats.statements is not None:
+            stats.statements[statement] += 1
+        if query is not None and len(stats.slow) < MAX_SLOW:
+            stats.slow.append(query)
+
+
+def instrument_engine(engine, slow=None):
+    """
+    Makes statements of `engine` counted by `count_queries`.
+
+    :param engine: Instance of `sqlalchemy.Engine`
+    :param slow: seconds statement is logged and kept as slow after,
+      `None` to not look for slow statements
+    :return: the same engine
+    """
+    if getattr(engine, '_instrumented', False):
+        return engine
+    engine._instrumented = True
+    event.listen(engine, 'before_cursor_execute', _before_execute)
+
+    def after_execute(*args):
+        _after_execute(slow, *args)
+
+    event.listen(engine, 'after_cursor_execute', after_execute)
+    return engine
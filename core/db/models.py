@@ -5,6 +5,8 @@ import datetime
 
 from sqlalchemy import (
     Column,
+    Date,
+    Index,
     Integer,
     String,
     Sequence,
@@ -19,9 +21,10 @@ from core.db import AuthModel
 from core.db import HistoryModel
 
 __all__ = ('UserConnection', 'HumanApiConnection',
-           'EventType', 'HistoricalData')
+           'EventType', 'HistoricalData', 'historical_data_daily_key')
 
 current_datetime = lambda: datetime.datetime.utcnow()
+current_date = lambda: datetime.datetime.utcnow().date()
 
 
 class UserConnection(AuthModel):
@@ -86,12 +89,18 @@ class EventType(HistoryModel):
 
 
 class HistoricalData(HistoryModel):
+    """
+    Table is range-partitioned by `day` a month per partition, see
+    `core.db.partitions`. Partition key has to be a part of primary key and
+    of every unique index.
+    """
     __tablename__ = 'historical_data'
     __table_args__ = (
         PrimaryKeyConstraint(name='historical_data_pkey'),
         ForeignKeyConstraint(['event_type_id'],
                              ['lookup_event_type.event_type_id'],
-                             name='event_type_FK')
+                             name='event_type_FK'),
+        {'postgresql_partition_by': 'RANGE (day)'}
     )
 
     id = Column('historical_data_id', Integer,
@@ -105,9 +114,14 @@ class HistoricalData(HistoryModel):
     event_type_id = Column(Integer, nullable=False)
     event_time = Column('datetime', DateTime, default=current_datetime,
                         onupdate=current_datetime)
+    #: utc date of `event_time`
+    day = Column(Date, primary_key=True, default=current_date)
 
     event_type = relationship('EventType')
 
+    # sequence makes id unique on its own
+    __mapper_args__ = {'primary_key': [id]}
+
     def __init__(self, sequence_id, user_id, device_type_id,
                  real_event_type_name, event_type, event):
         self.sequence_id = sequence_id
@@ -124,3 +138,13 @@ class HistoricalData(HistoryModel):
                 "device_type_id='{.device_type_id}', "
                 "event_type_id='{.event_type_id}', "
                 "event_type_name='{.real_event_type_name}')>".format(self))
+
+
+# one record per user, device and event type a day; serves per-event
+# lookups and is used as `ON CONFLICT` target by history writes
+historical_data_daily_key = Index('historical_data_daily_key',
+                                  HistoricalData.user_id,
+                                  HistoricalData.device_type_id,
+                                  HistoricalData.real_event_type_name,
+                                  HistoricalData.day,
+                                  unique=True)
@@ -0,0 +1,239 @@
+# coding: utf-8
+
+"""
+Maintenance of monthly range partitions of `historical_data`.
+
+    $ python -m core.db.partitions --ahead 2 --keep 12
+
+Creates partitions of the current and `--ahead` next months and detaches
+(or drops with `--drop`) the ones older than `--keep` months. Has to run
+at least monthly, e.g. daily by cron: rows of a day without partition
+can't be inserted.
+
+    $ python -m core.db.partitions --migrate
+
+Converts `historical_data` created before partitioning once, see
+`migrate`, and does nothing if it's partitioned already.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+import logging
+import argparse
+import datetime
+
+from sqlalchemy import text
+
+from core.db.models import HistoricalData
+from core.db.models import historical_data_daily_key
+
+__all__ = ('partition_name', 'create_partitions', 'detach_partitions',
+           'list_partitions', 'is_partitioned', 'migrate')
+
+logger = logging.getLogger(__name__)
+
+TABLE = HistoricalData.__tablename__
+_NAME_RE = re.compile(r'^{}_(\d{{4}})_(\d{{2}})$'.format(TABLE))
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _add_months(month, n):
+    months = month.year * 12 + month.month - 1 + n
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def _months_between(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def partition_name(month):
+    """
+    :param month: any date of month
+    :return: name of partition table of the month
+    """
+    return '{}_{:%Y_%m}'.format(TABLE, month)
+
+
+def list_partitions(bind):
+    """
+    :param bind: `sqlalchemy.Engine` or `Connection` of history db
+    :return: dict of first days of months by names of attached partitions
+    """
+    names = bind.execute(text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :table'), table=TABLE).fetchall()
+    partitions = {}
+    for name, in names:
+        match = _NAME_RE.match(name)
+        if match:
+            partitions[name] = datetime.date(int(match.group(1)),
+                                             int(match.group(2)), 1)
+    return partitions
+
+
+def create_partitions(bind, months_ahead=2, today=None):
+    """
+    Creates missing partitions of current and `months_ahead` next months.
+
+    :param bind: `sqlalchemy.Engine` or `Connection` of history db
+    :param today: date to count months from, utc today by default
+    :return: names of created partitions
+    """
+    month = _month(today or datetime.datetime.utcnow().date())
+    existing = list_partitions(bind)
+    created = []
+    for i in range(months_ahead + 1):
+        start = _add_months(month, i)
+        name = partition_name(start)
+        if name in existing:
+            continue
+        # bounds of partition can't be bind parameters
+        bind.execute(text(
+            "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')"
+            .format(name, TABLE, start.isoformat(),
+                    _add_months(start, 1).isoformat())))
+        logger.info("Created partition '{}'".format(name))
+        created.append(name)
+    return created
+
+
+def detach_partitions(bind, keep_months=12, today=None, drop=False):
+    """
+    Detaches partitions of months older than `keep_months` months, so they
+    can be archived and dropped without touching the table.
+
+    :param bind: `sqlalchemy.Engine` or `Connection` of history db
+    :param today: date to count months from, utc today by default
+    :param drop: whether detached partitions are dropped
+    :return: names of detached partitions
+    """
+    oldest = _add_months(_month(today or datetime.datetime.utcnow().date()),
+                         -keep_months)
+    detached = []
+    for name, month in sorted(list_partitions(bind).items()):
+        if month >= oldest:
+            continue
+        bind.execute(text('ALTER TABLE {} DETACH PARTITION {}'
+                          .format(TABLE, name)))
+        if drop:
+            bind.execute(text('DROP TABLE {}'.format(name)))
+        logger.info("{} partition '{}'".format(
+            'Dropped' if drop else 'Detached', name))
+        detached.append(name)
+    return detached
+
+
+def is_partitioned(bind):
+    """
+    :param bind: `sqlalchemy.Engine` or `Connection` of history db
+    :return: whether `historical_data` is partitioned table
+    """
+    kind = bind.execute(text(
+        'SELECT relkind FROM pg_class WHERE relname = :table'),
+        table=TABLE).scalar()
+    return kind == 'p'
+
+
+def migrate(bind, months_ahead=2, today=None):
+    """
+    Converts plain `historical_data` into partitioned one: adds and
+    backfills `day`, deletes all but the latest record of user, device and
+    event type a day, creates partitioned table with partitions of all
+    existing days plus `months_ahead` next months, moves rows there and
+    builds `historical_data_daily_key`.
+
+    Old table is renamed to `historical_data_unpartitioned` and kept to be
+    dropped by hand. Has to run in transaction, so it's either done as a
+    whole or not at all, while writers are stopped.
+
+    :param bind: `sqlalchemy.Connection` of history db in transaction
+    :param today: date to count months from, utc today by default
+    :return: number of moved rows, `None` if table is partitioned already
+    """
+    if is_partitioned(bind):
+        return None
+    old = '{}_unpartitioned'.format(TABLE)
+    sequence = HistoricalData.id.default.name
+
+    bind.execute(text('ALTER TABLE {} ADD COLUMN IF NOT EXISTS day date'
+                      .format(TABLE)))
+    bind.execute(text(
+        "UPDATE {} SET day = coalesce(datetime, now() AT TIME ZONE 'utc')"
+        "::date WHERE day IS NULL".format(TABLE)))
+    # latest record wins, as upsert of the day would have done
+    bind.execute(text(
+        'DELETE FROM {0} h USING {0} d '
+        'WHERE h.user_id = d.user_id '
+        'AND h.device_type_id = d.device_type_id '
+        'AND h.real_event_type_name = d.real_event_type_name '
+        'AND h.day = d.day '
+        'AND h.historical_data_id < d.historical_data_id'.format(TABLE)))
+
+    # names of indexes and their constraints are unique per schema
+    bind.execute(text('DROP INDEX IF EXISTS {}'
+                      .format(historical_data_daily_key.name)))
+    bind.execute(text('ALTER TABLE {} RENAME TO {}'.format(TABLE, old)))
+    bind.execute(text('ALTER TABLE {0} RENAME CONSTRAINT {1}_pkey '
+                      'TO {0}_pkey'.format(old, TABLE)))
+    bind.execute(text(
+        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (day)'.format(TABLE, old)))
+    bind.execute(text(
+        'ALTER TABLE {0} ADD CONSTRAINT {0}_pkey '
+        'PRIMARY KEY (historical_data_id, day)'.format(TABLE)))
+    bind.execute(text(
+        'ALTER TABLE {} ADD CONSTRAINT "event_type_FK" '
+        'FOREIGN KEY (event_type_id) '
+        'REFERENCES lookup_event_type (event_type_id)'.format(TABLE)))
+    # sequence would be dropped with old table otherwise
+    bind.execute(text('ALTER SEQUENCE {} OWNED BY {}.historical_data_id'
+                      .format(sequence, TABLE)))
+
+    month = _month(today or datetime.datetime.utcnow().date())
+    first_day = bind.execute(text('SELECT min(day) FROM {}'
+                                  .format(old))).scalar()
+    first_month = _month(min(first_day or month, month))
+    create_partitions(bind, _months_between(first_month, month) +
+                      months_ahead, today=first_month)
+
+    moved = bind.execute(text('INSERT INTO {} SELECT * FROM {}'
+                              .format(TABLE, old))).rowcount
+    # built once rows are in place, which is faster than row by row
+    historical_data_daily_key.create(bind)
+    logger.info("Moved {} row(s) of '{}' to partitioned table, it can be "
+                "dropped".format(moved, old))
+    return moved
+
+
+def main():
+    from core.app import resources
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--ahead', type=int, default=2,
+                        help='number of future months to create')
+    parser.add_argument('--keep', type=int, default=12,
+                        help='number of past months to keep attached')
+    parser.add_argument('--drop', action='store_true',
+                        help='drop detached partitions')
+    parser.add_argument('--migrate', action='store_true',
+                        help='convert table created before partitioning')
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with resources.history_db.begin() as connection:
+        if opts.migrate:
+            print(migrate(connection, opts.ahead))
+        print(create_partitions(connection, opts.ahead))
+        print(detach_partitions(connection, opts.keep, drop=opts.drop))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import time
+import random
+import itertools
+import collections
+
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session
+
+from core.db.base import CustomQuery
+from core.db.base import LazyBindSession
+
+__all__ = ('ReplicaConfig', 'ReplicaSet', 'RoutingSession',
+           'create_routing_session')
+
+
+class ReplicaConfig(collections.namedtuple('ReplicaConfig', [
+        'urls', 'strategy', 'sticky'])):
+    """
+    :param urls: `sqlalchemy` connection urls of read replicas
+    :param strategy: `round_robin` or `least_loaded`, see `ReplicaSet`
+    :param sticky: seconds session reads from primary after it wrote
+    """
+    __slots__ = ()
+
+    def __new__(cls, urls=(), strategy='round_robin', sticky=5):
+        return super(ReplicaConfig, cls).__new__(cls, tuple(urls), strategy,
+                                                 sticky)
+
+
+class ReplicaSet(object):
+    """
+    Chooses read replica engine for read-only transactions.
+
+    `round_robin` cycles through replicas, `least_loaded` takes one with
+    the least number of checked out connections of process's pool.
+    """
+    STRATEGIES = ('round_robin', 'least_loaded')
+
+    def __init__(self, engines, strategy='round_robin'):
+        """
+        :param engines: list of `sqlalchemy.Engine` or callable returning
+          it, which is called when replica is needed
+        :param strategy: name of selection strategy
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError("Unknown replica strategy '{}'".format(strategy))
+        self._engines = engines
+        self._strategy = strategy
+        self._counter = itertools.count()
+
+    @property
+    def engines(self):
+        return self._engines() if callable(self._engines) else self._engines
+
+    def choose(self):
+        """
+        :return: Instance of `sqlalchemy.Engine` or `None` if there are no
+          replicas
+        """
+        engines = self.engines
+        if not engines:
+            return None
+        if self._strategy == 'least_loaded':
+            # shuffled, so equally loaded replicas share load
+            engines = random.sample(engines, len(engines))
+            return min(engines, key=_checked_out)
+        return engines[next(self._counter) % len(engines)]
+
+
+def _checked_out(engine):
+    try:
+        return engine.pool.checkedout()
+    except AttributeError:
+        return 0
+
+
+class RoutingSession(LazyBindSession):
+    """
+    Session which runs plain SELECTs on read replica and everything else
+    on primary engine.
+
+    Flushes, DML, locking and textual statements go to primary. Once
+    session wrote, it keeps reading from primary for `sticky` seconds, so
+    it reads its own writes while replicas lag behind. Replica is chosen
+    once per transaction and again after `expire_all`; sessions which are
+    never committed should be removed after every unit of work, e.g. task.
+    """
+
+    def __init__(self, replicas=None, sticky=5, **kwargs):
+        """
+        :param replicas: Instance of `ReplicaSet`
+        :param sticky: seconds session reads from primary after it wrote
+        """
+        self._replicas = replicas
+        self._sticky = sticky
+        self._replica = None
+        self._primary_until = 0
+        super(RoutingSession, self).__init__(**kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super(RoutingSession, self).get_bind(mapper, clause)
+        if self._replicas is None or self._flushing:
+            return primary
+        if not isinstance(clause, Select) or \
+                clause._for_update_arg is not None:
+            if clause is not None:
+                self._wrote()
+            return primary
+        if time.time() < self._primary_until:
+            return primary
+        if self._replica is None:
+            self._replica = self._replicas.choose()
+        return self._replica or primary
+
+    def flush(self, objects=None):
+        changed = bool(self.new or self.dirty or self.deleted)
+        super(RoutingSession, self).flush(objects)
+        if changed:
+            self._wrote()
+
+    def commit(self):
+        try:
+            super(RoutingSession, self).commit()
+        finally:
+            self._replica = None
+
+    def rollback(self):
+        try:
+            super(RoutingSession, self).rollback()
+        finally:
+            self._replica = None
+
+    def close(self):
+        try:
+            super(RoutingSession, self).close()
+        finally:
+            self._replica = None
+
+    def expire_all(self):
+        # callers expire to see fresh data, which other replica may have
+        super(RoutingSession, self).expire_all()
+        self._replica = None
+
+    def _wrote(self):
+        self._primary_until = time.time() + self._sticky
+
+
+def create_routing_session(bind, replicas, sticky=5):
+    """
+    Returns scoped `RoutingSession` factory
+
+    :param bind: primary `sqlalchemy.Engine` or callable returning it
+    :param replicas: Instance of `ReplicaSet`
+    :param sticky: seconds session reads from primary after it wrote
+    """
+    kwargs = dict(engine=bind) if callable(bind) else dict(bind=bind)
+    return scoped_session(sessionmaker(class_=RoutingSession,
+                                       replicas=replicas, sticky=sticky,
+                                       query_cls=CustomQuery, **kwargs))
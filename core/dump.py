@@ -3,20 +3,62 @@
 from __future__ import absolute_import
 
 import abc
+import zlib
+import time
 import redis
 import logging
 import collections
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from core import utils
 from core.utils import json
+from core.utils import Batcher
 
-__all__ = ('create_redis', 'create_redis_pool', 'Task', 'Dump',
-           'RedisDump', 'InvalidKeyError', 'DumpConfig')
+__all__ = ('create_redis', 'create_redis_pool', 'create_codec', 'Task',
+           'Dump', 'RedisDump', 'RedisStreamDump', 'BufferedDump',
+           'InvalidKeyError', 'DumpConfig', 'Codec', 'JsonCodec',
+           'MsgpackCodec')
 
 logger = logging.getLogger(__name__)
-DumpConfig = collections.namedtuple('Dump', 'url')
 
 
-class Task(collections.namedtuple('Task', 'id name args kwargs exception')):
+class DumpConfig(collections.namedtuple('DumpConfig', [
+        'url', 'batch_enabled', 'batch_size', 'batch_interval',
+        'batch_maxsize', 'codec', 'compress_threshold', 'ttl',
+        'retention', 'backend', 'stream_maxlen'])):
+    """
+    :param url: redis connection url
+    :param batch_enabled: whether dumps are buffered and written in batches
+    :param batch_size: max number of objects written at once
+    :param batch_interval: max seconds object waits for its batch
+    :param batch_maxsize: max number of buffered objects
+    :param codec: name of codec, see `create_codec`
+    :param compress_threshold: min size of record to be compressed, bytes
+    :param ttl: seconds dumped object expires in, 0 means never
+    :param retention: seconds dumped object stays indexed, 0 means forever
+    :param backend: `hash` for `RedisDump`, `stream` for `RedisStreamDump`
+    :param stream_maxlen: approximate max number of stream entries
+    """
+    __slots__ = ()
+
+    def __new__(cls, url, batch_enabled=False, batch_size=100,
+                batch_interval=1.0, batch_maxsize=10000, codec='json',
+                compress_threshold=1024, ttl=0, retention=0, backend='hash',
+                stream_maxlen=100000):
+        return super(DumpConfig, cls).__new__(cls, url, batch_enabled,
+                                              batch_size, batch_interval,
+                                              batch_maxsize, codec,
+                                              compress_threshold, ttl,
+                                              retention, backend,
+                                              stream_maxlen)
+
+
+class Task(collections.namedtuple('Task', 'id name args kwargs exception '
+                                          'exception_type')):
     """
     Failed task info to be dumped.
 
@@ -24,13 +66,17 @@ class Task(collections.namedtuple('Task', 'id name args kwargs exception')):
     :param name: full name of task function
     :param args: args that were passed
     :param kwargs: kwargs that were passed
-    :param exception: string representation of exception
+    :param exception: exception or its string representation
+    :param exception_type: name of exception class, taken from `exception`
+      if not provided
     """
     __slots__ = ()
 
-    def __new__(cls, id, name, args, kwargs, exception):
+    def __new__(cls, id, name, args, kwargs, exception, exception_type=None):
+        if exception_type is None and isinstance(exception, BaseException):
+            exception_type = type(exception).__name__
         return super(Task, cls).__new__(cls, id, name, args, kwargs,
-                                        str(exception))
+                                        str(exception), exception_type)
 
 
 def create_redis(pool):
@@ -49,6 +95,100 @@ def create_redis_pool(config):
     return redis.ConnectionPool.from_url(config.url)
 
 
+def create_codec(config):
+    """
+    :param config: Instance of `core.dump.DumpConfig`
+    :return: Instance of `Codec`
+    """
+    if config.codec == 'json':
+        return JsonCodec()
+    if config.codec == 'msgpack':
+        return MsgpackCodec(config.compress_threshold)
+    raise ValueError("Unknown dump codec '{}'".format(config.codec))
+
+
+class Codec(object):
+    """
+    Converts dumped objects to redis hash fields and back.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def encode(self, obj):
+        """
+        :param obj: Instance of `namedtuple`
+        :return: dict of hash fields
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, fields):
+        """
+        :param fields: dict of hash fields as returned by redis
+        :return: dict of object's fields
+        """
+        raise NotImplementedError
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class JsonCodec(Codec):
+    """
+    Every field is json-encoded into separate hash field.
+    """
+
+    def encode(self, obj):
+        return {k: json.dumps(v) for k, v in obj._asdict().items()}
+
+    def decode(self, fields):
+        return {_text(k): json.loads(_text(v)) for k, v in fields.items()}
+
+
+class MsgpackCodec(Codec):
+    """
+    Whole object is packed with msgpack into single `data` hash field and
+    compressed with zlib if it's bigger than `compress_threshold`.
+
+    First byte of `data` tells whether it's compressed. Hashes without
+    `data`, which were dumped before switching codecs, are decoded with
+    `JsonCodec`.
+    """
+    FIELD = 'data'
+    PLAIN = b'm'
+    COMPRESSED = b'z'
+
+    def __init__(self, compress_threshold=1024, level=6):
+        """
+        :param compress_threshold: min size of packed object to be
+          compressed, bytes; 0 disables compression
+        :param level: zlib compression level
+        """
+        if msgpack is None:
+            raise ImportError("'msgpack' is required by MsgpackCodec")
+        self._compress_threshold = compress_threshold
+        self._level = level
+        self._fallback = JsonCodec()
+
+    def encode(self, obj):
+        data = msgpack.packb(obj._asdict(), use_bin_type=True, default=str)
+        if self._compress_threshold and len(data) > self._compress_threshold:
+            return {self.FIELD: self.COMPRESSED + zlib.compress(data,
+                                                                self._level)}
+        return {self.FIELD: self.PLAIN + data}
+
+    def decode(self, fields):
+        data = fields.get(self.FIELD, fields.get(self.FIELD.encode()))
+        if data is None:
+            return self._fallback.decode(fields)
+        if data[:1] == self.COMPRESSED:
+            data = zlib.decompress(data[1:])
+        else:
+            data = data[1:]
+        return msgpack.unpackb(data, raw=False)
+
+
 class DumpException(BaseException):
     pass
 
@@ -71,6 +211,21 @@ class Dump(object):
         """
         raise NotImplementedError
 
+    def dump_many(self, objs):
+        """
+        Dumps all `objs`. Implementations may do it at once.
+        :param objs: iterable of `namedtuple` instances
+        """
+        for obj in objs:
+            self.dump(obj)
+
+    def validate(self, obj):
+        """
+        Checks that `obj` can be dumped, so buffering dumps reject it
+        before it's queued.
+        :raises: `DumpException` if it can't
+        """
+
 
 class RedisDump(Dump):
     """
@@ -79,32 +234,422 @@ class RedisDump(Dump):
     Object's `id` is a key to hash.
 
     Hash key is build according to format `prefix:id`.
-    Set key is used if provided. `prefix:all` otherwise
+    Set key is used if provided. `prefix:all` otherwise.
+
+    Hash keys are also indexed by dump time in sorted set `set_key:index`
+    and, for every field of `indexed`, in sorted set
+    `set_key:field:value`. Indexes allow to `query` objects page by page.
+    Objects older than `retention`, or `ttl` if there is no retention, are
+    removed from set and indexes and deleted: a few chunks of them by one
+    of dumping processes every `TRIM_INTERVAL`, the rest by `trim`.
     """
+    TRIM_INTERVAL = 60
+    #: whether cursor of `query` stays valid after its page is removed
+    stable_cursor = False
+    #: max number of objects removed at once by trim
+    TRIM_CHUNK = 1000
+    #: max number of chunks removed by trim of `dump`
+    DUMP_TRIM_CHUNKS = 2
 
-    def __init__(self, redis, prefix, set_key=None):
+    def __init__(self, redis, prefix, set_key=None, codec=None, ttl=0,
+                 retention=0, indexed=()):
+        """
+        :param codec: Instance of `Codec`, `JsonCodec` by default
+        :param ttl: seconds hash expires in, 0 means never
+        :param retention: seconds hash stays indexed, 0 means forever
+        :param indexed: names of fields objects can be queried by
+        """
         super(RedisDump, self).__init__()
 
         self._redis = redis
         self._prefix = prefix
         self._set_key = set_key or '{}:all'.format(self._prefix)
+        self._index_key = '{}:index'.format(self._set_key)
+        self._indexes_key = '{}:indexes'.format(self._set_key)
+        self._trimmed_key = '{}:trimmed'.format(self._set_key)
+        self._codec = codec or JsonCodec()
+        self._ttl = ttl
+        self._retention = retention
+        # expired hashes would stay in set and indexes forever otherwise
+        self._horizon = retention or ttl
+        self._indexed = tuple(indexed)
+        self._trimmed_at = 0
 
     def dump(self, obj):
         """
         :raises: `InvalidKeyError` if `task.id` matches `tasks_set_name`
         """
+        self.dump_many((obj,))
+
+    def dump_many(self, objs):
+        """
+        Dumps `objs` with single pipeline.
+        :raises: `InvalidKeyError` if any `obj.id` matches `tasks_set_name`,
+          nothing is dumped then
+        """
+        keys = [(self._hash_key(obj.id), obj) for obj in objs]
+        for hash_key, _ in keys:
+            self._validate_key(hash_key)
+        if not keys:
+            return
+
+        now = time.time()
+        indexes = collections.defaultdict(list)
         pipe = self._redis.pipeline()
-        hash_key = self._hash_key(obj.id)
+        for hash_key, obj in keys:
+            pipe.hmset(hash_key, self._codec.encode(obj))
+            if self._ttl:
+                pipe.expire(hash_key, self._ttl)
+            indexes[self._index_key].extend((now, hash_key))
+            for field in self._indexed:
+                index_key = self._field_index_key(field, getattr(obj, field))
+                indexes[index_key].extend((now, hash_key))
+        pipe.sadd(self._set_key, *[hash_key for hash_key, _ in keys])
+        for index_key, scored in indexes.items():
+            pipe.execute_command('ZADD', index_key, *scored)
+        field_index_keys = [k for k in indexes if k != self._index_key]
+        if field_index_keys:
+            pipe.sadd(self._indexes_key, *field_index_keys)
+        pipe.execute()
+
+        if self._horizon and now - self._trimmed_at > self.TRIM_INTERVAL:
+            self._trimmed_at = now
+            try:
+                # interval is shared by all processes, one of them trims
+                if self._redis.set(self._trimmed_key, now, nx=True,
+                                   ex=self.TRIM_INTERVAL):
+                    self._trim(now - self._horizon, self.DUMP_TRIM_CHUNKS)
+            except redis.RedisError:
+                # objects are dumped, they are trimmed next time
+                logger.exception("Unable to trim '{}'".format(self._set_key))
+
+    def validate(self, obj):
+        """
+        :raises: `InvalidKeyError` if `obj.id` matches `tasks_set_name`
+        """
+        self._validate_key(self._hash_key(obj.id))
+
+    def _validate_key(self, hash_key):
+        if hash_key == self._set_key or \
+                hash_key.startswith(self._set_key + ':'):
+            raise InvalidKeyError(("Hash key '{}' conflicts with set key "
+                                   "'{}'").format(hash_key, self._set_key))
+
+    def query(self, cursor=None, count=100, since=None, until=None,
+              **filters):
+        """
+        Returns page of dumped objects, oldest first.
+
+        :param cursor: cursor returned with previous page, `None` for the
+          first one
+        :param count: max number of objects on page
+        :param since: min dump time, unix timestamp
+        :param until: max dump time, unix timestamp
+        :param filters: single `field=value` of indexed field
+        :return: tuple of list of `(hash_key, fields)` pairs and cursor of
+          the next page, which is `None` if there are no more objects.
+          `fields` of objects expired by TTL are `None`
+        """
+        utils.raise_on(len(filters) <= 1, 'Only one filter is supported')
+        index_key = self._index_key
+        for field, value in filters.items():
+            utils.raise_on(field in self._indexed,
+                           "Field '{}' is not indexed".format(field))
+            index_key = self._field_index_key(field, value)
+
+        if cursor:
+            score, skip = cursor.rsplit(',', 1)
+            score, skip = float(score), int(skip)
+        else:
+            score, skip = since if since is not None else '-inf', 0
+        members = self._redis.zrangebyscore(
+            index_key, score, until if until is not None else '+inf',
+            start=skip, num=count, withscores=True)
+        if not members:
+            return [], None
 
-        if hash_key == self._set_key:
-            raise InvalidKeyError(("Hash key '{}' conflicts with set key '{}'"
-                                   ).format(hash_key, self._set_key))
+        # objects dumped at once share score, so cursor counts ones of the
+        # last score which are already returned
+        last_score = members[-1][1]
+        same = sum(1 for _, s in members if s == last_score)
+        if last_score == score:
+            same += skip
+        next_cursor = '{!r},{}'.format(last_score, same)
 
-        pipe.hmset(hash_key, {k: json.dumps(v) for k, v in
-                              obj._asdict().items()})
-        pipe.sadd(self._set_key, hash_key)
+        pipe = self._redis.pipeline(transaction=False)
+        for member, _ in members:
+            pipe.hgetall(member)
+        page = [(_text(member), self._codec.decode(fields) if fields else None)
+                for (member, _), fields in zip(members, pipe.execute())]
+        return page, next_cursor if len(members) == count else None
+
+    def remove(self, hash_keys):
+        """
+        Deletes objects and removes them from set and indexes.
+        """
+        hash_keys = list(hash_keys)
+        if not hash_keys:
+            return
+        index_keys = self._redis.smembers(self._indexes_key)
+        pipe = self._redis.pipeline()
+        pipe.delete(*hash_keys)
+        pipe.srem(self._set_key, *hash_keys)
+        for index_key in set(index_keys) | {self._index_key}:
+            pipe.zrem(index_key, *hash_keys)
         pipe.execute()
 
+    def trim(self, max_age=None):
+        """
+        Removes all objects dumped more than `max_age` seconds ago.
+
+        :param max_age: `retention`, or `ttl` if there is no retention, by
+          default
+        :return: number of removed objects
+        """
+        max_age = self._horizon if max_age is None else max_age
+        utils.raise_on(max_age, 'Neither max age nor retention is set')
+        return self._trim(time.time() - max_age)
+
+    def backfill(self):
+        """
+        Indexes objects of set which aren't in `set_key:index`, e.g. ones
+        dumped before the index was introduced, as dumped now, so they are
+        trimmed when retention is over. Objects which are gone already
+        are removed.
+        :return: number of indexed objects
+        """
+        now, indexed, cursor = time.time(), 0, 0
+        while True:
+            cursor, hash_keys = self._redis.sscan(self._set_key, cursor,
+                                                  count=self.TRIM_CHUNK)
+            pipe = self._redis.pipeline(transaction=False)
+            for hash_key in hash_keys:
+                pipe.zscore(self._index_key, hash_key)
+                pipe.exists(hash_key)
+            replies = pipe.execute()
+            missing = [(k, exists) for k, score, exists in
+                       zip(hash_keys, replies[::2], replies[1::2])
+                       if score is None]
+            self.remove(k for k, exists in missing if not exists)
+            scored = [v for k, exists in missing if exists for v in (now, k)]
+            if scored:
+                self._redis.execute_command('ZADD', self._index_key, *scored)
+                indexed += len(scored) // 2
+            if not int(cursor):
+                return indexed
+
+    def _trim(self, before, chunks=None):
+        """
+        Removes objects dumped before `before` chunk by chunk, at most
+        `chunks` of them, until none is left by default.
+        """
+        removed = 0
+        while chunks is None or chunks > 0:
+            hash_keys = self._redis.zrangebyscore(self._index_key, '-inf',
+                                                  before, start=0,
+                                                  num=self.TRIM_CHUNK)
+            self.remove(hash_keys)
+            removed += len(hash_keys)
+            if len(hash_keys) < self.TRIM_CHUNK:
+                break
+            if chunks is not None:
+                chunks -= 1
+        return removed
+
+    def _field_index_key(self, field, value):
+        return '{}:{}:{}'.format(self._set_key, field, value)
+
     # TODO: simple concatenation will be faster then .format() function
     def _hash_key(self, id):
         return '{}:{}'.format(self._prefix, id)
+
+
+class RedisStreamDump(Dump):
+    """
+    Redis Streams implementation of `Dump`.
+
+    Objects are appended to capped stream `key` with XADD, so writes are
+    O(1), memory is bounded by `maxlen` entries and entries are ordered by
+    time. Entry fields are the ones of `codec`.
+
+    Consumers either read the stream with consumer groups (`create_group`,
+    `read`, `ack`) or page through it with `query`.
+    """
+    # cursor is id of the next entry, removal doesn't shift it
+    stable_cursor = True
+
+    def __init__(self, redis, key, codec=None, maxlen=100000):
+        """
+        :param redis: Instance of `redis.StrictRedis`
+        :param key: key of stream
+        :param codec: Instance of `Codec`, `JsonCodec` by default
+        :param maxlen: approximate max number of entries, 0 means unbounded
+        """
+        super(RedisStreamDump, self).__init__()
+
+        self._redis = redis
+        self._key = key
+        self._codec = codec or JsonCodec()
+        self._maxlen = maxlen
+
+    @property
+    def key(self):
+        return self._key
+
+    def dump(self, obj):
+        self.dump_many((obj,))
+
+    def dump_many(self, objs):
+        """
+        Appends `objs` with single pipeline.
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        for obj in objs:
+            args = [self._key]
+            if self._maxlen:
+                # `~` lets redis trim whole nodes only, which is way cheaper
+                args.extend(('MAXLEN', '~', self._maxlen))
+            args.append('*')
+            for field, value in self._codec.encode(obj).items():
+                args.extend((field, value))
+            pipe.execute_command('XADD', *args)
+        pipe.execute()
+
+    def create_group(self, group, start='0'):
+        """
+        Creates consumer group, does nothing if it already exists.
+
+        :param group: name of group
+        :param start: id of the last entry considered delivered, `0` for
+          the whole stream, `$` for new entries only
+        """
+        try:
+            self._redis.execute_command('XGROUP', 'CREATE', self._key, group,
+                                        start, 'MKSTREAM')
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read(self, group, consumer, count=100, block=None, pending=False):
+        """
+        Reads entries on behalf of `consumer` of `group`. Entries stay
+        pending until they are `ack`-ed.
+
+        :param count: max number of entries
+        :param block: max milliseconds to wait for new entries, `None` to
+          return at once
+        :param pending: whether to re-read entries delivered to `consumer`
+          but not acked yet, e.g. after crash, instead of new ones
+        :return: list of `(entry_id, fields)` pairs
+        """
+        args = ['GROUP', group, consumer, 'COUNT', count]
+        if block is not None:
+            args.extend(('BLOCK', block))
+        args.extend(('STREAMS', self._key, '0' if pending else '>'))
+        streams = self._redis.execute_command('XREADGROUP', *args)
+        if not streams:
+            return []
+        return [self._entry(entry) for entry in streams[0][1]]
+
+    def ack(self, group, entry_ids):
+        """
+        Marks entries as processed by `group`.
+        :return: number of acked entries
+        """
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return 0
+        return self._redis.execute_command('XACK', self._key, group,
+                                           *entry_ids)
+
+    def query(self, cursor=None, count=100, since=None, until=None,
+              **filters):
+        """
+        Returns page of dumped objects, oldest first. Same as
+        `RedisDump.query`, but any field may be filtered by. Stream has no
+        indexes, so `count` entries are read and filtered afterwards: page
+        may have less objects while there are more of them, until cursor
+        is `None`.
+        """
+        utils.raise_on(len(filters) <= 1, 'Only one filter is supported')
+        # ids start with milliseconds of XADD time, so time window maps to
+        # range of ids
+        start = cursor or ('-' if since is None else int(since * 1000))
+        end = '+' if until is None else int(until * 1000)
+        entries = self._redis.execute_command('XRANGE', self._key, start,
+                                              end, 'COUNT', count)
+        page = [self._entry(entry) for entry in entries]
+        next_cursor = None
+        if len(page) == count:
+            ms, seq = page[-1][0].split('-')
+            next_cursor = '{}-{}'.format(ms, int(seq) + 1)
+        for field, value in filters.items():
+            page = [(entry_id, fields) for entry_id, fields in page
+                    if fields is not None and fields.get(field) == value]
+        return page, next_cursor
+
+    def remove(self, entry_ids):
+        """
+        Deletes entries.
+        """
+        entry_ids = list(entry_ids)
+        if entry_ids:
+            self._redis.execute_command('XDEL', self._key, *entry_ids)
+
+    def _entry(self, entry):
+        entry_id, fields = entry
+        if fields is None:
+            # deleted while pending
+            return _text(entry_id), None
+        if not isinstance(fields, dict):
+            # raw reply of redis-py without stream response callbacks
+            fields = dict(zip(fields[::2], fields[1::2]))
+        return _text(entry_id), self._codec.decode(fields)
+
+
+class BufferedDump(Dump):
+    """
+    Buffers objects in bounded queue and writes them with `dump_many` of
+    wrapped dump from background thread.
+
+    `dump` never blocks: objects are dropped (and counted) when queue is
+    full, e.g. while redis is slow.
+    """
+
+    def __init__(self, dump, size=100, interval=1.0, maxsize=10000):
+        """
+        :param dump: Instance of `Dump` objects are written with
+        :param size: max number of objects written at once
+        :param interval: max seconds object waits for its batch
+        :param maxsize: max number of buffered objects
+        """
+        super(BufferedDump, self).__init__()
+
+        self._dump = dump
+        self._batcher = Batcher(dump.dump_many, size=size, interval=interval,
+                                maxsize=maxsize, name='dump')
+
+    @property
+    def dropped(self):
+        """
+        Number of objects dropped because queue was full.
+        """
+        return self._batcher.dropped
+
+    def dump(self, obj):
+        """
+        :raises: `DumpException` if wrapped dump can't dump `obj`
+        """
+        # invalid objects would fail the whole batch in background thread
+        self._dump.validate(obj)
+        # logged sparingly: drops happen in storms
+        if not self._batcher.put(obj, block=False) and \
+                self.dropped % 1000 == 1:
+            logger.warning('Dump queue is full, {} object(s) dropped so far'
+                           .format(self.dropped))
+
+    def flush(self, timeout=None):
+        self._batcher.flush(timeout)
+
+    def close(self, timeout=None):
+        self._batcher.close(timeout)
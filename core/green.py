@@ -0,0 +1,91 @@
+# coding: utf-8
+
+"""
+Support of cooperative (gevent) worker pool.
+
+With `celery worker -P gevent` a single worker process runs many
+processings at once: every blocking call on a patched socket yields to the
+event loop. Pure python drivers (pg8000, redis, kombu, requests) are
+patched by gevent itself, psycopg2(cffi) needs a wait callback.
+"""
+
+from __future__ import absolute_import
+
+import threading
+import contextlib
+
+__all__ = ('is_patched', 'patch_psycopg', 'ConcurrencyLimiter')
+
+
+def is_patched():
+    """
+    Returns `True` if process runs with gevent monkey patches applied.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def patch_psycopg():
+    """
+    Makes psycopg2 (or psycopg2cffi in compat mode) wait for socket
+    readiness cooperatively. Does nothing if psycopg2 is not available.
+    """
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    extensions.set_wait_callback(_gevent_wait_callback)
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    from psycopg2 import extensions, OperationalError
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('Bad result from poll: {}'.format(state))
+
+
+class ConcurrencyLimiter(object):
+    """
+    Bounds number of concurrent calls per key, e.g. per vendor, so a single
+    worker running many processings at once doesn't flood one API.
+    """
+
+    def __init__(self, limit):
+        """
+        :param limit: max concurrent calls per key, 0 means unbounded
+        """
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextlib.contextmanager
+    def slot(self, key):
+        if not self._limit:
+            yield
+            return
+        semaphore = self._semaphore(key)
+        with semaphore:
+            yield
+
+    def _semaphore(self, key):
+        try:
+            return self._semaphores[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(
+                    self._limit)
+            return self._semaphores[key]
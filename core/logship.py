@@ -0,0 +1,161 @@
+# coding: utf-8
+
+"""
+Shipping of log records to logstash without blocking loggers.
+
+Records are formatted by the calling thread and put into bounded queue,
+background thread sends them in batches over TCP. Records which don't fit
+into the queue are dropped and counted, so slow or unreachable logstash
+never stalls tasks.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import socket
+import logging
+import threading
+
+from logstash.formatter import LogstashFormatterVersion1
+
+from core import utils
+
+__all__ = ('create_log_handler', 'QueuedLogstashHandler', 'TCPSender')
+
+logger = logging.getLogger(__name__)
+
+#: name of sender thread, its own records are never shipped
+THREAD_NAME = 'logship'
+
+
+def create_log_handler(config):
+    """
+    :param config: Instance of `core.config.LogstashConfig`
+    :return: Instance of `QueuedLogstashHandler`
+    """
+    return QueuedLogstashHandler(config.host, int(config.port or 5959),
+                                 size=config.batch_size,
+                                 interval=config.batch_interval,
+                                 maxsize=config.queue_size)
+
+
+class TCPSender(object):
+    """
+    Sends batches of lines over TCP connection, which is opened on demand
+    and re-opened after errors with exponential backoff.
+    """
+
+    def __init__(self, host, port, timeout=5.0, retries=3, backoff=0.5,
+                 max_backoff=30.0):
+        """
+        :param timeout: seconds to connect and send
+        :param retries: number of retries of batch before it's dropped
+        :param backoff: seconds to wait before the first retry
+        :param max_backoff: max seconds to wait between retries
+        """
+        self._address = (host, port)
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._delay = backoff
+        self._socket = None
+        self._pid = None
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, lines):
+        """
+        :param lines: list of bytes without line endings
+        """
+        data = b''.join(line + b'\n' for line in lines)
+        for attempt in range(self._retries + 1):
+            if attempt:
+                time.sleep(self._delay)
+                self._delay = min(self._delay * 2, self._max_backoff)
+            try:
+                self._connect().sendall(data)
+            except (socket.error, IOError) as e:
+                self.close()
+                logger.debug('Unable to send {} record(s) to {}:{}: {!r}'
+                             .format(len(lines), self._address[0],
+                                     self._address[1], e))
+                continue
+            self._delay = self._backoff
+            self.sent += len(lines)
+            return True
+        self.dropped += len(lines)
+        logger.warning('Dropped {} record(s): {}:{} is unreachable'.format(
+            len(lines), *self._address))
+        return False
+
+    def close(self):
+        if self._socket is not None and self._pid == os.getpid():
+            try:
+                self._socket.close()
+            except (socket.error, IOError):
+                pass
+        self._socket = None
+
+    def _connect(self):
+        # socket of parent is never used by forked child
+        if self._socket is None or self._pid != os.getpid():
+            self._socket = socket.create_connection(self._address,
+                                                    self._timeout)
+            self._pid = os.getpid()
+        return self._socket
+
+
+class QueuedLogstashHandler(logging.Handler):
+    """
+    Logging handler formatting records as logstash events of version 1 and
+    sending them from background thread.
+    """
+
+    def __init__(self, host, port=5959, size=100, interval=0.5,
+                 maxsize=10000, message_type='logstash', tags=None,
+                 sender=None):
+        """
+        :param size: max number of records sent at once
+        :param interval: max seconds record waits for its batch
+        :param maxsize: max number of queued records, newer ones are
+          dropped
+        :param sender: Instance of `TCPSender`, created for `host` and
+          `port` if not provided
+        """
+        super(QueuedLogstashHandler, self).__init__()
+        self.setFormatter(LogstashFormatterVersion1(message_type, tags))
+        self._sender = sender or TCPSender(host, port)
+        self._batcher = utils.Batcher(self._sender.send, size=size,
+                                      interval=interval, maxsize=maxsize,
+                                      name=THREAD_NAME)
+
+    @property
+    def dropped(self):
+        """
+        Number of records dropped because queue was full or logstash was
+        unreachable.
+        """
+        return self._batcher.dropped + self._sender.dropped
+
+    def emit(self, record):
+        if threading.current_thread().name == THREAD_NAME:
+            # records of sender itself would feed its own queue
+            return
+        try:
+            data = self.format(record)
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+        self._batcher.put(data, block=False)
+
+    def flush(self, timeout=5.0):
+        self._batcher.flush(timeout)
+
+    def close(self, timeout=5.0):
+        self._batcher.close(timeout)
+        self._sender.close()
+        super(QueuedLogstashHandler, self).close()
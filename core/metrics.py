@@ -0,0 +1,265 @@
+# coding: utf-8
+
+"""
+Pluggable sinks of timers and counters.
+
+Metric names are dotted, labels are passed as `tags` dict, e.g.
+`sink.timing('processing.api', 0.2, dict(device_type=1))`.
+"""
+
+from __future__ import absolute_import
+
+import abc
+import time
+import socket
+import logging
+import threading
+import collections
+
+__all__ = ('create_sink', 'MetricsConfig', 'Sink', 'NullSink', 'MemorySink',
+           'StatsdSink', 'PrometheusSink')
+
+logger = logging.getLogger(__name__)
+
+MetricsConfig = collections.namedtuple('MetricsConfig',
+                                       'sink host port prefix')
+
+
+def create_sink(config):
+    """
+    :param config: Instance of `core.metrics.MetricsConfig`
+    :return: Instance of `Sink`, `NullSink` if no sink is configured
+    """
+    if not config.sink:
+        return NullSink()
+    if config.sink == 'memory':
+        return MemorySink()
+    if config.sink == 'statsd':
+        # port 0 means the default one of the sink
+        return StatsdSink(config.host, config.port or 8125, config.prefix)
+    if config.sink == 'prometheus':
+        return PrometheusSink(config.prefix)
+    raise ValueError("Unknown metrics sink '{}'".format(config.sink))
+
+
+def _key(tags):
+    return tuple(sorted(tags.items())) if tags else ()
+
+
+class _Timer(object):
+    __slots__ = ('_sink', '_name', '_tags', '_started')
+
+    def __init__(self, sink, name, tags):
+        self._sink = sink
+        self._name = name
+        self._tags = tags
+
+    def __enter__(self):
+        self._started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._sink.timing(self._name, time.time() - self._started,
+                          self._tags)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Sink(object):
+    """
+    Receives metrics. Implementations have to be thread-safe.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    #: whether metrics are recorded at all, so callers may skip collecting
+    enabled = True
+
+    @abc.abstractmethod
+    def timing(self, name, seconds, tags=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def incr(self, name, value=1, tags=None):
+        raise NotImplementedError
+
+    def timer(self, name, tags=None):
+        """
+        :return: context manager recording time of its block
+        """
+        return _Timer(self, name, tags)
+
+
+class NullSink(Sink):
+    """
+    Drops everything.
+    """
+    enabled = False
+
+    def timing(self, name, seconds, tags=None):
+        pass
+
+    def incr(self, name, value=1, tags=None):
+        pass
+
+    def timer(self, name, tags=None):
+        return _NULL_TIMER
+
+
+class MemorySink(Sink):
+    """
+    Keeps all metrics in memory, e.g. for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = collections.defaultdict(list)
+        self.counters = collections.defaultdict(int)
+
+    def timing(self, name, seconds, tags=None):
+        with self._lock:
+            self.timings[(name, _key(tags))].append(seconds)
+
+    def incr(self, name, value=1, tags=None):
+        with self._lock:
+            self.counters[(name, _key(tags))] += value
+
+    def clear(self):
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+
+class StatsdSink(Sink):
+    """
+    Sends metrics to StatsD over UDP. Tag values are appended to metric
+    name in order of tag names, e.g. `core.processing.api.1.activities`.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='core'):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._failed = False
+
+    def timing(self, name, seconds, tags=None):
+        self._send('{}:{:.3f}|ms'.format(self._name(name, tags),
+                                         seconds * 1000))
+
+    def incr(self, name, value=1, tags=None):
+        self._send('{}:{}|c'.format(self._name(name, tags), value))
+
+    def _name(self, name, tags):
+        parts = [self._prefix, name] if self._prefix else [name]
+        parts.extend(str(v).replace('.', '_') for _, v in _key(tags))
+        return '.'.join(parts)
+
+    def _send(self, line):
+        # metrics are never worth failing the task
+        try:
+            self._socket.sendto(line.encode('utf-8'), self._address)
+        except (socket.error, IOError):
+            # the first failure is usually misconfiguration, others noise
+            logger.log(logging.DEBUG if self._failed else logging.WARNING,
+                       'Unable to send metric to {}:{}'.format(
+                           *self._address), exc_info=True)
+            self._failed = True
+
+
+class PrometheusSink(Sink):
+    """
+    Aggregates metrics in memory and renders them in Prometheus text
+    exposition format: counters as `_total`, timings as summaries of
+    `_seconds_count` and `_seconds_sum`.
+    """
+
+    def __init__(self, prefix='core'):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._timings = collections.defaultdict(lambda: [0, 0.0])
+        self._server = None
+
+    def timing(self, name, seconds, tags=None):
+        with self._lock:
+            summary = self._timings[(name, _key(tags))]
+            summary[0] += 1
+            summary[1] += seconds
+
+    def incr(self, name, value=1, tags=None):
+        with self._lock:
+            self._counters[(name, _key(tags))] += value
+
+    def exposition(self):
+        """
+        :return: text of all metrics in Prometheus exposition format
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted((k, list(v)) for k, v in self._timings.items())
+
+        lines, typed = [], set()
+        for (name, tags), value in counters:
+            metric = self._metric(name) + '_total'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{}{} {}'.format(metric, _labels(tags), value))
+        for (name, tags), (count, total) in timings:
+            metric = self._metric(name) + '_seconds'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} summary'.format(metric))
+            lines.append('{}_count{} {}'.format(metric, _labels(tags), count))
+            lines.append('{}_sum{} {!r}'.format(metric, _labels(tags), total))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host=''):
+        """
+        Serves `exposition` over HTTP from background thread.
+        """
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type',
+                                       'text/plain; version=0.0.4')])
+            return [self.exposition().encode('utf-8')]
+
+        self._server = make_server(host, port, app,
+                                   handler_class=QuietHandler)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='metrics')
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def _metric(self, name):
+        metric = name.replace('.', '_').replace('-', '_')
+        return '{}_{}'.format(self._prefix, metric) if self._prefix \
+            else metric
+
+
+def _labels(tags):
+    if not tags:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in tags) + '}'
@@ -2,20 +2,26 @@
 
 
 import abc
+import logging
 import collections
 
 import kombu
 import boto3.session
+from concurrent.futures import ThreadPoolExecutor
 from kombu.messaging import Producer
 
 from core.utils import json
+from core.utils import Batcher
 
-__all__ = ('create_amqp_pool', 'create_exchange',
+__all__ = ('create_amqp_pool', 'create_amqp_connection', 'create_exchange',
            'create_aws_session', 'create_sns',
            'UserEvent', 'SystemEvent',
            'EventNotifier',
-           'RabbitMQEventNotifier',
-           'SnsEventNotifier', 'EmailEventNotifier')
+           'RabbitMQEventNotifier', 'BatchedRabbitMQEventNotifier',
+           'PublishConfirms', 'NotConfirmedError',
+           'SnsEventNotifier', 'EmailEventNotifier', 'AsyncEventNotifier')
+
+logger = logging.getLogger(__name__)
 
 UserEvent = collections.namedtuple('UserEvent', ['body', 'priority'])
 SystemEvent = collections.namedtuple('SystemEvent', ['id', 'time', 'type',
@@ -30,6 +36,16 @@ def create_amqp_pool(config):
     return kombu.Connection(config.url).Pool()
 
 
+def create_amqp_connection(config, confirm_publish=False):
+    """
+    :param config: Instance of `core.config.NotificationConfig`
+    :param confirm_publish: whether publishing waits for broker's confirm
+    :return: Instance of `kombu.Connection`
+    """
+    return kombu.Connection(config.url, transport_options=dict(
+        confirm_publish=confirm_publish))
+
+
 def create_exchange(name, _type):
     return kombu.Exchange(name=name, type=_type)
 
@@ -79,12 +95,217 @@ class RabbitMQEventNotifier(EventNotifier):
                              exchange=self._exchange,
                              routing_key=self._routing_key,
                              declare=[self._exchange],
-                             headers=dict(
-                                 RoutingKey=self._routing_key,
-                                 Priority=str(event.priority)
-                             ),
+                             headers=self._headers(event),
                              **self._extra_properties)
 
+    def _headers(self, event):
+        return dict(RoutingKey=self._routing_key,
+                    Priority=str(event.priority))
+
+
+class NotConfirmedError(Exception):
+    """
+    Broker nacked published message.
+    """
+
+
+class PublishConfirms(object):
+    """
+    Tracks publisher confirms of AMQP channel, which is put in confirm mode
+    once. Broker numbers messages of channel from 1 on and acks or nacks
+    them, possibly many at once, so a burst is confirmed with a single
+    `wait` instead of a round trip per message.
+    """
+    #: Basic.Ack and Basic.Nack methods
+    METHODS = [(60, 80), (60, 120)]
+
+    def __init__(self, channel, timeout=None):
+        """
+        :param channel: `amqp.Channel` of `kombu.Connection`
+        :param timeout: max seconds to wait for a confirm
+        """
+        channel.confirm_select()
+        channel.events['basic_ack'].add(self._acked)
+        channel.events['basic_nack'].add(self._nacked)
+        self._channel = channel
+        self._timeout = timeout
+        self._tag = 0
+        self._unconfirmed = set()
+        self._rejected = set()
+
+    @staticmethod
+    def supported(channel):
+        return hasattr(channel, 'confirm_select')
+
+    def published(self):
+        """
+        Counts message published over the channel.
+        :return: delivery tag of the message
+        """
+        self._tag += 1
+        self._unconfirmed.add(self._tag)
+        return self._tag
+
+    def wait(self):
+        """
+        Waits for confirms of all published messages.
+
+        :return: set of delivery tags of nacked messages
+        :raises: `socket.timeout` if confirm doesn't come in `timeout`
+        """
+        while self._unconfirmed:
+            self._channel.wait(self.METHODS, timeout=self._timeout)
+        rejected, self._rejected = self._rejected, set()
+        return rejected
+
+    def _acked(self, delivery_tag, multiple):
+        self._confirmed(delivery_tag, multiple)
+
+    def _nacked(self, delivery_tag, multiple, requeue=None):
+        self._rejected.update(self._confirmed(delivery_tag, multiple))
+
+    def _confirmed(self, delivery_tag, multiple):
+        tags = {t for t in self._unconfirmed if t <= delivery_tag} \
+            if multiple else {delivery_tag}
+        self._unconfirmed -= tags
+        return tags
+
+
+class BatchedRabbitMQEventNotifier(RabbitMQEventNotifier):
+    """
+    Buffers events and publishes them in bursts from background thread
+    over long-lived channel. Exchange is declared once per channel.
+
+    `send` doesn't wait for publishing, so events which can't be published
+    after reconnect or are nacked by broker are handed to `on_failure`, or
+    logged and lost if it's not provided. With `confirm`, burst counts as
+    published once broker confirmed all its events; burst interrupted by
+    connection error is published again as a whole, so events may be
+    delivered twice. Without it, event counts as published once it's
+    written to the connection.
+    """
+
+    def __init__(self, connection, routing_key, exchange,
+                 extra_properties=None, size=100, interval=0.5,
+                 maxsize=10000, on_failure=None, confirm=True,
+                 confirm_timeout=10):
+        """
+        :param connection: Instance of `kombu.Connection`, owned by notifier
+        :param size: max number of events published at once
+        :param interval: max seconds event waits for publishing
+        :param maxsize: max number of buffered events, the following ones
+          are dropped
+        :param on_failure: callable taking list of unpublished events and
+          the last error, called from background thread
+        :param confirm: whether bursts wait for publisher confirms, which
+          are used if transport supports them
+        :param confirm_timeout: max seconds to wait for a confirm
+        """
+        super(BatchedRabbitMQEventNotifier, self).__init__(
+            None, routing_key, exchange, extra_properties)
+        self._connection = connection
+        self._producer = None
+        self._confirms = None
+        self._confirm = confirm
+        self._confirm_timeout = confirm_timeout
+        self._on_failure = on_failure
+        self._batcher = Batcher(self._publish, size=size, interval=interval,
+                                maxsize=maxsize, name='user-event-publisher')
+
+    def send(self, event):
+        if not self._batcher.put(event, block=False):
+            logger.warning('Publishing buffer is full, event {} is dropped'
+                           .format(event.body))
+
+    def flush(self, timeout=None):
+        self._batcher.flush(timeout)
+
+    def close(self):
+        self._batcher.close()
+        self._release()
+
+    def _publish(self, events):
+        pending = collections.deque(events)
+        errors = (self._connection.connection_errors +
+                  self._connection.channel_errors)
+        error = None
+        for attempt in (1, 2):
+            try:
+                producer = self._ensure_producer()
+                if self._confirms is not None:
+                    self._publish_confirmed(producer, list(pending))
+                    return
+                while pending:
+                    self._publish_event(producer, pending[0])
+                    pending.popleft()
+                return
+            except errors as e:
+                logger.exception('Unable to publish {} event(s), attempt {}'
+                                 .format(len(pending), attempt))
+                error = e
+                self._release()
+            except Exception as e:
+                # retry wouldn't help
+                logger.exception('Unable to publish {} event(s)'
+                                 .format(len(pending)))
+                error = e
+                self._release()
+                break
+        self._failed(list(pending), error)
+
+    def _publish_confirmed(self, producer, events):
+        tags = []
+        for event in events:
+            self._publish_event(producer, event)
+            tags.append(self._confirms.published())
+        nacked = self._confirms.wait()
+        if nacked:
+            logger.error('{} event(s) are nacked by broker'
+                         .format(len(nacked)))
+            self._failed([event for event, tag in zip(events, tags)
+                          if tag in nacked],
+                         NotConfirmedError('basic.nack'))
+
+    def _publish_event(self, producer, event):
+        producer.publish(event.body,
+                         routing_key=self._routing_key,
+                         headers=self._headers(event),
+                         **self._extra_properties)
+
+    def _failed(self, events, error):
+        if self._on_failure is not None:
+            try:
+                self._on_failure(events, error)
+                return
+            except Exception:
+                logger.exception('Unable to hand over {} unpublished '
+                                 'event(s)'.format(len(events)))
+        logger.error('{} event(s) are dropped'.format(len(events)))
+
+    def _ensure_producer(self):
+        if self._producer is None:
+            self._connection.ensure_connection(max_retries=3)
+            channel = self._connection.channel()
+            if self._confirm and PublishConfirms.supported(channel):
+                # once per channel, broker numbers messages published
+                # afterwards from 1 on
+                self._confirms = PublishConfirms(channel,
+                                                 self._confirm_timeout)
+            # declares exchange once for the channel's lifetime
+            self._producer = Producer(channel, exchange=self._exchange,
+                                      auto_declare=True)
+        return self._producer
+
+    def _release(self):
+        if self._producer is not None:
+            try:
+                self._producer.channel.close()
+            except Exception:
+                pass
+            self._producer = None
+            self._confirms = None
+        self._connection.release()
+
 
 class SnsEventNotifier(EventNotifier):
     def __init__(self, sns, topic, subject, message_type):
@@ -117,3 +338,31 @@ class EmailEventNotifier(SnsEventNotifier):
             default=self.DEFAULT_FORMAT.format(m=event),
             email=self.EMAIL_FORMAT.format(m=event)
         ))
+
+
+class AsyncEventNotifier(EventNotifier):
+    """
+    Sends events with wrapped notifier from pool of background threads, so
+    caller doesn't wait for the broker.
+    """
+
+    def __init__(self, notifier, workers=4):
+        """
+        :param notifier: Instance of thread-safe `EventNotifier`
+        :param workers: number of sending threads
+        """
+        self._notifier = notifier
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def send(self, event):
+        """
+        :return: Instance of `concurrent.futures.Future` of sending
+        """
+        return self._executor.submit(self._notifier.send, event)
+
+    def close(self, wait=True):
+        """
+        Stops accepting events.
+        :param wait: whether to wait for pending events to be sent
+        """
+        self._executor.shutdown(wait)
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+"""
+Priorities of events and routing of their tasks to Celery queues.
+
+Every processing class has `base_priority` of fresh events, 0-9, the
+higher the sooner. Priority of event decreases by one every `age_step`
+seconds of its age, so backlog of old events gives way to fresh ones.
+Priority picks one of the event queues:
+
+* `events.realtime` - 7 and above
+* `events.default` - 4 to 6
+* `events.bulk` - below 4
+
+Messages carry the priority too, so RabbitMQ orders them within a queue.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import collections
+
+from kombu import Queue
+
+from core import utils
+
+__all__ = ('PriorityConfig', 'PriorityRouter', 'event_priority',
+           'queue_for', 'route', 'create_queues', 'MIN_PRIORITY',
+           'MAX_PRIORITY', 'DEFAULT_PRIORITY')
+
+PriorityConfig = collections.namedtuple('PriorityConfig',
+                                        'routing age_step')
+
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+#: tuples of min priority and name of queue, highest first
+QUEUES = ((7, 'events.realtime'),
+          (4, 'events.default'),
+          (MIN_PRIORITY, 'events.bulk'))
+
+#: positional arguments of `core.tasks.process_event`
+_PROCESS_EVENT_ARGS = ('user_id', 'seq_id', 'device_type', 'event_type',
+                       'processing_timestamp')
+
+
+def event_priority(base, timestamp=None, age_step=300, now=None):
+    """
+    :param base: priority of fresh event
+    :param timestamp: `datetime` of event, event is fresh if `None`
+    :param age_step: seconds of age priority decreases by one after, 0
+      means age is ignored
+    :param now: current `datetime`, for tests
+    :return: priority of event, from `MIN_PRIORITY` to `MAX_PRIORITY`
+    """
+    priority = base
+    if timestamp is not None and age_step:
+        if now is None:
+            now = datetime.datetime.now(timestamp.tzinfo)
+        age = (now - timestamp).total_seconds()
+        if age > 0:
+            priority -= int(age // age_step)
+    return max(MIN_PRIORITY, min(MAX_PRIORITY, priority))
+
+
+def queue_for(priority):
+    """
+    :return: name of queue of events of `priority`
+    """
+    for min_priority, name in QUEUES:
+        if priority >= min_priority:
+            return name
+    return QUEUES[-1][1]
+
+
+def route(priority):
+    """
+    :return: dict of `apply_async` options sending task to queue of
+      `priority` with it
+    """
+    return dict(queue=queue_for(priority), priority=priority)
+
+
+def create_queues(default_queue='celery'):
+    """
+    Returns queues of `CELERY_QUEUES`: event queues and the default one of
+    other tasks. Event queues are declared with max priority.
+    """
+    arguments = {'x-max-priority': MAX_PRIORITY + 1}
+    return (Queue(default_queue, routing_key=default_queue),) + tuple(
+        Queue(name, routing_key=name, queue_arguments=arguments)
+        for _, name in QUEUES)
+
+
+class PriorityRouter(object):
+    """
+    Celery router sending `core.tasks.process_event` to queue of event's
+    priority. Base priority is taken from processing class of device and
+    event type, see `core.processing.device_event_processing_mapping`.
+
+        CELERY_ROUTES = ('core.priority.PriorityRouter',)
+    """
+    tasks = ('core.tasks.process_event',)
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        if task not in self.tasks:
+            return None
+        # processing imports app, whose config refers to the router
+        from core.app import config
+        from core.processing import device_event_processing_mapping
+
+        params = dict(zip(_PROCESS_EVENT_ARGS, args or ()), **(kwargs or {}))
+        cls = device_event_processing_mapping.get(
+            (params.get('device_type'), params.get('event_type')))
+        priority = event_priority(
+            cls.base_priority if cls is not None else DEFAULT_PRIORITY,
+            utils.parse_timestamp(params.get('processing_timestamp')),
+            config.priority.age_step)
+        return route(priority)
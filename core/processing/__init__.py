@@ -14,6 +14,10 @@ from core.processing.base import (
     ProcessingRequest,
     TimedProcessingRequest
 )
+from core.processing.clients import (
+    ClientRegistry,
+    vendor_clients
+)
 from core.processing.fitbit import (
     FitbitActivitiesProcessing,
     FitbitBodyProcessing,
@@ -26,7 +30,9 @@ __all__ = ('get_processing', 'create_processing', 'Device',
            'ProcessingException', 'UnknownProcessingTypeException',
            'BaseProcessing', 'FitbitActivitiesProcessing',
            'FitbitBodyProcessing', 'FitbitSleepProcessing',
-           'MovesProcessing', 'ProcessingRequest', 'TimedProcessingRequest')
+           'MovesProcessing', 'ProcessingRequest', 'TimedProcessingRequest',
+           'ClientRegistry', 'vendor_clients', 'validate_request',
+           'process_bulk', 'BulkResult')
 
 device_event_processing_mapping = {
     (Device.Fitbit.value, 'activities'): FitbitActivitiesProcessing,
@@ -55,14 +61,9 @@ def get_processing(device_type, event_type):
                                              .format(device_type, event_type))
 
 
-@contextlib.contextmanager
-def create_processing(request, auth_session=app.AuthSession,
-                      history_session=app.HistorySession):
+def validate_request(request):
     """
-    :param request: Instance of `core.processing.ProcessingRequest`
-    :param auth_session: Factory of auth db `sqlalchemy.Session`
-    :param history_session: Factory of history db `sqlalchemy.Session`
-    :return: subclass of `core.processing.BaseRequest`
+    :raises: ValueError if `request` can't be processed
     """
     if not request:
         raise ValueError("Processing requires not null 'request' arg")
@@ -70,5 +71,29 @@ def create_processing(request, auth_session=app.AuthSession,
         raise ValueError("Processing requires not null 'user_id'")
     if not request.sequence_id:
         raise ValueError("Processing requires not null 'sequence_id'")
+
+
+@contextlib.contextmanager
+def create_processing(request, auth_session=app.AuthSession,
+                      history_session=app.HistorySession,
+                      history_writer=None):
+    """
+    :param request: Instance of `core.processing.ProcessingRequest`
+    :param auth_session: Factory of auth db `sqlalchemy.Session`
+    :param history_session: Factory of history db `sqlalchemy.Session`
+    :param history_writer: Instance of `core.db.HistoryWriter`. Worker's
+      writer is used if batching is enabled in config
+    :return: subclass of `core.processing.BaseRequest`
+    """
+    validate_request(request)
+    if history_writer is None and app.config.history_batch.enabled:
+        history_writer = app.history_writer()
     processing = get_processing(request.device_type, request.event_type)
-    yield processing(request, auth_session(), history_session())
+    yield processing(request, auth_session(), history_session(),
+                     history_writer=history_writer)
+
+
+from core.processing.bulk import (  # noqa
+    BulkResult,
+    process_bulk
+)
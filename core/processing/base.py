@@ -3,11 +3,17 @@
 
 import abc
 import enum
-import datetime
+import time
+import contextlib
 from collections import namedtuple
 
 from core import db
+from core import priority
+from core.app import config
+from core.app import metrics_sink
+from core.app import vendor_limiter
 from core.app import user_event_notifier
+from core.app import user_connection_cache
 from core.notify import UserEvent
 
 __all__ = ('BaseProcessing', 'ProcessingRequest', 'TimedProcessingRequest',
@@ -21,13 +27,6 @@ TimedProcessingRequest = namedtuple('TimedProcessingRequest',
                                     ProcessingRequest._fields +
                                     ('processing_time',))
 
-current_day_start = lambda: datetime.datetime.utcnow().replace(
-    hour=0, minute=0, second=0, microsecond=0
-)
-current_day_end = lambda: datetime.datetime.utcnow().replace(
-    hour=23, minute=59, second=59, microsecond=999
-)
-
 
 @enum.unique
 class Device(enum.Enum):
@@ -39,21 +38,78 @@ class Device(enum.Enum):
 class BaseProcessing(object):
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, request, auth_session, history_session):
+    #: cache of connections processing authenticates API calls with
+    connection_cache = user_connection_cache
+
+    #: priority of fresh events, see `core.priority`
+    base_priority = priority.DEFAULT_PRIORITY
+
+    def __init__(self, request, auth_session, history_session,
+                 history_writer=None):
         """
         :param request: Instance of `core.processing.ProcessingRequest`
+        :param history_writer: Instance of `core.db.HistoryWriter`, results
+          are saved through `history_session` directly if not provided
         """
         self._request = request
         self._auth_session = auth_session
         self._history_session = history_session
+        self._history_writer = history_writer
 
     def process(self):
         """
         Runs processing chain for specified provider.
         """
-        data_from_api = self._call_api()
-        self._save_to_historic_db(data_from_api)
-        self._notify()
+        with self._metered():
+            record = self.fetch()
+            with self._timer('save'):
+                created = self._save_to_historic_db(record.event)
+            self.after_save(created)
+            self.notify()
+
+    def fetch(self):
+        """
+        Runs processing chain up to API call.
+        :return: Instance of `core.db.HistoryRecord` to be saved
+        """
+        with vendor_limiter.slot(self._request.device_type):
+            with self._timer('api'):
+                raw_data = self._call_api()
+        return self._history_record(raw_data)
+
+    @contextlib.contextmanager
+    def _metered(self):
+        """
+        Records total time, statements and errors of the block, if metrics
+        are enabled.
+        """
+        sink = metrics_sink()
+        if not sink.enabled:
+            yield
+            return
+
+        tags = self._metric_tags
+        started = time.time()
+        with db.count_queries() as queries:
+            try:
+                yield
+            except Exception as e:
+                sink.incr('processing.errors',
+                          tags=dict(tags, error=type(e).__name__))
+                raise
+            finally:
+                sink.timing('processing.total', time.time() - started, tags)
+                sink.timing('processing.db', queries.time, tags)
+                sink.incr('processing.db.queries', queries.count, tags)
+
+    def _timer(self, stage):
+        return metrics_sink().timer('processing.' + stage,
+                                    self._metric_tags)
+
+    @property
+    def _metric_tags(self):
+        return dict(device_type=self._request.device_type,
+                    event_type=self._request.event_type)
 
     @abc.abstractmethod
     def _call_api(self):
@@ -64,39 +120,57 @@ class BaseProcessing(object):
         raise NotImplementedError
 
     def _save_to_historic_db(self, raw_data):
-        event_type = self._history_session.query(db.EventType).filter(
-            db.EventType.name == 'raw'
-        ).first_or_raise()
-        try:
-            record = self._history_session.query(db.HistoricalData).filter(
-                db.HistoricalData.user_id == self._request.user_id,
-                db.HistoricalData.device_type_id == self._request.device_type,
-                db.HistoricalData.real_event_type_name == self._request.event_type,  # noqa
-                db.HistoricalData.event_time.between(
-                    current_day_start(), current_day_end()
-                )
-            ).first_or_raise()
-            record.event = raw_data
-        except db.NotFoundException:
-            record = db.HistoricalData(
-                sequence_id=self._request.sequence_id,
-                user_id=self._request.user_id,
-                device_type_id=self._request.device_type,
-                real_event_type_name=self._request.event_type,
-                event_type=event_type,
-                event=raw_data
-            )
-            self._history_session.add(record)
+        """
+        :return: whether saved record is the first one of the day
+        """
+        record = self._history_record(raw_data)
+        if self._history_writer is not None:
+            return self._history_writer.write(record)
+
+        # concurrent first events of a day would race SELECT and INSERT
+        created, = db.upsert_historical_data(self._history_session,
+                                             (record,))
         self._history_session.commit()
+        return created
+
+    def after_save(self, created):
+        """
+        Hook called once result is saved, before notification.
 
-    def _notify(self):
-        user_event_notifier().send(UserEvent(dict(
+        :param created: whether saved record is the first one of the day
+          rather than replaces the existing one
+        """
+
+    def _history_record(self, raw_data):
+        return db.HistoryRecord(
             sequence_id=self._request.sequence_id,
-            device_type=self._request.device_type,
-            event_type=self._request.event_type
-        ), 1))  # TODO(ak): fix hardcode
+            user_id=self._request.user_id,
+            device_type_id=self._request.device_type,
+            real_event_type_name=self._request.event_type,
+            event=raw_data
+        )
+
+    def notify(self):
+        """
+        Notifies about processed event.
+        """
+        with self._timer('notify'):
+            user_event_notifier().send(UserEvent(dict(
+                sequence_id=self._request.sequence_id,
+                device_type=self._request.device_type,
+                event_type=self._request.event_type
+            ), self.priority))
+
+    @property
+    def priority(self):
+        """
+        Priority of request's event, decreased by its age.
+        """
+        timestamp = getattr(self._request, 'processing_time', None)
+        return priority.event_priority(self.base_priority, timestamp,
+                                       config.priority.age_step)
 
     @property
     def _user_connection(self):
-        return (self._auth_session.query(db.UserConnection).filter_by(
-            user_id=self._request.user_id).first_or_raise())
+        return self.connection_cache.get(self._auth_session,
+                                         self._request.user_id)
@@ -0,0 +1,151 @@
+# coding: utf-8
+
+
+from __future__ import absolute_import
+
+import logging
+import datetime
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from core import app
+from core import db
+from core.processing import get_processing
+from core.processing import validate_request
+from core.processing.exc import UnknownProcessingTypeException
+
+__all__ = ('BulkResult', 'process_bulk')
+
+logger = logging.getLogger(__name__)
+
+RETRY_COUNTDOWN = 60
+
+
+class BulkResult(collections.namedtuple('BulkResult', 'request error')):
+    """
+    Outcome of processing of single request of a bulk.
+
+    :param request: Instance of `core.processing.ProcessingRequest`
+    :param error: exception request failed with, `None` on success
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def process_bulk(requests, workers=10, auth_session=app.AuthSession,
+                 history_session=app.HistorySession, reenqueue=True):
+    """
+    Processes batch of requests at once.
+
+    Connections of all users are loaded with one query per connection
+    model, API calls are made from pool of `workers` threads and all
+    results are saved in single transaction.
+
+    :param requests: iterable of `core.processing.ProcessingRequest`
+    :param workers: max number of concurrent API calls
+    :param auth_session: Factory of auth db `sqlalchemy.Session`
+    :param history_session: Factory of history db `sqlalchemy.Session`
+    :param reenqueue: whether failed requests are sent to
+      `core.tasks.process_event` one by one
+    :return: list of `BulkResult` in order of `requests`
+    """
+    requests = list(requests)
+    errors = {}
+    processings = {}
+
+    for i, request in enumerate(requests):
+        try:
+            validate_request(request)
+            processings[i] = get_processing(request.device_type,
+                                            request.event_type)
+        except (ValueError, UnknownProcessingTypeException) as e:
+            errors[i] = e
+
+    _prefetch_connections(auth_session(), requests, processings)
+
+    fetched = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {i: executor.submit(_fetch, cls, requests[i],
+                                      auth_session.session_factory,
+                                      history_session.session_factory)
+                   for i, cls in processings.items()}
+        for i, future in futures.items():
+            try:
+                fetched[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+    finally:
+        executor.shutdown()
+
+    saved = sorted(fetched)
+    session = history_session()
+    try:
+        created = db.upsert_historical_data(
+            session, (fetched[i][1] for i in saved))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.exception('Unable to save bulk of {} record(s)'
+                         .format(len(fetched)))
+        errors.update((i, e) for i in fetched)
+        saved, created = [], []
+
+    for i, first in zip(saved, created):
+        processing, _ = fetched[i]
+        try:
+            processing.after_save(first)
+            processing.notify()
+        except Exception as e:
+            errors[i] = e
+
+    results = [BulkResult(request, errors.get(i))
+               for i, request in enumerate(requests)]
+    if reenqueue:
+        for result in results:
+            if not result.ok and not isinstance(
+                    result.error, (ValueError,
+                                   UnknownProcessingTypeException)):
+                _reenqueue(result)
+    return results
+
+
+def _prefetch_connections(session, requests, processings):
+    user_ids = collections.defaultdict(set)
+    for i, cls in processings.items():
+        user_ids[cls.connection_cache].add(requests[i].user_id)
+    for cache, ids in user_ids.items():
+        cache.prefetch(session, ids)
+
+
+def _fetch(cls, request, auth_session_factory, history_session_factory):
+    # sessions are not thread-safe, so each processing gets its own ones
+    auth_session = auth_session_factory()
+    history_session = history_session_factory()
+    try:
+        processing = cls(request, auth_session, history_session)
+        return processing, processing.fetch()
+    finally:
+        auth_session.close()
+        history_session.close()
+
+
+def _reenqueue(result):
+    request = result.request
+    try:
+        timestamp = request.processing_time.isoformat()
+    except AttributeError:
+        timestamp = datetime.datetime.now().isoformat()
+    countdown = getattr(result.error, 'retry', None) or RETRY_COUNTDOWN
+
+    kw = dict(user_id=request.user_id,
+              seq_id=request.sequence_id,
+              device_type=request.device_type,
+              event_type=request.event_type,
+              processing_timestamp=timestamp,
+              debounce=False)
+    app.app.send_task('core.tasks.process_event', kwargs=kw,
+                      countdown=countdown)
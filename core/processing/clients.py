@@ -0,0 +1,82 @@
+# coding: utf-8
+
+
+from __future__ import absolute_import
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core import app
+from core.utils import process_local
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+__all__ = ('ClientRegistry', 'vendor_clients')
+
+
+class ClientRegistry(object):
+    """
+    Keeps keep-alive `requests.Session` per vendor host, so TLS connections
+    are reused by all processings of the process.
+
+    Sessions carry no credentials: vendor clients have to authenticate
+    every request on their own.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, timeout=None):
+        """
+        :param pool_connections: number of connection pools to cache
+        :param pool_maxsize: max number of connections kept per host
+        :param timeout: default timeout of vendor requests, seconds
+        """
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.timeout = timeout
+
+    def session(self, url):
+        """
+        :param url: any url of vendor's host
+        :return: Instance of `requests.Session`
+        """
+        host = urlparse(url).netloc
+        try:
+            return self._sessions[host]
+        except KeyError:
+            pass
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._create_session()
+            return self._sessions[host]
+
+    def mount(self, url, session):
+        """
+        Replaces session used for host of `url`, e.g. with a fake one.
+        """
+        with self._lock:
+            self._sessions[urlparse(url).netloc] = session
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_connections,
+                              pool_maxsize=self._pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+@process_local
+def vendor_clients():
+    return ClientRegistry(*app.config.vendor_pool)
@@ -10,7 +10,10 @@ import fitbit
 from fitbit.exceptions import HTTPTooManyRequests
 
 
+from core.app import rate_limits
+from core.app import user_connection_cache
 from core.processing import BaseProcessing
+from core.processing.clients import vendor_clients
 from core.processing.exc import (
     ProcessingDelayedException,
     ProcessingRetryLimitException
@@ -33,18 +36,25 @@ class BaseFitbitProcessing(BaseProcessing):
         try:
             return self._call_fitbit()
         except HTTPTooManyRequests as e:
-            user_connection.delay_till = now + datetime.timedelta(
-                seconds=e.retry_after_secs)
+            delay_till = now + datetime.timedelta(seconds=e.retry_after_secs)
+            user_connection.delay_till = delay_till
             self._auth_session.commit()
+            user_connection_cache.update(self._request.user_id,
+                                         delay_till=delay_till)
+            rate_limits().delay(self._request.device_type,
+                                self._request.user_id, e.retry_after_secs)
             raise ProcessingRetryLimitException(retry=e.retry_after_secs)
 
     @property
     def _fitbit(self):
         user = self._user_connection
         client = fitbit.Fitbit(user.access_token, user.access_token_secret,
-                               resource_owner_key=user.q_token,
-                               resource_license_plate=rollout_plate,
+                               resource_owner_key=user.oauth_token,
                                resource_owner_secret=user.oauth_token_secret)
+        # credentials are signed into every request, so the keep-alive
+        # session can be shared by all users
+        client.client.session = vendor_clients().session(
+            client.client.API_ENDPOINT)
         return client
 
     @abc.abstractmethod
@@ -53,15 +63,22 @@ class BaseFitbitProcessing(BaseProcessing):
 
 
 class FitbitActivitiesProcessing(BaseFitbitProcessing):
+    # users wait for their activity updates
+    base_priority = 8
+
     def _call_fitbit(self):
         return self._fitbit.activities()
 
 
 class FitbitBodyProcessing(BaseFitbitProcessing):
+    base_priority = 6
+
     def _call_fitbit(self):
         return self._fitbit.bp()
 
 
 class FitbitSleepProcessing(BaseFitbitProcessing):
+    base_priority = 6
+
     def _call_fitbit(self):
         return self._fitbit.sleep()
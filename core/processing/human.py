@@ -4,12 +4,14 @@
 import datetime
 
 import humanapi
+from humanapi.api import ROOT
 
-from core import db
+from core.app import human_connection_cache
 from core.processing import BaseProcessing
+from core.processing.clients import vendor_clients
 
 
-__all__ = ('HumanApiActivitiesProcessing',)
+__all__ = ('HumanApiActivitiesProcessing', 'PooledHumanAPI')
 
 
 start_of_day = lambda: datetime.datetime.utcnow().replace(
@@ -17,16 +19,46 @@ start_of_day = lambda: datetime.datetime.utcnow().replace(
 )
 
 
+class PooledHumanAPI(humanapi.HumanAPI):
+    """
+    `humanapi.HumanAPI` sending requests through shared keep-alive session
+    instead of a new connection per call.
+    """
+
+    def __init__(self, session, timeout=None, **kwargs):
+        """
+        :param session: Instance of `requests.Session`
+        :param timeout: request timeout, seconds
+        """
+        super(PooledHumanAPI, self).__init__(**kwargs)
+        self._session = session
+        self._timeout = timeout
+
+    def call(self, url, params=None):
+        r = self._session.get('{}{}'.format(ROOT, url), headers={
+            'Authorization': 'Bearer ' + self.accessToken,
+            'accept': 'application/json',
+            'user-agent': 'HumanAPI-Python/1.0.0'
+        }, timeout=self._timeout)
+        result = r.json()
+        if r.status_code != 200:
+            raise self.cast_error(result)
+        return result
+
+
 class HumanApiActivitiesProcessing(BaseProcessing):
+    connection_cache = human_connection_cache
+
     @property
     def _human_connection(self):
-        return (self._auth_session.query(db.HumanApiConnection).filter(
-            db.HumanApiConnection.human_id == self._request.user_id
-        ).first_or_raise())
+        return self.connection_cache.get(self._auth_session,
+                                         self._request.user_id)
 
     def _call_api(self):
         human = self._human_connection
-        api = humanapi.HumanAPI(accessToken=human.access_token)
+        clients = vendor_clients()
+        api = PooledHumanAPI(clients.session(ROOT), timeout=clients.timeout,
+                             accessToken=human.access_token)
         return api.call('/activities/summaries?updated_since={}'.format(
             start_of_day().strftime('%Y%m%dT%H%M%SZ')
         ))
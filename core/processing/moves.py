@@ -7,31 +7,64 @@ import datetime
 
 import moves
 
-from core import db
 from core import app
+from core import priority
 from core.processing import BaseProcessing
+from core.processing.clients import vendor_clients
 
-__all__ = ('MovesProcessing',)
+__all__ = ('MovesProcessing', 'PooledMovesClient')
 
-current_day_start = lambda: datetime.datetime.utcnow().replace(
-    hour=0, minute=0, second=0, microsecond=0
-)
-current_day_end = lambda: datetime.datetime.utcnow().replace(
-    hour=23, minute=59, second=59, microsecond=999
-)
+
+class PooledMovesClient(moves.MovesClient):
+    """
+    `moves.MovesClient` sending requests through shared keep-alive session
+    instead of a new connection per call.
+    """
+
+    def __init__(self, session, timeout=None, **kwargs):
+        """
+        :param session: Instance of `requests.Session`
+        :param timeout: request timeout, seconds
+        """
+        super(PooledMovesClient, self).__init__(**kwargs)
+        self._session = session
+        self._timeout = timeout
+
+    def api(self, path, method='GET', **kwargs):
+        params = dict(kwargs.get('params') or {})
+        access_token = params.pop('access_token', self.access_token)
+        if not access_token:
+            raise moves.MovesAPIError('You must provide a valid access token.')
+
+        resp = self._session.request(
+            method, '{}/{}'.format(self.api_url, path),
+            params=params, data=kwargs.get('data') or {},
+            headers={'Authorization': 'Bearer ' + access_token},
+            timeout=self._timeout)
+        if resp.status_code >= 400:
+            raise moves.MovesAPIError(
+                'Error returned via the API with status code ({}):'.format(
+                    resp.status_code), resp.text)
+        self._last_headers = resp.headers
+        return resp
 
 
 class MovesProcessing(BaseProcessing):
     DATE_FORMAT = '%Y%m%d'
 
-    def process(self):
-        self._check_and_add_final_data_collection()
-        super(MovesProcessing, self).process()
+    base_priority = 4
+
+    def after_save(self, created):
+        if created:
+            self._add_final_data_collection()
 
     @property
     def _moves(self):
         connection = self._user_connection
-        return moves.MovesClient(client_id=connection.access_token,
+        clients = vendor_clients()
+        return PooledMovesClient(clients.session(moves.MovesClient.api_url),
+                                 timeout=clients.timeout,
+                                 client_id=connection.access_token,
                                  client_secret=connection.access_token_secret,
                                  access_token=connection.oauth_token)
 
@@ -42,28 +75,27 @@ class MovesProcessing(BaseProcessing):
             day = datetime.datetime.now()
         return self._moves.user_summary_daily(day.strftime(self.DATE_FORMAT))
 
-    def _check_and_add_final_data_collection(self):
+    def _add_final_data_collection(self):
+        """
+        Schedules final collection of the day. Called for the first event
+        of the day only: upsert of its record tells it's inserted, so
+        neither a separate lookup nor records buffered by history writer
+        let events of the day schedule it twice.
+        """
         request = self._request
-
         try:
-            self._history_session.query(db.HistoricalData).filter(
-                db.HistoricalData.user_id == request.user_id,
-                db.HistoricalData.device_type_id == request.device_type,
-                db.HistoricalData.real_event_type_name == request.event_type,
-                db.HistoricalData.event_time.between(
-                    current_day_start(), current_day_end()
-                )
-            ).first_or_raise()
-        except db.NotFoundException:
-            try:
-                time = request.processing_time
-            except AttributeError:
-                time = datetime.datetime.now()
-            eta = time.replace(day=time.day + 1, hour=2)
-
-            kw = dict(user_id=request.user_id,
-                      seq_id=request.sequence_id,
-                      device_type=request.device_type,
-                      event_type=request.event_type,
-                      processing_timestamp=time.isoformat())
-            app.app.send_task('core.tasks.process_event', kwargs=kw, eta=eta)
+            time = request.processing_time
+        except AttributeError:
+            time = datetime.datetime.now()
+        eta = (time + datetime.timedelta(days=1)).replace(hour=2)
+
+        kw = dict(user_id=request.user_id,
+                  seq_id=request.sequence_id,
+                  device_type=request.device_type,
+                  event_type=request.event_type,
+                  processing_timestamp=time.isoformat())
+        # nobody waits for final collection, it goes after everything else
+        options = priority.route(priority.MIN_PRIORITY) \
+            if app.config.priority.routing else {}
+        app.app.send_task('core.tasks.process_event', kwargs=kw, eta=eta,
+                          **options)
@@ -0,0 +1,55 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import logging
+
+import redis
+
+__all__ = ('RateLimitRegistry',)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitRegistry(object):
+    """
+    Redis-based registry of users throttled by vendor API, shared by all
+    workers.
+
+    User is throttled while key `prefix:device_type:user_id` exists, key's
+    TTL is a delay. Registry fails open: if redis is unavailable users are
+    treated as not throttled.
+    """
+
+    def __init__(self, redis, prefix='ratelimit'):
+        """
+        :param redis: Instance of `redis.StrictRedis`
+        :param prefix: prefix of keys
+        """
+        self._redis = redis
+        self._prefix = prefix
+
+    def delay(self, device_type, user_id, seconds):
+        """
+        Marks user as throttled for `seconds`.
+        """
+        try:
+            self._redis.set(self._key(device_type, user_id), 1,
+                            px=max(int(seconds * 1000), 1))
+        except redis.RedisError:
+            logger.exception("Unable to delay user '{}'".format(user_id))
+
+    def remaining(self, device_type, user_id):
+        """
+        :return: seconds user stays throttled for, 0 if user is not throttled
+        """
+        try:
+            ttl = self._redis.pttl(self._key(device_type, user_id))
+        except redis.RedisError:
+            logger.exception("Unable to check delay of user '{}'"
+                             .format(user_id))
+            return 0
+        return ttl / 1000.0 if ttl and ttl > 0 else 0
+
+    def _key(self, device_type, user_id):
+        return '{}:{}:{}'.format(self._prefix, device_type, user_id)
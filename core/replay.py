@@ -0,0 +1,106 @@
+# coding: utf-8
+
+"""
+Re-sends dumped failed tasks to celery.
+
+    $ python -m core.replay --name core.tasks.process_event \
+        --exception-type ProcessingRetryLimitException --since 1438387200
+
+Tasks are read page by page and published in batches over single
+producer, so redis is never asked for the whole dump at once.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import time
+import logging
+import argparse
+
+__all__ = ('replay',)
+
+logger = logging.getLogger(__name__)
+
+
+def replay(store, celery, batch=500, limit=None, remove=False, pause=0,
+           dry_run=False, **query):
+    """
+    Re-sends tasks matching `query` to `celery`.
+
+    :param store: Instance of `core.dump.RedisDump` or
+      `core.dump.RedisStreamDump` tasks are dumped to
+    :param celery: Instance of `celery.Celery`
+    :param batch: number of tasks read and sent at once
+    :param limit: max number of tasks to replay
+    :param remove: whether replayed tasks are removed from `store`
+    :param pause: seconds to sleep between batches
+    :param dry_run: whether tasks are only counted
+    :param query: `since`, `until` and single indexed field filter, see
+      `core.dump.RedisDump.query`
+    :return: number of replayed tasks
+    """
+    remove = remove and not dry_run
+    replayed, cursor = 0, None
+    while limit is None or replayed < limit:
+        count = batch if limit is None else min(batch, limit - replayed)
+        page, next_cursor = store.query(cursor=cursor, count=count, **query)
+        tasks = [task for _, task in page if task is not None]
+        if tasks and not dry_run:
+            _send(celery, tasks)
+        if remove:
+            # expired ones are removed too, so removed page is never read
+            # again and, unless cursor survives removal, the next one is
+            # the first one
+            store.remove(key for key, _ in page)
+        if not remove or store.stable_cursor:
+            cursor = next_cursor
+        replayed += len(tasks)
+        logger.info('Replayed {} task(s)'.format(replayed))
+        if next_cursor is None:
+            break
+        if pause:
+            time.sleep(pause)
+    return replayed
+
+
+def _send(celery, tasks):
+    with celery.producer_or_acquire() as producer:
+        for task in tasks:
+            celery.send_task(task['name'], args=task['args'],
+                             kwargs=task['kwargs'], producer=producer)
+
+
+def main():
+    from core.app import app
+    from core.app import task_store
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--name', help='full name of task')
+    parser.add_argument('--exception-type', help='name of exception class')
+    parser.add_argument('--since', type=float, help='unix timestamp')
+    parser.add_argument('--until', type=float, help='unix timestamp')
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--pause', type=float, default=0,
+                        help='seconds between batches')
+    parser.add_argument('--remove', action='store_true',
+                        help='remove replayed tasks from dump')
+    parser.add_argument('--dry-run', action='store_true')
+    opts = parser.parse_args()
+
+    query = dict(since=opts.since, until=opts.until)
+    if opts.name and opts.exception_type:
+        parser.error('only one of --name and --exception-type is supported')
+    if opts.name:
+        query['name'] = opts.name
+    if opts.exception_type:
+        query['exception_type'] = opts.exception_type
+
+    logging.basicConfig(level=logging.INFO)
+    print(replay(task_store(), app, batch=opts.batch, limit=opts.limit,
+                 remove=opts.remove, pause=opts.pause, dry_run=opts.dry_run,
+                 **query))
+
+
+if __name__ == '__main__':
+    main()
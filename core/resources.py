@@ -0,0 +1,104 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import os
+import time
+import logging
+import threading
+import collections
+
+__all__ = ('Resources',)
+
+logger = logging.getLogger(__name__)
+
+
+class Resources(object):
+    """
+    Lazy container of process-wide resources: connection pools, engines,
+    sessions of SDKs.
+
+    Resource is created by its factory on first use in every process.
+    Resources created before fork are forgotten by children, so they never
+    share sockets inherited from parent, and parent which never uses them
+    doesn't pay for them at all.
+
+        resources = Resources()
+        resources.register('redis_pool', create_pool)
+        resources.redis_pool.get_connection(...)
+    """
+
+    def __init__(self):
+        self._factories = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = None
+        self._resources = {}
+        self._timings = collections.OrderedDict()
+
+    def register(self, name, factory):
+        """
+        :param name: name resource is accessed by
+        :param factory: callable with no arguments creating resource
+        """
+        self._factories[name] = factory
+
+    def get(self, name):
+        """
+        Returns resource of current process, creates it if needed.
+        :raises: `KeyError` if no resource is registered with `name`
+        """
+        try:
+            if self._pid == os.getpid():
+                return self._resources[name]
+        except KeyError:
+            pass
+        with self._lock:
+            self._reset_if_forked()
+            if name not in self._resources:
+                factory = self._factories[name]
+                started = time.time()
+                self._resources[name] = factory()
+                self._timings[name] = time.time() - started
+                logger.debug("Created '{}' in {:.1f} ms".format(
+                    name, self._timings[name] * 1000))
+            return self._resources[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def init(self, names=None):
+        """
+        Creates resources of current process at once and logs how long it
+        took.
+        :param names: names of resources, all registered ones by default
+        """
+        started = time.time()
+        for name in names or self._factories:
+            self.get(name)
+        logger.info('Resources of process {} are ready in {:.1f} ms ({})'
+                    .format(os.getpid(), (time.time() - started) * 1000,
+                            ', '.join('{}: {:.1f} ms'.format(k, v * 1000)
+                                      for k, v in self.timings().items())))
+
+    def timings(self):
+        """
+        :return: dict of seconds it took to create resources of current
+          process by name
+        """
+        with self._lock:
+            self._reset_if_forked()
+            return collections.OrderedDict(self._timings)
+
+    def _reset_if_forked(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # objects of parent are dropped, not closed: closing would
+            # shut down sockets parent still uses
+            self._resources = {}
+            self._timings = collections.OrderedDict()
+            self._pid = pid
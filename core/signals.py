@@ -2,27 +2,147 @@
 
 
 import logging
-import logstash
 
 from celery import signals
+from billiard.process import current_process
 
+from core.app import resources
+from core.app import AuthSession
+from core.app import HistorySession
 from core.app import task_dump
+from core.app import notify_dump
+from core.app import redis_client
+from core.app import metrics_sink
+from core.app import history_writer
+from core.app import buffered_task_dump
+from core.app import user_event_notifier
+from core.app import system_event_notifier
+from core.app import batched_user_event_notifier
+from core import db
+from core import logship
 from core.dump import Task
+from core.metrics import PrometheusSink
 from core.app import config
 
 logger = logging.getLogger(__name__)
 
+#: `core.db.QueryStats` of running tasks by task id
+_task_queries = {}
+
+#: handler shared by all loggers, forked children restart its thread
+_log_handler = None
+
 
 @signals.task_failure.connect
-def failed_task(task_id, exception, args, kwargs, sender):
-    t = Task(task_id, sender.name, args, kwargs, str(exception))
+def failed_task(task_id, exception, args, kwargs, sender, **named):
+    t = Task(task_id, sender.name, args, kwargs, exception)
     logger.info('Going to dump failed task: {}'.format(t))
     task_dump().dump(t)
 
 
+@signals.task_prerun.connect
+def count_task_queries(task_id=None, **kwargs):
+    if config.query_log.enabled:
+        _task_queries[task_id] = db.start_counting(by_statement=True)
+
+
+@signals.task_postrun.connect
+def log_task_queries(task_id=None, task=None, **kwargs):
+    stats = _task_queries.pop(task_id, None)
+    if stats is None:
+        return
+    db.stop_counting(stats)
+
+    tags = dict(task=task.name)
+    metrics_sink().incr('task.db.queries', stats.count, tags)
+    metrics_sink().timing('task.db', stats.time, tags)
+
+    statement, repeated = stats.most_repeated()
+    message = '{}[{}] executed {} statement(s) in {:.1f} ms, {} slow'.format(
+        task.name, task_id, stats.count, stats.time * 1000, len(stats.slow))
+    if repeated > 1:
+        message += ', most repeated {} times: {}'.format(repeated,
+                                                         statement[:200])
+    # fields of record are shipped to logstash as they are
+    logger.info(message, extra=dict(
+        task_name=task.name, task_id=task_id,
+        sql_statements=stats.count, sql_time=stats.time,
+        sql_repeated=repeated,
+        sql_slow=[dict(statement=q.statement, parameters=q.parameters,
+                       time=q.time) for q in stats.slow]))
+
+
+@signals.task_postrun.connect
+def release_sessions(**kwargs):
+    """
+    Closes scoped sessions of the task, so connections go back to pools and
+    next task's reads choose replica anew.
+    """
+    AuthSession.remove()
+    HistorySession.remove()
+
+
+@signals.worker_process_init.connect
+def init_clients(**kwargs):
+    """
+    Creates resources and long-lived clients of child process before it
+    gets tasks.
+    """
+    resources.init()
+    redis_client()
+    task_dump()
+    notify_dump()
+    user_event_notifier()
+    system_event_notifier()
+    serve_metrics()
+
+
+def serve_metrics():
+    sink = metrics_sink()
+    if isinstance(sink, PrometheusSink) and config.metrics.port:
+        # every child has own metrics, so each one listens on own port
+        index = getattr(current_process(), 'index', 0) or 0
+        sink.serve(config.metrics.port + index)
+
+
+@signals.worker_process_shutdown.connect
+def close_history_writer(**kwargs):
+    if config.history_batch.enabled:
+        history_writer().close()
+
+
+@signals.worker_process_shutdown.connect
+def close_user_event_notifier(**kwargs):
+    if config.rabbitmq_batch.enabled:
+        batched_user_event_notifier().close()
+
+
+@signals.worker_process_shutdown.connect
+def close_system_event_notifier(**kwargs):
+    # before task dump is closed: failed events are dumped as failed tasks
+    if config.sns.async_workers:
+        system_event_notifier().close()
+
+
+@signals.worker_process_shutdown.connect
+def close_task_dump(**kwargs):
+    if config.dump.batch_enabled:
+        buffered_task_dump().close()
+
+
+@signals.worker_process_shutdown.connect
+def close_log_handler(**kwargs):
+    # last one: records of other closing clients are still shipped
+    if _log_handler is not None:
+        _log_handler.close()
+
+
 @signals.after_setup_logger.connect
 @signals.after_setup_task_logger.connect
-def after_setup_logger_handler(logger=None):
-    logger.addHandler(logstash.TCPLogstashHandler(host=config.logstash.host,
-                                                  port=config.logstash.port,
-                                                  version=1))
+def after_setup_logger_handler(logger=None, **kwargs):
+    global _log_handler
+    if not config.logstash.host:
+        return
+    if _log_handler is None:
+        _log_handler = logship.create_log_handler(config.logstash)
+    logger.addHandler(_log_handler)
@@ -2,46 +2,218 @@
 
 
 import uuid
-import datetime
+import logging
+import functools
 
-import iso8601
+import redis
 
+from core import utils
 from core.app import app
+from core.app import alert_aggregator
+from core.app import config
+from core.app import event_coalescer
+from core.app import metrics_sink
 from core.app import notify_dump
+from core.app import rate_limits
 from core.app import system_event_notifier
+from core.app import task_dump
+from core.app import user_event_notifier
+from core.dump import Task
 from core.notify import SystemEvent
+from core.notify import UserEvent
 from core.processing import TimedProcessingRequest
 from core.processing import create_processing
+from core.processing import process_bulk
 from core.processing.exc import ProcessingRetryLimitException
 
 
-__all__ = ('process_event', 'notify_error')
+__all__ = ('process_event', 'process_events_bulk', 'notify_error',
+           'notify_digest')
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_time(processing_timestamp):
+    # the same parsing as the one of `core.priority.PriorityRouter`, so
+    # queue and notification get the same priority
+    return utils.parse_timestamp(processing_timestamp) or utils.utcnow()
 
 
 @app.task
 def process_event(user_id=None, seq_id=None, device_type=None,
-                  event_type=None, processing_timestamp=None):
-    try:
-        processing_time = iso8601.parse_date(processing_timestamp)
-    except iso8601.ParseError:
-        processing_time = datetime.datetime.now()
+                  event_type=None, processing_timestamp=None,
+                  debounce=True, pending=False):
+    """
+    :param debounce: whether event may be coalesced with following ones of
+      the same user, device and event type
+    :param pending: whether task processes pending event of coalescing
+      window instead of the passed one
+    """
+    kwargs = dict(user_id=user_id, seq_id=seq_id, device_type=device_type,
+                  event_type=event_type,
+                  processing_timestamp=processing_timestamp)
+
+    if pending:
+        event = event_coalescer().take(user_id, device_type, event_type)
+        if event is not None:
+            taken = dict(kwargs, seq_id=event.sequence_id, debounce=False)
+            taken['processing_timestamp'] = event.processing_timestamp
+            _dispatch_taken(taken)
+        return
+
+    delay = rate_limits().remaining(device_type, user_id)
+    if delay:
+        # user is throttled by vendor API, postpone without touching db
+        metrics_sink().incr('process_event.delayed',
+                            tags=_metric_tags(device_type, event_type))
+        process_event.apply_async(kwargs=dict(kwargs, debounce=debounce,
+                                              pending=pending),
+                                  countdown=delay)
+        return
+
+    if debounce and config.coalesce.window:
+        if event_coalescer().offer(user_id, device_type, event_type, seq_id,
+                                   processing_timestamp):
+            process_event.apply_async(kwargs=dict(kwargs, pending=True),
+                                      countdown=config.coalesce.window)
+        else:
+            # folded into pending event of already opened window
+            metrics_sink().incr('process_event.coalesced',
+                                tags=_metric_tags(device_type, event_type))
+        return
 
     request = TimedProcessingRequest(user_id, seq_id, device_type,
-                                     event_type, processing_time)
+                                     event_type,
+                                     _parse_time(processing_timestamp))
 
     try:
         with create_processing(request) as processing:
             processing.process()
     except ProcessingRetryLimitException as e:
-        process_event.retry(countdown=e.retry, exc=e)
+        metrics_sink().incr('process_event.retries',
+                            tags=_metric_tags(device_type, event_type))
+        process_event.retry(kwargs=dict(kwargs, debounce=False),
+                            countdown=e.retry, exc=e)
+
+
+def _dispatch_taken(kwargs):
+    """
+    Sends event taken from its coalescing window to a task of its own, so
+    failures of processing dump the event itself instead of the emptied
+    window. The event is dumped right away if it can't be sent.
+    """
+    try:
+        process_event.apply_async(kwargs=kwargs)
+    except Exception as exc:
+        logger.exception("Unable to send pending event '{}'"
+                         .format(kwargs['seq_id']))
+        task_dump().dump(Task(process_event.request.id or str(uuid.uuid4()),
+                              process_event.name, [], kwargs, exc))
+
+
+def _metric_tags(device_type, event_type):
+    return dict(device_type=device_type, event_type=event_type)
+
+
+@app.task
+def process_events_bulk(events):
+    """
+    Processes many events at once. Failed ones are re-sent to
+    `process_event` one by one.
+
+    :param events: list of dicts of `process_event` kwargs
+    :return: list of dicts with `user_id`, `seq_id`, `ok` and `error`
+    """
+    requests = [TimedProcessingRequest(e.get('user_id'), e.get('seq_id'),
+                                       e.get('device_type'),
+                                       e.get('event_type'),
+                                       _parse_time(
+                                           e.get('processing_timestamp')))
+                for e in events]
+    return [dict(user_id=r.request.user_id,
+                 seq_id=r.request.sequence_id,
+                 ok=r.ok,
+                 error=None if r.ok else str(r.error))
+            for r in process_bulk(requests)]
+
+
+@app.task
+def notify_user_event(body, priority):
+    """
+    Publishes notification of processed event. Dumped for notifications
+    which batched publishing failed to deliver, see `core.replay`.
+    """
+    user_event_notifier().send(UserEvent(body, priority))
 
 
 @app.task
-def notify_error(time, err_type, message):
+def notify_error(time, err_type, message, aggregate=True):
+    """
+    :param aggregate: whether event may be sent in digest with following
+      ones of the same type and message pattern
+    """
     event = SystemEvent(str(uuid.uuid4()), time, err_type, message)
+    if aggregate and config.alerts.window:
+        try:
+            if alert_aggregator().add(event):
+                notify_digest.apply_async((err_type, message),
+                                          countdown=config.alerts.window)
+            return
+        except redis.RedisError:
+            # sending every event is better than losing them
+            logger.exception("Unable to aggregate '{}' event"
+                             .format(err_type))
+
+    _send_system_event(notify_error, event, (time, err_type, message),
+                       dict(aggregate=False))
+
+
+@app.task
+def notify_digest(err_type, message, event=None):
+    """
+    Sends digest of events collected in aggregation window opened by event
+    of `err_type` and `message`.
+
+    :param event: dict of digest's `SystemEvent`, passed on retries only
+    """
+    if event is None:
+        digest = alert_aggregator().take(err_type, message)
+        if digest is None:
+            return
+        event = digest.event(str(uuid.uuid4()))
+    else:
+        event = SystemEvent(**event)
+
+    # digest is already taken from redis, so retries carry it
+    _send_system_event(notify_digest, event, (err_type, message),
+                       dict(event=event._asdict()))
+
+
+def _send_system_event(task, event, args, kwargs):
+    """
+    Sends `event` and dumps it once it's sent.
+
+    Failed synchronous sending retries `task` with `kwargs`. Asynchronous
+    sending doesn't block the task, so failed one is dumped as failed
+    `task` to be replayed.
+    """
+    if config.sns.async_workers:
+        system_event_notifier().send(event).add_done_callback(
+            functools.partial(_system_event_sent, task, event, args, kwargs))
+        return
+
     try:
         system_event_notifier().send(event)
     except Exception as exc:
-        raise notify_error.retry(countdown=10, exc=exc, max_retry=3)
+        raise task.retry(kwargs=kwargs, countdown=10, exc=exc, max_retries=3)
 
     notify_dump().dump(event)
+
+
+def _system_event_sent(task, event, args, kwargs, future):
+    exc = future.exception()
+    if exc is None:
+        notify_dump().dump(event)
+        return
+    logger.error("Unable to send '{}' event: {!r}".format(event.type, exc))
+    task_dump().dump(Task(event.id, task.name, args, kwargs, exc))
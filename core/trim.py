@@ -0,0 +1,59 @@
+# coding: utf-8
+
+"""
+Removes dumped tasks and notifications older than retention.
+
+    $ python -m core.trim [--max-age 604800] [--backfill]
+
+Dumping processes trim only a few chunks of old objects at a time, so
+the rest is left to this command, e.g. run hourly by cron. `--backfill`
+indexes objects dumped before the dump was indexed by time first, so they
+are trimmed once retention is over.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import logging
+import argparse
+
+__all__ = ('trim',)
+
+logger = logging.getLogger(__name__)
+
+
+def trim(store, max_age=None, backfill=False):
+    """
+    :param store: Instance of `core.dump.RedisDump`
+    :param max_age: seconds, retention of `store` by default
+    :param backfill: whether not indexed objects are indexed first
+    :return: number of removed objects
+    """
+    if backfill:
+        logger.info('Indexed {} object(s)'.format(store.backfill()))
+    return store.trim(max_age)
+
+
+def main():
+    from core.app import config
+    from core.app import task_store
+    from core.app import notify_dump
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--max-age', type=float,
+                        help='seconds, DUMP_RETENTION or DUMP_TTL by default')
+    parser.add_argument('--backfill', action='store_true',
+                        help='index objects which are not indexed by time')
+    opts = parser.parse_args()
+
+    if config.dump.backend != 'hash':
+        parser.error('stream dump is capped by DUMP_STREAM_MAXLEN instead')
+
+    logging.basicConfig(level=logging.INFO)
+    for store in (task_store(), notify_dump()):
+        print(trim(store, opts.max_age, opts.backfill))
+
+
+if __name__ == '__main__':
+    main()
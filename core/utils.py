@@ -3,15 +3,212 @@
 
 from __future__ import absolute_import
 
+import os
+import time
+import logging
+import functools
+import datetime
+import threading
+
+import iso8601
+from iso8601.iso8601 import UTC
+
 try:
     import simplejson as json
 except ImportError:
     import json
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+__all__ = ('json', 'raise_on', 'process_local', 'parse_timestamp',
+           'utcnow', 'Batcher')
 
-__all__ = ('json', 'raise_on')
+logger = logging.getLogger(__name__)
 
 
 def raise_on(condition, message='Condition failed'):
     if not condition:
         raise ValueError(message)
+
+
+def parse_timestamp(value, default=None):
+    """
+    Parses ISO 8601 timestamp of event. Naive timestamps are UTC ones.
+
+    :param default: value returned if `value` is empty or invalid
+    :return: timezone-aware `datetime`
+    """
+    if not value:
+        return default
+    try:
+        return iso8601.parse_date(value, default_timezone=UTC)
+    except iso8601.ParseError:
+        return default
+
+
+def utcnow():
+    """
+    :return: timezone-aware current utc `datetime`
+    """
+    return datetime.datetime.now(UTC)
+
+
+def process_local(factory):
+    """
+    Memoizes result of `factory()` per process, so objects owning threads
+    or sockets are never shared between forked workers.
+    """
+    cache = {}
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def wrapper():
+        pid = os.getpid()
+        try:
+            return cache[pid]
+        except KeyError:
+            pass
+        with lock:
+            if pid not in cache:
+                cache.clear()
+                cache[pid] = factory()
+            return cache[pid]
+
+    return wrapper
+
+
+class _FlushMarker(object):
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class Batcher(object):
+    """
+    Buffers items and passes them to `flush` in batches from a background
+    thread.
+
+    Batch is flushed when `size` items are buffered or `interval` seconds
+    passed since its first item was taken. The thread is started on first
+    `put` and restarted in forked children.
+    """
+
+    def __init__(self, flush, size=100, interval=1.0, maxsize=0,
+                 name='batcher'):
+        """
+        :param flush: callable accepting list of items
+        :param size: max number of items in single batch
+        :param interval: max seconds item waits for its batch
+        :param maxsize: max number of buffered items, 0 means unbounded
+        :param name: name of background thread
+        """
+        self._flush = flush
+        self._size = size
+        self._interval = interval
+        self._maxsize = maxsize
+        self._name = name
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Buffers `item`. Returns `False` if buffer is full and `block` is
+        `False` (or `timeout` expired), `True` otherwise.
+        """
+        q = self._ensure_started()
+        try:
+            q.put(item, block, timeout)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Blocks until items buffered before the call are flushed.
+        """
+        if not self._started:
+            return
+        marker = _FlushMarker()
+        self._queue.put(marker, True, timeout)
+        marker.done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Flushes buffered items and stops background thread.
+        """
+        with self._lock:
+            if not self._started:
+                return
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._pid = self._queue = self._thread = None
+
+    @property
+    def _started(self):
+        return self._thread is not None and self._pid == os.getpid() and \
+            self._thread.is_alive()
+
+    def _ensure_started(self):
+        if self._started:
+            return self._queue
+        with self._lock:
+            if not self._started:
+                if self._queue is None or self._pid != os.getpid():
+                    self._queue = queue.Queue(self._maxsize)
+                elif self._thread is not None:
+                    logger.error("'{}' thread died, restarting it"
+                                 .format(self._name))
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._queue,),
+                                                name=self._name)
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, q):
+        stop = False
+        while not stop:
+            batch, markers, stop = self._collect(q)
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception:
+                    logger.exception("'{}' failed to flush {} item(s)"
+                                     .format(self._name, len(batch)))
+            for marker in markers:
+                marker.done.set()
+
+    def _collect(self, q):
+        batch, markers, deadline = [], [], None
+        while len(batch) < self._size:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+            try:
+                item = q.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, _FlushMarker):
+                markers.append(item)
+                break
+            batch.append(item)
+            if deadline is None:
+                deadline = time.time() + self._interval
+        return batch, markers, False
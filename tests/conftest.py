@@ -0,0 +1,27 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+
+
+class StubSNS(object):
+    """
+    Stand-in of boto3 SNS client recording published messages, fails with
+    `error` if it's set.
+    """
+
+    def __init__(self):
+        self.published = []
+        self.error = None
+
+    def publish(self, **kwargs):
+        self.published.append(kwargs)
+        if self.error is not None:
+            raise self.error
+        return dict(MessageId=str(len(self.published)))
+
+
+@pytest.fixture
+def sns():
+    return StubSNS()
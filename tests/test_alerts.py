@@ -0,0 +1,78 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+
+import pytest
+
+from core import alerts
+from core.notify import SystemEvent
+from core.notify import EmailEventNotifier
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def aggregator():
+    return alerts.AlertAggregator(fakeredis.FakeStrictRedis(), window=60,
+                                  samples=2)
+
+
+def event(message, time='2015-08-01T00:00:00', type='ProcessingError'):
+    return SystemEvent('id', time, type, message)
+
+
+def test_normalize_shares_pattern_of_variable_parts():
+    assert alerts.normalize("User 'u-1' failed after 3 retries") == \
+        alerts.normalize("User 'u-22' failed after 10 retries") == \
+        "User '<str>' failed after <n> retries"
+
+
+def test_only_first_event_opens_window(aggregator):
+    assert aggregator.add(event('Timeout of user 1'))
+    assert not aggregator.add(event('Timeout of user 2'))
+    assert aggregator.add(event('Timeout of user 1', type='OtherError'))
+
+
+def test_take_pops_digest_of_window(aggregator):
+    for i, time in enumerate(('2015-08-01T00:00:00', '2015-08-01T00:00:30',
+                              '2015-08-01T00:00:59')):
+        aggregator.add(event('Timeout of user {}'.format(i), time))
+
+    digest = aggregator.take('ProcessingError', 'Timeout of user 7')
+
+    assert digest == alerts.AlertDigest(
+        'ProcessingError', 'Timeout of user <n>', 3, '2015-08-01T00:00:00',
+        '2015-08-01T00:00:59', ['Timeout of user 0', 'Timeout of user 1'])
+    assert aggregator.take('ProcessingError', 'Timeout of user 7') is None
+
+
+def test_digest_of_single_event_is_the_event(aggregator):
+    aggregator.add(event('Timeout of user 1'))
+
+    digest = aggregator.take('ProcessingError', 'Timeout of user 1')
+
+    assert digest.event('digest') == SystemEvent(
+        'digest', '2015-08-01T00:00:00', 'ProcessingError',
+        'Timeout of user 1')
+
+
+def test_digest_is_sent_as_single_sns_message(aggregator, sns):
+    notifier = EmailEventNotifier(sns, 'topic', 'subject', 'json')
+    for i in range(5):
+        aggregator.add(event('Timeout of user {}'.format(i)))
+
+    digest = aggregator.take('ProcessingError', 'Timeout of user 9')
+    notifier.send(digest.event('digest'))
+
+    assert len(sns.published) == 1
+    published = sns.published[0]
+    assert (published['TopicArn'], published['Subject']) == \
+        ('topic', 'subject')
+    message = json.loads(published['Message'])
+    assert message['default'].startswith(
+        '[ProcessingError] at 2015-08-01T00:00:00: 5 event(s) from '
+        '2015-08-01T00:00:00 to 2015-08-01T00:00:00: Timeout of user <n>')
+    assert '* Timeout of user 1' in message['email']
+    assert '* Timeout of user 2' not in message['email']
@@ -0,0 +1,44 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+
+from core.coalesce import EventCoalescer
+from core.coalesce import PendingEvent
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def coalescer():
+    return EventCoalescer(fakeredis.FakeStrictRedis(), window=60)
+
+
+def test_only_first_event_opens_window(coalescer):
+    assert coalescer.offer('user', 1, 'activities', 'seq-1')
+    assert not coalescer.offer('user', 1, 'activities', 'seq-2')
+    assert coalescer.offer('user', 1, 'sleep', 'seq-3')
+    assert coalescer.offer('other', 1, 'activities', 'seq-4')
+
+
+def test_take_pops_the_latest_event_of_window(coalescer):
+    coalescer.offer('user', 1, 'activities', 'seq-1', '2015-08-01T00:00:00')
+    coalescer.offer('user', 1, 'activities', 'seq-2', '2015-08-01T00:00:05')
+    coalescer.offer('user', 1, 'activities', 'seq-3')
+
+    assert coalescer.take('user', 1, 'activities') == \
+        PendingEvent('seq-3', None, 2)
+    assert coalescer.take('user', 1, 'activities') is None
+    # the next event opens a new window
+    assert coalescer.offer('user', 1, 'activities', 'seq-4')
+
+
+def test_merged_events_are_counted_by_type(coalescer):
+    for seq_id in ('seq-1', 'seq-2', 'seq-3'):
+        coalescer.offer('user', 1, 'activities', seq_id)
+    coalescer.offer('user', 1, 'sleep', 'seq-4')
+    coalescer.take('user', 1, 'activities')
+    coalescer.take('user', 1, 'sleep')
+
+    assert coalescer.merged() == {'1:activities': 2}
@@ -0,0 +1,111 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+
+from core import dump
+from core.dump import Task
+from core.dump import RedisDump
+from core.dump import JsonCodec
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeStrictRedis()
+
+
+def task(id, name='core.tasks.process_event'):
+    return Task(id, name, [1], dict(seq_id='seq'), IOError('timeout'))
+
+
+def stored(store, **query):
+    return [key for key, _ in store.query(**query)[0]]
+
+
+def age(redis, store_key, hash_key, seconds):
+    redis.execute_command('ZINCRBY', store_key + ':index', -seconds, hash_key)
+
+
+@pytest.mark.parametrize('codec', ['json', 'msgpack'])
+def test_codec_round_trip(codec):
+    if codec == 'msgpack':
+        pytest.importorskip('msgpack')
+    codec = dump.create_codec(dump.DumpConfig(None, codec=codec,
+                                              compress_threshold=64))
+    obj = task('id')._replace(args=['x' * 100])
+
+    assert codec.decode(codec.encode(obj)) == dict(obj._asdict())
+
+
+def test_msgpack_codec_decodes_hashes_dumped_with_json(redis):
+    pytest.importorskip('msgpack')
+    RedisDump(redis, 'tasks').dump(task('old'))
+    store = RedisDump(redis, 'tasks', codec=dump.MsgpackCodec())
+    store.dump(task('new'))
+
+    page, _ = store.query()
+
+    assert [(key, obj['id']) for key, obj in page] == [
+        ('tasks:old', 'old'), ('tasks:new', 'new')]
+
+
+def test_dumped_hash_expires_by_ttl(redis):
+    RedisDump(redis, 'tasks', ttl=60).dump(task('id'))
+
+    assert 0 < redis.ttl('tasks:id') <= 60
+
+
+def test_dump_trims_few_chunks_once_per_interval(monkeypatch, redis):
+    monkeypatch.setattr(RedisDump, 'TRIM_CHUNK', 2)
+    store = RedisDump(redis, 'tasks', retention=60)
+    store.dump_many(task(i) for i in range(7))
+    for i in range(7):
+        age(redis, 'tasks:all', 'tasks:{}'.format(i), 120)
+    redis.delete('tasks:all:trimmed')
+
+    # the other process trims
+    RedisDump(redis, 'tasks', retention=60).dump(task('new'))
+    store.dump(task('newer'))
+
+    # only `DUMP_TRIM_CHUNKS` chunks are trimmed, interval is shared
+    assert stored(store) == ['tasks:4', 'tasks:5', 'tasks:6', 'tasks:new',
+                             'tasks:newer']
+    assert not redis.exists('tasks:0')
+    assert store.trim() == 3
+    assert stored(store) == ['tasks:new', 'tasks:newer']
+    assert redis.smembers('tasks:all') == {b'tasks:new', b'tasks:newer'}
+
+
+def test_trim_removes_objects_from_field_indexes(redis):
+    store = RedisDump(redis, 'tasks', indexed=('name',))
+    store.dump(task('old', name='a'))
+    age(redis, 'tasks:all', 'tasks:old', 120)
+    store.dump(task('new', name='a'))
+
+    assert store.trim(60) == 1
+
+    assert stored(store, name='a') == ['tasks:new']
+
+
+def test_trim_requires_max_age_or_retention(redis):
+    with pytest.raises(ValueError):
+        RedisDump(redis, 'tasks').trim()
+
+
+def test_backfill_indexes_objects_dumped_before_index(redis):
+    codec = JsonCodec()
+    for id in ('kept', 'expired'):
+        redis.sadd('tasks:all', 'tasks:' + id)
+    redis.hmset('tasks:kept', codec.encode(task('kept')))
+    store = RedisDump(redis, 'tasks', retention=60)
+
+    assert store.backfill() == 1
+
+    assert stored(store) == ['tasks:kept']
+    assert redis.smembers('tasks:all') == {b'tasks:kept'}
+    age(redis, 'tasks:all', 'tasks:kept', 120)
+    assert store.trim() == 1
+    assert redis.scard('tasks:all') == 0
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import collections
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core.db import batch
+from core.db import HistoryRecord
+from core.db import HistoryWriter
+
+EventType = collections.namedtuple('EventType', 'id')
+
+
+class StubSession(object):
+    """
+    Stand-in of history db session replying to upsert with `rows`.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+        self.committed = False
+
+    def execute(self, statement):
+        self.statements.append(str(statement.compile(
+            dialect=postgresql.dialect())))
+        return iter(self.rows)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def event_type(monkeypatch):
+    monkeypatch.setattr(batch, 'lookup',
+                        lambda session, model, value: EventType(1))
+
+
+def record(user_id, sequence_id):
+    return HistoryRecord(sequence_id, user_id, 6, 'activities',
+                         dict(steps=1))
+
+
+def test_upsert_tells_records_inserted_as_first_ones_of_day():
+    records = [record('a', 'seq-1'), record('b', 'seq-2'),
+               record('a', 'seq-3')]
+    session = StubSession([('a', 6, 'activities', True),
+                           ('b', 6, 'activities', False)])
+
+    created = batch.upsert_historical_data(session, records)
+
+    # only the latest record of a key is written
+    assert created == [False, False, True]
+    assert len(session.statements) == 1
+    assert 'ON CONFLICT' in session.statements[0]
+    assert session.statements[0].endswith('xmax = 0')
+
+
+def test_upsert_of_no_records_executes_nothing():
+    session = StubSession()
+
+    assert batch.upsert_historical_data(session, []) == []
+    assert session.statements == []
+
+
+def test_writer_resolves_futures_with_first_of_day_flags():
+    session = StubSession([('a', 6, 'activities', True)])
+    writer = HistoryWriter(lambda: session, size=2, interval=1)
+    try:
+        first = writer.submit(record('a', 'seq-1'))
+        second = writer.submit(record('a', 'seq-2'))
+        # only the latest record of a key is inserted
+        assert (first.result(5), second.result(5)) == (False, True)
+    finally:
+        writer.close()
+
+    assert session.committed
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import datetime
+
+import pytest
+import sqlalchemy
+
+from core import db
+
+
+@pytest.fixture
+def engine():
+    return db.instrument_engine(sqlalchemy.create_engine('sqlite://'))
+
+
+def test_nested_blocks_count_their_statements(engine):
+    with db.count_queries() as outer:
+        engine.execute('SELECT 1')
+        with db.count_queries(by_statement=True) as inner:
+            engine.execute('SELECT 2')
+            engine.execute('SELECT 2')
+
+    assert (outer.count, inner.count) == (3, 2)
+    assert inner.most_repeated() == ('SELECT 2', 2)
+    assert outer.most_repeated() == (None, 0)
+    assert outer.time >= inner.time > 0
+
+
+def test_statements_out_of_blocks_are_not_counted(engine):
+    engine.execute('SELECT 1')
+    stats = db.start_counting()
+    db.stop_counting(stats)
+    engine.execute('SELECT 1')
+
+    assert stats.count == 0
+
+
+def test_engine_is_instrumented_once(engine):
+    db.instrument_engine(engine)
+
+    with db.count_queries() as stats:
+        engine.execute('SELECT 1')
+
+    assert stats.count == 1
+
+
+def test_slow_statements_are_kept_with_redacted_parameters():
+    engine = db.instrument_engine(sqlalchemy.create_engine('sqlite://'),
+                                  slow=0)
+
+    with db.count_queries() as stats:
+        engine.execute('SELECT ?, ?', ('secret-token', 42))
+
+    assert len(stats.slow) == 1
+    assert stats.slow[0].statement == 'SELECT ?, ?'
+    assert stats.slow[0].parameters == ['<str of 12>', '<int>']
+
+
+def test_redact_hides_values():
+    assert db.redact(dict(token='secret', day=datetime.date.today(),
+                          flag=None)) == \
+        dict(token='<str of 6>', day='<date>', flag=None)
+    assert db.redact([('a', 1), ('b', 2)], executemany=True) == \
+        [['<str of 1>', '<int>'], '... 2 set(s)']
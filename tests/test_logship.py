@@ -0,0 +1,187 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import socket
+import logging
+import threading
+
+import pytest
+
+pytest.importorskip('logstash')
+
+from core import logship  # noqa
+
+
+class Listener(object):
+    """
+    Stand-in of logstash TCP input collecting received lines.
+    """
+
+    def __init__(self, port=0):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', port))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        self.lines = []
+        self._received = threading.Condition()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def wait(self, count, timeout=5):
+        """
+        :return: list of at least `count` received lines, fewer ones if
+          they didn't come in `timeout` seconds
+        """
+        with self._received:
+            if len(self.lines) < count:
+                self._received.wait(timeout)
+            return list(self.lines)
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except (socket.error, IOError):
+                return
+            thread = threading.Thread(target=self._read, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, connection):
+        for line in connection.makefile('rb'):
+            with self._received:
+                self.lines.append(line.rstrip(b'\n'))
+                self._received.notify_all()
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+@pytest.fixture
+def listener():
+    listener = Listener()
+    yield listener
+    listener.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(logship.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_records_are_shipped_as_logstash_events(listener):
+    handler = logship.QueuedLogstashHandler('127.0.0.1', listener.port,
+                                            interval=0.01)
+    logger = logging.getLogger('tests.logship')
+    logger.addHandler(handler)
+    try:
+        logger.warning('Task %s failed', 'abc', extra=dict(user_id='user'))
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    events = [json.loads(line.decode('utf-8'))
+              for line in listener.wait(1)]
+    assert len(events) == 1
+    assert (events[0]['message'], events[0]['user_id']) == \
+        ('Task abc failed', 'user')
+    assert '@timestamp' in events[0]
+    assert handler.dropped == 0
+
+
+def test_sender_backs_off_and_drops_batch_of_unreachable_host(sleeps):
+    sender = logship.TCPSender('127.0.0.1', free_port(), retries=3,
+                               backoff=0.5, max_backoff=1)
+
+    assert not sender.send([b'a', b'b'])
+
+    assert sleeps == [0.5, 1, 1]
+    assert (sender.sent, sender.dropped) == (0, 2)
+
+
+def test_sender_reconnects_once_host_is_back(sleeps):
+    port = free_port()
+    sender = logship.TCPSender('127.0.0.1', port, retries=1, backoff=0.5)
+    assert not sender.send([b'lost'])
+
+    listener = Listener(port)
+    try:
+        assert sender.send([b'first'])
+        assert sender.send([b'second'])
+        assert listener.wait(2) == [b'first', b'second']
+    finally:
+        sender.close()
+        listener.close()
+
+    assert (sender.sent, sender.dropped) == (2, 1)
+    # successful send resets backoff
+    assert sleeps == [0.5]
+
+
+class BlockedSender(object):
+    """
+    Sender whose sending waits for `release`.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.dropped = 0
+        self.release = threading.Event()
+
+    def send(self, lines):
+        self.release.wait(5)
+        self.sent.extend(lines)
+
+    def close(self):
+        pass
+
+
+def test_records_over_queue_size_are_dropped_without_blocking():
+    sender = BlockedSender()
+    handler = logship.QueuedLogstashHandler(None, size=1, interval=0,
+                                            maxsize=2, sender=sender)
+    logger = logging.getLogger('tests.logship.full')
+    logger.addHandler(handler)
+    try:
+        for i in range(10):
+            logger.warning('record %s', i)
+        dropped = handler.dropped
+        sender.release.set()
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    # one record may be taken by the blocked sender before queue filled up
+    assert dropped in (7, 8)
+    assert len(sender.sent) + dropped == 10
+
+
+def test_records_of_sender_thread_are_not_shipped():
+    sender = BlockedSender()
+    sender.release.set()
+    handler = logship.QueuedLogstashHandler(None, interval=0,
+                                            sender=sender)
+    record = logging.makeLogRecord(dict(msg='sender failed'))
+    thread = threading.Thread(target=handler.emit, args=(record,),
+                              name=logship.THREAD_NAME)
+    thread.start()
+    thread.join()
+    handler.close()
+
+    assert sender.sent == []
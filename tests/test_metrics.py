@@ -0,0 +1,85 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import socket
+
+import pytest
+
+from core import metrics
+from core.metrics import MetricsConfig
+
+
+def test_memory_sink_keeps_metrics_by_name_and_tags():
+    sink = metrics.MemorySink()
+    tags = dict(event_type='activities', device_type=1)
+
+    sink.timing('processing.api', 0.2, tags)
+    sink.timing('processing.api', 0.3, dict(tags))
+    sink.incr('processing.errors', tags=tags)
+    with sink.timer('processing.save'):
+        pass
+
+    key = (('device_type', 1), ('event_type', 'activities'))
+    assert sink.timings[('processing.api', key)] == [0.2, 0.3]
+    assert len(sink.timings[('processing.save', ())]) == 1
+    assert sink.counters == {('processing.errors', key): 1}
+
+
+def test_null_sink_is_disabled():
+    sink = metrics.create_sink(MetricsConfig('', '', 0, 'core'))
+
+    assert not sink.enabled
+    with sink.timer('processing.api'):
+        pass
+
+
+def test_unknown_sink_is_rejected():
+    with pytest.raises(ValueError):
+        metrics.create_sink(MetricsConfig('graphite', '', 0, 'core'))
+
+
+@pytest.fixture
+def udp():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    yield server
+    server.close()
+
+
+def test_statsd_sink_sends_tags_as_name_parts(udp):
+    sink = metrics.create_sink(MetricsConfig('statsd', '127.0.0.1',
+                                             udp.getsockname()[1], 'core'))
+
+    sink.timing('processing.api', 0.25, dict(device_type=1,
+                                             event_type='body.weight'))
+    sink.incr('process_event.delayed')
+
+    assert udp.recv(512) == b'core.processing.api.1.body_weight:250.000|ms'
+    assert udp.recv(512) == b'core.process_event.delayed:1|c'
+
+
+def test_statsd_sink_defaults_to_statsd_port():
+    sink = metrics.create_sink(MetricsConfig('statsd', 'localhost', 0, ''))
+
+    assert sink._address == ('localhost', 8125)
+
+
+def test_prometheus_sink_renders_counters_and_summaries():
+    sink = metrics.PrometheusSink('core')
+    tags = dict(device_type=1, event_type='sleep')
+    sink.timing('processing.api', 0.5, tags)
+    sink.timing('processing.api', 0.25, tags)
+    sink.incr('processing.errors', tags=dict(tags, error='Timeout'))
+
+    assert sink.exposition().splitlines() == [
+        '# TYPE core_processing_errors_total counter',
+        'core_processing_errors_total{device_type="1",error="Timeout",'
+        'event_type="sleep"} 1.0',
+        '# TYPE core_processing_api_seconds summary',
+        'core_processing_api_seconds_count{device_type="1",'
+        'event_type="sleep"} 2',
+        'core_processing_api_seconds_sum{device_type="1",'
+        'event_type="sleep"} 0.75',
+    ]
@@ -0,0 +1,241 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import uuid
+import collections
+
+import kombu
+import pytest
+
+from core import notify
+from core.notify import UserEvent
+
+
+@pytest.fixture
+def exchange():
+    return notify.create_exchange('events-{}'.format(uuid.uuid4()), 'direct')
+
+
+@pytest.fixture
+def queue(exchange):
+    queue = kombu.Queue(exchange.name, exchange, routing_key='key')
+    with kombu.Connection('memory://') as conn:
+        queue(conn.channel()).declare()
+    return queue
+
+
+def received(queue):
+    messages = []
+    with kombu.Connection('memory://') as conn:
+        bound = queue(conn.channel())
+        message = bound.get()
+        while message is not None:
+            messages.append((message.payload, message.headers))
+            message = bound.get()
+    return messages
+
+
+def test_batched_notifier_publishes_events_in_order(exchange, queue):
+    notifier = notify.BatchedRabbitMQEventNotifier(
+        kombu.Connection('memory://'), 'key', exchange, size=2, interval=5)
+    try:
+        for i in range(3):
+            notifier.send(UserEvent(dict(sequence_id=i), 5))
+        notifier.flush(5)
+    finally:
+        notifier.close()
+
+    assert received(queue) == [
+        (dict(sequence_id=i), dict(RoutingKey='key', Priority='5'))
+        for i in range(3)]
+
+
+def test_batched_notifier_publishes_on_close(exchange, queue):
+    notifier = notify.BatchedRabbitMQEventNotifier(
+        kombu.Connection('memory://'), 'key', exchange, interval=60)
+    notifier.send(UserEvent(dict(sequence_id=1), 7))
+    notifier.close()
+
+    assert received(queue) == [
+        (dict(sequence_id=1), dict(RoutingKey='key', Priority='7'))]
+
+
+def test_batched_notifier_hands_over_unpublished_events(monkeypatch,
+                                                        exchange, queue):
+    connection = kombu.Connection('memory://')
+    error = connection.connection_errors[0]
+
+    class BrokenProducer(notify.Producer):
+        def publish(self, *args, **kwargs):
+            raise error('connection lost')
+
+    monkeypatch.setattr(notify, 'Producer', BrokenProducer)
+    failed = []
+    notifier = notify.BatchedRabbitMQEventNotifier(
+        connection, 'key', exchange, interval=5,
+        on_failure=lambda events, exc: failed.append((events, exc)))
+    events = [UserEvent(dict(sequence_id=i), 5) for i in range(2)]
+    try:
+        for event in events:
+            notifier.send(event)
+        notifier.flush(5)
+    finally:
+        notifier.close()
+
+    assert len(failed) == 1
+    assert failed[0][0] == events
+    assert isinstance(failed[0][1], error)
+    assert received(queue) == []
+
+
+def test_unpublished_events_are_dumped_for_replay(monkeypatch):
+    pytest.importorskip('celery')
+    fakeredis = pytest.importorskip('fakeredis')
+    from core import app
+    from core.dump import RedisDump
+
+    store = RedisDump(fakeredis.FakeStrictRedis(), 'task',
+                      indexed=('name',))
+    monkeypatch.setattr(app, 'task_dump', lambda: store)
+
+    app._dump_unpublished([UserEvent(dict(sequence_id=1), 3)],
+                          IOError('connection lost'))
+
+    page, _ = store.query(name='core.tasks.notify_user_event')
+    assert [(task['args'], task['exception']) for _, task in page] == [
+        ([dict(sequence_id=1), 3], 'connection lost')]
+
+
+def test_async_notifier_sends_from_background_threads(sns):
+    notifier = notify.AsyncEventNotifier(
+        notify.EmailEventNotifier(sns, 'topic', 'subject', 'json'),
+        workers=2)
+    try:
+        futures = [notifier.send(notify.SystemEvent(i, 'time', 'type', 'm'))
+                   for i in range(3)]
+        results = [future.result(5) for future in futures]
+    finally:
+        notifier.close()
+
+    assert len(results) == len(sns.published) == 3
+
+
+def test_async_notifier_future_carries_error(sns):
+    sns.error = IOError('throttled')
+    notifier = notify.AsyncEventNotifier(
+        notify.EmailEventNotifier(sns, 'topic', 'subject', 'json'))
+    try:
+        future = notifier.send(notify.SystemEvent(1, 'time', 'type', 'm'))
+        assert future.exception(5) is sns.error
+    finally:
+        notifier.close()
+
+
+class ConfirmingChannel(object):
+    """
+    Stand-in of AMQP channel whose broker confirms all published messages
+    with one multiple ack, nacking the ones of `nacked` delivery tags.
+    """
+
+    def __init__(self, nacked=()):
+        self.events = collections.defaultdict(set)
+        self.nacked = set(nacked)
+        self.published = []
+        self.selected = self.waits = 0
+
+    def confirm_select(self):
+        self.selected += 1
+
+    def wait(self, methods, timeout=None):
+        self.waits += 1
+        for tag in sorted(self.nacked):
+            for callback in self.events['basic_nack']:
+                callback(tag, False, False)
+        for callback in self.events['basic_ack']:
+            callback(len(self.published), True)
+
+    def close(self):
+        pass
+
+
+class StubConnection(object):
+    connection_errors = (IOError,)
+    channel_errors = ()
+
+    def __init__(self, channel):
+        self._channel = channel
+
+    def ensure_connection(self, max_retries=None):
+        pass
+
+    def channel(self):
+        return self._channel
+
+    def release(self):
+        pass
+
+
+class StubProducer(object):
+    def __init__(self, channel, exchange=None, auto_declare=True):
+        self.channel = channel
+
+    def publish(self, body, **kwargs):
+        self.channel.published.append(body)
+
+
+@pytest.fixture
+def confirming(monkeypatch):
+    monkeypatch.setattr(notify, 'Producer', StubProducer)
+
+    def confirming(channel, **kwargs):
+        failed = []
+        notifier = notify.BatchedRabbitMQEventNotifier(
+            StubConnection(channel), 'key', None, size=3, interval=5,
+            on_failure=lambda events, exc: failed.append((events, exc)),
+            **kwargs)
+        return notifier, failed
+    return confirming
+
+
+def publish_bursts(notifier, bursts, size=3):
+    try:
+        for burst in range(bursts):
+            for i in range(size):
+                notifier.send(UserEvent(dict(sequence_id=(burst, i)), 5))
+            notifier.flush(5)
+    finally:
+        notifier.close()
+
+
+def test_every_burst_waits_for_confirms_once(confirming):
+    channel = ConfirmingChannel()
+    notifier, failed = confirming(channel)
+
+    publish_bursts(notifier, 2)
+
+    assert len(channel.published) == 6
+    assert (channel.selected, channel.waits) == (1, 2)
+    assert failed == []
+
+
+def test_nacked_events_are_handed_over(confirming):
+    channel = ConfirmingChannel(nacked=[2])
+    notifier, failed = confirming(channel)
+
+    publish_bursts(notifier, 1)
+
+    assert len(channel.published) == 3
+    assert [([e.body for e in events], type(exc))
+            for events, exc in failed] == [
+        ([dict(sequence_id=(0, 1))], notify.NotConfirmedError)]
+
+
+def test_confirms_can_be_turned_off(confirming):
+    channel = ConfirmingChannel()
+    notifier, failed = confirming(channel, confirm=False)
+
+    publish_bursts(notifier, 1)
+
+    assert len(channel.published) == 3
+    assert (channel.selected, channel.waits) == (0, 0)
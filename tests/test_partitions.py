@@ -0,0 +1,146 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core.db import partitions
+
+TODAY = datetime.date(2015, 8, 17)
+
+
+class Result(object):
+    def __init__(self, rows=(), rowcount=0):
+        self._rows = list(rows)
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self._rows
+
+    def scalar(self):
+        return self._rows[0][0] if self._rows else None
+
+
+class StubBind(object):
+    """
+    Stand-in of history db connection recording executed statements and
+    replying to the ones starting with keys of `replies`.
+    """
+
+    dialect = postgresql.dialect()
+
+    def __init__(self, **replies):
+        self.replies = dict(replies)
+        self.statements = []
+
+    def execute(self, statement, **params):
+        sql = str(statement.compile(dialect=self.dialect))
+        self.statements.append(sql)
+        for prefix, result in self.replies.items():
+            if sql.startswith(prefix):
+                return result
+        return Result()
+
+    def _run_visitor(self, visitorcallable, element, **kwargs):
+        # `Index.create` of sqlalchemy 1.3
+        visitorcallable(self.dialect, self, **kwargs).traverse_single(element)
+
+    def executed(self, prefix):
+        return [sql for sql in self.statements if sql.startswith(prefix)]
+
+
+def attached(*names):
+    return Result([(name,) for name in names])
+
+
+def test_partition_name_is_the_one_of_month():
+    assert partitions.partition_name(TODAY) == 'historical_data_2015_08'
+
+
+def test_missing_partitions_of_next_months_are_created():
+    bind = StubBind(**{'SELECT c.relname': attached(
+        'historical_data_2015_08', 'historical_data_default')})
+
+    created = partitions.create_partitions(bind, 2, today=TODAY)
+
+    assert created == ['historical_data_2015_09', 'historical_data_2015_10']
+    assert bind.executed('CREATE TABLE') == [
+        "CREATE TABLE historical_data_2015_09 PARTITION OF historical_data "
+        "FOR VALUES FROM ('2015-09-01') TO ('2015-10-01')",
+        "CREATE TABLE historical_data_2015_10 PARTITION OF historical_data "
+        "FOR VALUES FROM ('2015-10-01') TO ('2015-11-01')"]
+
+
+def test_partitions_over_year_boundary_are_created():
+    bind = StubBind()
+
+    created = partitions.create_partitions(
+        bind, 1, today=datetime.date(2015, 12, 31))
+
+    assert created == ['historical_data_2015_12', 'historical_data_2016_01']
+
+
+@pytest.mark.parametrize('drop', [False, True])
+def test_partitions_older_than_kept_months_are_detached(drop):
+    bind = StubBind(**{'SELECT c.relname': attached(
+        'historical_data_2014_07', 'historical_data_2014_08',
+        'historical_data_2015_08')})
+
+    detached = partitions.detach_partitions(bind, 12, today=TODAY,
+                                            drop=drop)
+
+    assert detached == ['historical_data_2014_07']
+    assert bind.executed('ALTER TABLE') == [
+        'ALTER TABLE historical_data DETACH PARTITION historical_data_2014_07']
+    assert bind.executed('DROP TABLE') == (
+        ['DROP TABLE historical_data_2014_07'] if drop else [])
+
+
+def test_partitioned_table_is_not_migrated():
+    bind = StubBind(**{'SELECT relkind': Result([('p',)])})
+
+    assert partitions.migrate(bind, today=TODAY) is None
+    assert len(bind.statements) == 1
+
+
+def test_rows_are_moved_to_partitions_of_all_their_days():
+    bind = StubBind(**{
+        'SELECT relkind': Result([('r',)]),
+        'SELECT min(day)': Result([(datetime.date(2015, 6, 3),)]),
+        'INSERT INTO': Result(rowcount=42)})
+
+    assert partitions.migrate(bind, 1, today=TODAY) == 42
+
+    statements = [sql.split(' (')[0].split(' WHERE')[0]
+                  for sql in bind.statements
+                  if not sql.startswith('SELECT')]
+    assert statements == [
+        'ALTER TABLE historical_data ADD COLUMN IF NOT EXISTS day date',
+        'UPDATE historical_data SET day = coalesce(datetime, now() AT '
+        "TIME ZONE 'utc')::date",
+        'DELETE FROM historical_data h USING historical_data d',
+        'DROP INDEX IF EXISTS historical_data_daily_key',
+        'ALTER TABLE historical_data RENAME TO historical_data_unpartitioned',
+        'ALTER TABLE historical_data_unpartitioned RENAME CONSTRAINT '
+        'historical_data_pkey TO historical_data_unpartitioned_pkey',
+        'CREATE TABLE historical_data',
+        'ALTER TABLE historical_data ADD CONSTRAINT historical_data_pkey '
+        'PRIMARY KEY',
+        'ALTER TABLE historical_data ADD CONSTRAINT "event_type_FK" '
+        'FOREIGN KEY',
+        'ALTER SEQUENCE historical_data_historical_data_id_seq OWNED BY '
+        'historical_data.historical_data_id',
+        'CREATE TABLE historical_data_2015_06 PARTITION OF historical_data '
+        'FOR VALUES FROM',
+        'CREATE TABLE historical_data_2015_07 PARTITION OF historical_data '
+        'FOR VALUES FROM',
+        'CREATE TABLE historical_data_2015_08 PARTITION OF historical_data '
+        'FOR VALUES FROM',
+        'CREATE TABLE historical_data_2015_09 PARTITION OF historical_data '
+        'FOR VALUES FROM',
+        'INSERT INTO historical_data SELECT * FROM '
+        'historical_data_unpartitioned',
+        'CREATE UNIQUE INDEX historical_data_daily_key ON historical_data']
@@ -0,0 +1,140 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+import sqlalchemy
+
+pytest.importorskip('celery')
+
+from core import db  # noqa
+from core.metrics import NullSink  # noqa
+from core.metrics import MemorySink  # noqa
+from core.processing import base  # noqa
+from core.processing import ProcessingRequest  # noqa
+
+TAGS = (('device_type', 1), ('event_type', 'activities'))
+
+
+class VendorError(Exception):
+    pass
+
+
+class StubProcessing(base.BaseProcessing):
+    """
+    Processing whose API call runs `statements` on auth session and fails
+    with `error` if it's set.
+    """
+    statements = 2
+    error = None
+
+    def _call_api(self):
+        for _ in range(self.statements):
+            self._auth_session.execute('SELECT 1')
+        if self.error is not None:
+            raise self.error
+        return dict(steps=1000)
+
+
+class StubWriter(object):
+    def __init__(self, created=True):
+        self.records = []
+        self.created = created
+
+    def write(self, record):
+        self.records.append(record)
+        return self.created
+
+
+class StrictNullSink(NullSink):
+    def timing(self, name, seconds, tags=None):
+        raise AssertionError('{} is timed by disabled sink'.format(name))
+
+    def incr(self, name, value=1, tags=None):
+        raise AssertionError('{} is counted by disabled sink'.format(name))
+
+
+class StubNotifier(object):
+    def __init__(self):
+        self.events = []
+
+    def send(self, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    sink = MemorySink()
+    monkeypatch.setattr(base, 'metrics_sink', lambda: sink)
+    return sink
+
+
+@pytest.fixture
+def notifier(monkeypatch):
+    notifier = StubNotifier()
+    monkeypatch.setattr(base, 'user_event_notifier', lambda: notifier)
+    return notifier
+
+
+@pytest.fixture
+def processing():
+    engine = db.instrument_engine(sqlalchemy.create_engine('sqlite://'))
+    return StubProcessing(ProcessingRequest('user', 'seq', 1, 'activities'),
+                          db.create_session(engine)(), None, StubWriter())
+
+
+def test_stages_are_timed_by_device_and_event_type(sink, notifier,
+                                                   processing):
+    processing.process()
+
+    assert len(processing._history_writer.records) == 1
+    assert len(notifier.events) == 1
+    for stage in ('api', 'save', 'notify', 'total', 'db'):
+        assert len(sink.timings[('processing.' + stage, TAGS)]) == 1, stage
+    assert sink.timings[('processing.db', TAGS)][0] <= \
+        sink.timings[('processing.total', TAGS)][0]
+    assert sink.counters == {('processing.db.queries', TAGS): 2}
+
+
+def test_errors_are_counted_by_type(sink, notifier, processing):
+    processing.error = VendorError('timeout')
+
+    with pytest.raises(VendorError):
+        processing.process()
+
+    assert sink.counters[('processing.errors', (
+        ('device_type', 1), ('error', 'VendorError'),
+        ('event_type', 'activities')))] == 1
+    assert len(sink.timings[('processing.total', TAGS)]) == 1
+    assert ('processing.notify', TAGS) not in sink.timings
+    assert notifier.events == []
+
+
+def test_nothing_is_recorded_by_disabled_sink(monkeypatch, notifier,
+                                              processing):
+    monkeypatch.setattr(base, 'metrics_sink', lambda: StrictNullSink())
+
+    processing.process()
+
+    assert len(notifier.events) == 1
+
+
+@pytest.mark.parametrize('created', [True, False])
+def test_moves_final_collection_is_scheduled_by_first_record_of_day(
+        monkeypatch, notifier, created):
+    pytest.importorskip('moves')
+    from core import app
+    from core.processing.moves import MovesProcessing
+
+    sent = []
+    monkeypatch.setattr(MovesProcessing, '_call_api', lambda self: {})
+    monkeypatch.setattr(app.app, 'send_task',
+                        lambda name, **options: sent.append(options))
+    request = ProcessingRequest('user', 'seq', 6, 'activities')
+    processing = MovesProcessing(request, None, None, StubWriter(created))
+
+    processing.process()
+
+    assert len(notifier.events) == 1
+    assert [options['kwargs']['seq_id'] for options in sent] == \
+        (['seq'] if created else [])
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+from core import db
+
+
+def create_db(path, name):
+    """
+    Creates SQLite auth db with single connection, whose access token is
+    `name` of the db, so reads tell which db served them.
+    """
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(path),
+                                      poolclass=QueuePool)
+    db.AuthModel.metadata.create_all(engine)
+    session = db.create_session(engine)()
+    session.add(db.UserConnection('user', 'token', 'secret', name, 'secret'))
+    session.commit()
+    session.close()
+    return engine
+
+
+@pytest.fixture
+def engines(tmpdir):
+    return dict((name, create_db(str(tmpdir.join(name + '.db')), name))
+                for name in ('primary', 'replica1', 'replica2'))
+
+
+def create_factory(engines, strategy='round_robin', sticky=60):
+    replicas = db.ReplicaSet([engines['replica1'], engines['replica2']],
+                             strategy)
+    return db.create_routing_session(engines['primary'], replicas, sticky)
+
+
+def served_by(session):
+    return session.query(db.UserConnection.access_token).scalar()
+
+
+def test_reads_go_to_replicas_in_turn_per_transaction(engines):
+    session = create_factory(engines)()
+
+    served = []
+    for _ in range(3):
+        served.append((served_by(session), served_by(session)))
+        session.commit()
+
+    assert served == [('replica1', 'replica1'), ('replica2', 'replica2'),
+                      ('replica1', 'replica1')]
+
+
+def test_writes_and_following_reads_go_to_primary(engines):
+    session = create_factory(engines)()
+    connection = session.query(db.UserConnection).one()
+    assert connection.access_token == 'replica1'
+
+    connection.oauth_token = 'refreshed'
+    session.commit()
+
+    assert served_by(session) == 'primary'
+    assert engines['primary'].execute(sqlalchemy.select(
+        [db.UserConnection.oauth_token])).scalar() == 'refreshed'
+
+
+def test_reads_return_to_replicas_after_sticky_period(engines):
+    session = create_factory(engines, sticky=0)()
+    session.add(db.UserConnection('other', 'token', 'secret', 'new', 's'))
+    session.commit()
+
+    assert served_by(session) == 'replica1'
+
+
+def test_locking_reads_go_to_primary(engines):
+    session = create_factory(engines)()
+
+    assert session.query(db.UserConnection.access_token) \
+        .with_for_update().scalar() == 'primary'
+
+
+def test_expire_all_chooses_replica_anew(engines):
+    session = create_factory(engines)()
+    assert served_by(session) == 'replica1'
+
+    session.expire_all()
+
+    assert served_by(session) == 'replica2'
+
+
+def test_removed_scoped_session_chooses_replica_anew(engines):
+    factory = create_factory(engines)
+    assert served_by(factory()) == 'replica1'
+
+    # what `core.signals.release_sessions` does after every task
+    factory.remove()
+
+    assert served_by(factory()) == 'replica2'
+
+
+def test_least_loaded_skips_busy_replica(engines):
+    session = create_factory(engines, strategy='least_loaded')()
+    busy = engines['replica1'].connect()
+    served = set()
+    try:
+        for _ in range(5):
+            served.add(served_by(session))
+            session.commit()
+    finally:
+        busy.close()
+
+    assert served == {'replica2'}
+
+
+def test_reads_go_to_primary_without_replicas(engines):
+    session = db.create_routing_session(engines['primary'],
+                                        db.ReplicaSet([]))()
+
+    assert served_by(session) == 'primary'
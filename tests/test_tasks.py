@@ -0,0 +1,227 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pytest
+import contextlib
+from concurrent.futures import Future
+
+pytest.importorskip('celery')
+fakeredis = pytest.importorskip('fakeredis')
+
+from core import tasks  # noqa
+from core import replay  # noqa
+from core import signals  # noqa
+from core.coalesce import CoalesceConfig  # noqa
+from core.coalesce import EventCoalescer  # noqa
+from core.alerts import AlertAggregator  # noqa
+from core.dump import RedisDump  # noqa
+from core.metrics import MemorySink  # noqa
+from core.ratelimit import RateLimitRegistry  # noqa
+from core.notify import SystemEvent  # noqa
+from core.notify import EmailEventNotifier  # noqa
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def dumps(monkeypatch, redis):
+    task_dump = RedisDump(redis, 'task', indexed=('name',))
+    notify_dump = RedisDump(redis, 'notification')
+    monkeypatch.setattr(tasks, 'task_dump', lambda: task_dump)
+    monkeypatch.setattr(signals, 'task_dump', lambda: task_dump)
+    monkeypatch.setattr(tasks, 'notify_dump', lambda: notify_dump)
+    return task_dump, notify_dump
+
+
+@pytest.fixture
+def aggregator(monkeypatch, redis):
+    aggregator = AlertAggregator(redis, window=60)
+    monkeypatch.setattr(tasks, 'alert_aggregator', lambda: aggregator)
+    return aggregator
+
+
+@pytest.fixture
+def notifier(monkeypatch, sns):
+    notifier = EmailEventNotifier(sns, 'topic', 'subject', 'json')
+    monkeypatch.setattr(tasks, 'system_event_notifier', lambda: notifier)
+    return notifier
+
+
+def dumped(dump, **query):
+    return [obj for _, obj in dump.query(**query)[0]]
+
+
+def test_notify_digest_sends_digest_once(dumps, aggregator, notifier, sns):
+    for i in range(3):
+        aggregator.add(SystemEvent(i, 'time', 'ProcessingError',
+                                   'Timeout of user {}'.format(i)))
+
+    tasks.notify_digest.apply(('ProcessingError', 'Timeout of user 0'))
+    tasks.notify_digest.apply(('ProcessingError', 'Timeout of user 0'))
+
+    assert len(sns.published) == 1
+    events = dumped(dumps[1])
+    assert len(events) == 1
+    assert events[0]['message'].startswith('3 event(s) from time to time')
+
+
+def test_notify_digest_retries_digest_taken_from_redis(dumps, aggregator,
+                                                       notifier, sns):
+    aggregator.add(SystemEvent(1, 'time', 'ProcessingError', 'Timeout'))
+    sns.error = IOError('throttled')
+
+    result = tasks.notify_digest.apply(('ProcessingError', 'Timeout'))
+
+    assert result.failed()
+    # the first attempt and `max_retries` retries of the same message
+    assert len(sns.published) == 4
+    assert len(set(p['Message'] for p in sns.published)) == 1
+
+
+def test_failed_async_send_is_dumped_as_failed_task(dumps):
+    event = SystemEvent('id', 'time', 'ProcessingError', 'Timeout')
+    future = Future()
+    future.set_exception(IOError('throttled'))
+
+    tasks._system_event_sent(tasks.notify_digest, event,
+                             ('ProcessingError', 'Timeout'),
+                             dict(event=event._asdict()), future)
+
+    failed = dumped(dumps[0], name='core.tasks.notify_digest')
+    assert [(t['args'], t['kwargs'], t['exception']) for t in failed] == [
+        (['ProcessingError', 'Timeout'], dict(event=event._asdict()),
+         'throttled')]
+    assert dumped(dumps[1]) == []
+
+
+def test_throttled_event_is_postponed_and_counted(monkeypatch, redis):
+    limits = RateLimitRegistry(redis)
+    limits.delay(1, 'user', 30)
+    sink = MemorySink()
+    postponed = []
+    monkeypatch.setattr(tasks, 'rate_limits', lambda: limits)
+    monkeypatch.setattr(tasks, 'metrics_sink', lambda: sink)
+    monkeypatch.setattr(tasks.process_event, 'apply_async',
+                        lambda **kwargs: postponed.append(kwargs))
+
+    tasks.process_event.apply(kwargs=dict(
+        user_id='user', seq_id='seq', device_type=1,
+        event_type='activities'))
+
+    assert len(postponed) == 1
+    assert 0 < postponed[0]['countdown'] <= 30
+    assert sink.counters == {('process_event.delayed', (
+        ('device_type', 1), ('event_type', 'activities'))): 1}
+
+
+class VendorError(Exception):
+    pass
+
+
+class StubCelery(object):
+    """
+    Stand-in of celery app recording tasks sent by `core.replay`.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    @contextlib.contextmanager
+    def producer_or_acquire(self):
+        yield None
+
+    def send_task(self, name, args=None, kwargs=None, producer=None):
+        self.sent.append((name, args, kwargs))
+
+
+@pytest.fixture
+def coalescer(monkeypatch, redis):
+    coalescer = EventCoalescer(redis, window=60)
+    monkeypatch.setattr(tasks, 'event_coalescer', lambda: coalescer)
+    monkeypatch.setattr(type(tasks.config), 'coalesce',
+                        property(lambda self: CoalesceConfig(60)))
+    monkeypatch.setattr(tasks, 'rate_limits',
+                        lambda: RateLimitRegistry(redis))
+    return coalescer
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    sink = MemorySink()
+    monkeypatch.setattr(tasks, 'metrics_sink', lambda: sink)
+    return sink
+
+
+@pytest.fixture
+def postponed(monkeypatch):
+    postponed = []
+    monkeypatch.setattr(tasks.process_event, 'apply_async',
+                        lambda **kwargs: postponed.append(kwargs))
+    return postponed
+
+
+def event_kwargs(seq_id, **kwargs):
+    return dict(dict(user_id='user', seq_id=seq_id, device_type=1,
+                     event_type='activities', processing_timestamp=None),
+                **kwargs)
+
+
+def test_burst_is_coalesced_into_single_pending_task(coalescer, sink,
+                                                     postponed):
+    for seq_id in ('seq-1', 'seq-2', 'seq-3'):
+        tasks.process_event.apply(kwargs=event_kwargs(seq_id))
+
+    assert postponed == [dict(kwargs=event_kwargs('seq-1', pending=True),
+                              countdown=60)]
+    assert sink.counters == {('process_event.coalesced', (
+        ('device_type', 1), ('event_type', 'activities'))): 2}
+
+
+def test_pending_task_dispatches_the_latest_event(coalescer, postponed):
+    coalescer.offer('user', 1, 'activities', 'seq-1')
+    coalescer.offer('user', 1, 'activities', 'seq-2', '2015-08-01T00:00:00')
+
+    tasks.process_event.apply(kwargs=event_kwargs('seq-1', pending=True))
+    tasks.process_event.apply(kwargs=event_kwargs('seq-1', pending=True))
+
+    assert postponed == [dict(kwargs=event_kwargs(
+        'seq-2', processing_timestamp='2015-08-01T00:00:00',
+        debounce=False))]
+    assert coalescer.merged() == {'1:activities': 1}
+
+
+def test_taken_event_is_dumped_if_it_cannot_be_dispatched(monkeypatch,
+                                                          coalescer, dumps):
+    def apply_async(**kwargs):
+        raise IOError('broker is down')
+
+    monkeypatch.setattr(tasks.process_event, 'apply_async', apply_async)
+    coalescer.offer('user', 1, 'activities', 'seq-1')
+
+    tasks.process_event.apply(kwargs=event_kwargs('seq-1', pending=True))
+
+    assert [t['kwargs'] for t in dumped(dumps[0])] == [
+        event_kwargs('seq-1', debounce=False)]
+
+
+def test_failed_taken_event_is_replayed(monkeypatch, coalescer, dumps,
+                                        postponed):
+    def create_processing(request):
+        raise VendorError('timeout')
+
+    monkeypatch.setattr(tasks, 'create_processing', create_processing)
+    coalescer.offer('user', 1, 'activities', 'seq-1')
+    coalescer.offer('user', 1, 'activities', 'seq-2')
+    tasks.process_event.apply(kwargs=event_kwargs('seq-1', pending=True))
+
+    # broker delivers the dispatched event, its processing fails
+    assert not tasks.process_event.apply(**postponed.pop()).successful()
+    celery = StubCelery()
+    assert replay.replay(dumps[0], celery) == 1
+
+    assert celery.sent == [('core.tasks.process_event', [],
+                            event_kwargs('seq-2', debounce=False))]